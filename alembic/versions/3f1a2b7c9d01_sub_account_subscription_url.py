@@ -0,0 +1,27 @@
+"""sub_accounts.subscription_url
+
+Revision ID: 3f1a2b7c9d01
+Revises:
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3f1a2b7c9d01"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# اولین نسخه: جداول پایه را install.sh (یک‌بار با create_all) ساخته است و این زنجیره فقط تغییرات بعد از آن را اعمال می‌کند.
+# هر نسخه بی‌خطر تکرارپذیر است، چون نصب‌های تازه‌تر بخشی از این تغییرات را از قبل با create_all دارند.
+def upgrade() -> None:
+    op.execute("ALTER TABLE sub_accounts ADD COLUMN IF NOT EXISTS subscription_url TEXT")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE sub_accounts DROP COLUMN IF EXISTS subscription_url")
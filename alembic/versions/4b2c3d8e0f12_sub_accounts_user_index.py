@@ -0,0 +1,30 @@
+"""sub_accounts.guardino_user_id index
+
+Revision ID: 4b2c3d8e0f12
+Revises: 3f1a2b7c9d01
+Create Date: 2026-10-17 09:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "4b2c3d8e0f12"
+down_revision: Union[str, None] = "3f1a2b7c9d01"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_sub_accounts_guardino_user_id", "sub_accounts", ["guardino_user_id"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_sub_accounts_guardino_user_id", table_name="sub_accounts", postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,42 @@
+"""delta usage accounting columns
+
+Revision ID: 5c3d4e9f1a23
+Revises: 4b2c3d8e0f12
+Create Date: 2026-10-17 09:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5c3d4e9f1a23"
+down_revision: Union[str, None] = "4b2c3d8e0f12"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _columns(table: str) -> set:
+    return {c["name"] for c in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade() -> None:
+    # مقداردهی اولیه فقط وقتی که ستون همین حالا اضافه شده باشد؛ در نصب‌های جدیدتر ستون‌ها مقدار واقعی دارند
+    if "last_raw_traffic" not in _columns("sub_accounts"):
+        op.add_column("sub_accounts", sa.Column("last_raw_traffic", sa.BigInteger(), nullable=False, server_default="0"))
+        # تا این نسخه used_traffic همان شمارنده خام پنل بود؛ مبنای دلتا همان می‌شود تا اولین سینک مصرف را دوباره نشمارد
+        op.execute("UPDATE sub_accounts SET last_raw_traffic = COALESCE(used_traffic, 0)")
+
+    if "used_traffic" not in _columns("guardino_users"):
+        op.add_column("guardino_users", sa.Column("used_traffic", sa.BigInteger(), nullable=False, server_default="0"))
+        op.execute(
+            "UPDATE guardino_users u SET used_traffic = COALESCE("
+            "(SELECT SUM(s.used_traffic) FROM sub_accounts s WHERE s.guardino_user_id = u.id), 0)"
+        )
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE guardino_users DROP COLUMN IF EXISTS used_traffic")
+    op.execute("ALTER TABLE sub_accounts DROP COLUMN IF EXISTS last_raw_traffic")
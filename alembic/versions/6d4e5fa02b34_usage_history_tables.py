@@ -0,0 +1,58 @@
+"""usage history tables
+
+Revision ID: 6d4e5fa02b34
+Revises: 5c3d4e9f1a23
+Create Date: 2026-10-17 09:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "6d4e5fa02b34"
+down_revision: Union[str, None] = "5c3d4e9f1a23"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# SQLAlchemy نام اعضای Enum را ذخیره می‌کند (HOUR/DAY)، نه مقدارشان را
+usage_granularity = postgresql.ENUM("HOUR", "DAY", name="usagegranularity", create_type=False)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    usage_granularity.create(bind, checkfirst=True)
+
+    if not inspector.has_table("usage_samples"):
+        op.create_table(
+            "usage_samples",
+            sa.Column("guardino_user_id", sa.Integer(), sa.ForeignKey("guardino_users.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("bucket", sa.DateTime(), nullable=False),
+            sa.Column("reseller_id", sa.Integer(), nullable=False),
+            sa.Column("bytes", sa.BigInteger(), nullable=False),
+            sa.PrimaryKeyConstraint("guardino_user_id", "bucket"),
+        )
+    op.create_index("ix_usage_samples_bucket", "usage_samples", ["bucket"], if_not_exists=True)
+
+    if not inspector.has_table("usage_rollups"):
+        op.create_table(
+            "usage_rollups",
+            sa.Column("granularity", usage_granularity, nullable=False),
+            sa.Column("guardino_user_id", sa.Integer(), sa.ForeignKey("guardino_users.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("bucket", sa.DateTime(), nullable=False),
+            sa.Column("reseller_id", sa.Integer(), nullable=False),
+            sa.Column("bytes", sa.BigInteger(), nullable=False),
+            sa.PrimaryKeyConstraint("granularity", "guardino_user_id", "bucket"),
+        )
+    op.create_index("ix_usage_rollups_reseller", "usage_rollups", ["reseller_id", "granularity", "bucket"], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS usage_rollups")
+    op.execute("DROP TABLE IF EXISTS usage_samples")
+    usage_granularity.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,30 @@
+"""guardino_users status/expire_date index
+
+Revision ID: 7e5f6ab13c45
+Revises: 6d4e5fa02b34
+Create Date: 2026-10-17 09:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "7e5f6ab13c45"
+down_revision: Union[str, None] = "6d4e5fa02b34"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_guardino_users_status_expire", "guardino_users", ["status", "expire_date"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_guardino_users_status_expire", table_name="guardino_users", postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,35 @@
+"""adaptive sync schedule columns
+
+Revision ID: 8f6a7bc24d56
+Revises: 7e5f6ab13c45
+Create Date: 2026-10-17 09:50:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8f6a7bc24d56"
+down_revision: Union[str, None] = "7e5f6ab13c45"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # next_sync_at خالی یعنی «همین حالا»؛ پس کاربران موجود در اولین دور سینک برداشته می‌شوند
+    op.execute("ALTER TABLE guardino_users ADD COLUMN IF NOT EXISTS last_synced_at TIMESTAMP WITHOUT TIME ZONE")
+    op.execute("ALTER TABLE guardino_users ADD COLUMN IF NOT EXISTS next_sync_at TIMESTAMP WITHOUT TIME ZONE")
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_guardino_users_status_next_sync", "guardino_users", ["status", "next_sync_at"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_guardino_users_status_next_sync", table_name="guardino_users", postgresql_concurrently=True, if_exists=True)
+    op.execute("ALTER TABLE guardino_users DROP COLUMN IF EXISTS next_sync_at")
+    op.execute("ALTER TABLE guardino_users DROP COLUMN IF EXISTS last_synced_at")
@@ -0,0 +1,27 @@
+"""panel webhook columns
+
+Revision ID: 9a7b8cd35e67
+Revises: 8f6a7bc24d56
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9a7b8cd35e67"
+down_revision: Union[str, None] = "8f6a7bc24d56"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE nodes ADD COLUMN IF NOT EXISTS webhook_secret VARCHAR(128)")
+    op.execute("ALTER TABLE sub_accounts ADD COLUMN IF NOT EXISTS last_event_at TIMESTAMP WITHOUT TIME ZONE")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE sub_accounts DROP COLUMN IF EXISTS last_event_at")
+    op.execute("ALTER TABLE nodes DROP COLUMN IF EXISTS webhook_secret")
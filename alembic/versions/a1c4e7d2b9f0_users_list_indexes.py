@@ -0,0 +1,47 @@
+"""users list keyset pagination indexes
+
+Revision ID: a1c4e7d2b9f0
+Revises: bc9daef57a89
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a1c4e7d2b9f0"
+down_revision: Union[str, None] = "bc9daef57a89"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# جدول guardino_users روی سرورهای فعلی بزرگ است؛ ایندکس‌ها CONCURRENTLY (خارج از تراکنش) ساخته می‌شوند
+# تا ساخت و ثبت کاربر حین مهاجرت قفل نشود. IF NOT EXISTS اجرای دوباره روی دیتابیس‌هایی را که
+# جداول را از روی مدل‌ها ساخته‌اند بی‌خطر می‌کند.
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_guardino_users_reseller_created", "guardino_users",
+            ["reseller_id", "created_at", "id"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.create_index(
+            "ix_guardino_users_reseller_status_created", "guardino_users",
+            ["reseller_id", "status", "created_at", "id"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.create_index(
+            "ix_guardino_users_reseller_username", "guardino_users",
+            ["reseller_id", "username"],
+            postgresql_ops={"username": "varchar_pattern_ops"},
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_guardino_users_reseller_username", table_name="guardino_users", postgresql_concurrently=True, if_exists=True)
+        op.drop_index("ix_guardino_users_reseller_status_created", table_name="guardino_users", postgresql_concurrently=True, if_exists=True)
+        op.drop_index("ix_guardino_users_reseller_created", table_name="guardino_users", postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,58 @@
+"""node command outbox
+
+Revision ID: ab8c9de46f78
+Revises: 9a7b8cd35e67
+Create Date: 2026-10-17 10:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "ab8c9de46f78"
+down_revision: Union[str, None] = "9a7b8cd35e67"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+node_command_action = postgresql.ENUM("CREATE", "MODIFY", "SUSPEND", "DELETE", name="nodecommandaction", create_type=False)
+node_command_status = postgresql.ENUM("PENDING", "DONE", "FAILED", "CANCELLED", name="nodecommandstatus", create_type=False)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    node_command_action.create(bind, checkfirst=True)
+    node_command_status.create(bind, checkfirst=True)
+    # نصب‌هایی که جدول را پیش از اضافه شدن CANCELLED ساخته‌اند؛ ADD VALUE داخل تراکنش اجرا نمی‌شود
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE nodecommandstatus ADD VALUE IF NOT EXISTS 'CANCELLED'")
+
+    if not sa.inspect(bind).has_table("node_commands"):
+        op.create_table(
+            "node_commands",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("node_id", sa.Integer(), sa.ForeignKey("nodes.id"), nullable=False),
+            sa.Column("action", node_command_action, nullable=False),
+            sa.Column("remote_identifier", sa.String(255), nullable=False),
+            sa.Column("payload", sa.JSON(), nullable=True),
+            sa.Column("status", node_command_status, nullable=False),
+            sa.Column("attempts", sa.Integer(), nullable=False),
+            sa.Column("next_attempt_at", sa.DateTime(), nullable=False),
+            sa.Column("last_error", sa.Text(), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+            sa.Column("completed_at", sa.DateTime(), nullable=True),
+        )
+    op.create_index("ix_node_commands_id", "node_commands", ["id"], if_not_exists=True)
+    op.create_index("ix_node_commands_status_next_attempt", "node_commands", ["status", "next_attempt_at"], if_not_exists=True)
+    op.create_index("ix_node_commands_target", "node_commands", ["node_id", "remote_identifier", "status"], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS node_commands")
+    bind = op.get_bind()
+    node_command_status.drop(bind, checkfirst=True)
+    node_command_action.drop(bind, checkfirst=True)
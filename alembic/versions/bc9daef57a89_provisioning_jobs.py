@@ -0,0 +1,54 @@
+"""provisioning jobs
+
+Revision ID: bc9daef57a89
+Revises: ab8c9de46f78
+Create Date: 2026-10-17 10:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "bc9daef57a89"
+down_revision: Union[str, None] = "ab8c9de46f78"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+provisioning_job_status = postgresql.ENUM(
+    "PENDING", "RUNNING", "SUCCEEDED", "FAILED", name="provisioningjobstatus", create_type=False
+)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    provisioning_job_status.create(bind, checkfirst=True)
+
+    if not sa.inspect(bind).has_table("provisioning_jobs"):
+        op.create_table(
+            "provisioning_jobs",
+            sa.Column("id", sa.String(32), primary_key=True),
+            sa.Column("reseller_id", sa.Integer(), sa.ForeignKey("resellers.id"), nullable=False),
+            sa.Column("guardino_user_id", sa.Integer(), sa.ForeignKey("guardino_users.id", ondelete="SET NULL"), nullable=True),
+            sa.Column("username", sa.String(100), nullable=False),
+            sa.Column("status", provisioning_job_status, nullable=False),
+            sa.Column("total_cost", sa.Integer(), nullable=False),
+            sa.Column("payload", sa.JSON(), nullable=False),
+            sa.Column("node_results", sa.JSON(), nullable=False),
+            sa.Column("error", sa.Text(), nullable=True),
+            sa.Column("attempts", sa.Integer(), nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+            sa.Column("started_at", sa.DateTime(), nullable=True),
+            sa.Column("finished_at", sa.DateTime(), nullable=True),
+        )
+    op.create_index("ix_provisioning_jobs_reseller_id", "provisioning_jobs", ["reseller_id"], if_not_exists=True)
+    op.create_index("ix_provisioning_jobs_status_created", "provisioning_jobs", ["status", "created_at"], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS provisioning_jobs")
+    provisioning_job_status.drop(op.get_bind(), checkfirst=True)
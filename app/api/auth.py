@@ -1,34 +1,59 @@
 # app/api/auth.py
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 from app.core.database import get_db
-from app.core.security import verify_password, create_access_token
+from app.core.config import settings
+from app.core.security import verify_password_async, create_access_token
+from app.core import rate_limit
 from app.models import Reseller
 
 router = APIRouter(prefix="/api/v1/auth", tags=["Authentication"])
 
+def _too_many_attempts(retry_after: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="تعداد تلاش‌های ورود بیش از حد مجاز است. لطفاً کمی بعد دوباره تلاش کنید.",
+        headers={"Retry-After": str(retry_after)},
+    )
+
 @router.post("/login")
 async def login_access_token(
+    request: Request,
     db: AsyncSession = Depends(get_db),
     form_data: OAuth2PasswordRequestForm = Depends()
 ):
     """
     دریافت نام کاربری و رمز عبور و بازگرداندن توکن JWT
     """
+    # محدودیت نرخ قبل از هر کار سنگین (کوئری و bcrypt): سقف تلاش هر IP و سقف رمز اشتباه هر نام کاربری از هر IP.
+    # شمارنده رمز اشتباه به (نام کاربری، IP) گره خورده تا کسی نتواند با چند رمز اشتباه، صاحب حساب (حتی ادمین کل) را قفل کند
+    client_ip = request.client.host if request.client else "unknown"
+    allowed, retry_after = await rate_limit.hit(f"guardino:login:ip:{client_ip}", settings.LOGIN_IP_LIMIT, settings.LOGIN_IP_WINDOW)
+    if not allowed:
+        raise _too_many_attempts(retry_after)
+    user_key = f"guardino:login:user:{form_data.username.lower()}:{client_ip}"
+    failures, retry_after = await rate_limit.count(user_key, settings.LOGIN_USER_WINDOW)
+    if failures >= settings.LOGIN_USER_FAILURE_LIMIT:
+        raise _too_many_attempts(retry_after)
+
     # جستجوی نماینده
     query = await db.execute(select(Reseller).where(Reseller.username == form_data.username))
     reseller = query.scalar_one_or_none()
     
-    # بررسی صحت نماینده و رمز عبور
-    if not reseller or not verify_password(form_data.password, reseller.password_hash):
+    # بررسی صحت نماینده و رمز عبور (bcrypt در استخر رشته‌ای جدا، بدون مسدود کردن حلقه رویداد)
+    if not reseller or not await verify_password_async(form_data.password, reseller.password_hash):
+        await rate_limit.record(user_key, settings.LOGIN_USER_WINDOW)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="نام کاربری یا رمز عبور اشتباه است.",
         )
         
+    # ورود موفق، رمزهای اشتباه قبلی همین IP را پاک می‌کند
+    await rate_limit.clear(user_key)
+
     if reseller.status == "suspended":
         raise HTTPException(status_code=403, detail="اکانت شما مسدود شده است.")
 
@@ -1,6 +1,8 @@
 # app/api/deps.py
+import math
+from typing import Optional
 from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
+from fastapi.security import OAuth2PasswordBearer, APIKeyHeader
 from jose import jwt, JWTError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
@@ -8,14 +10,51 @@ from sqlalchemy import select
 from app.core.config import settings
 from app.core.database import get_db
 from app.core.security import ALGORITHM
+from app.core.principal_cache import get_principal, put_principal
+from app.core.api_keys import hash_api_key, rate_limit_key, record_api_key_usage
+from app.core import rate_limit
 from app.models import Reseller
 
 # این آدرس API لاگین ما خواهد بود
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
+# auto_error خاموش است تا ربات‌ها بتوانند به‌جای JWT فقط با هدر X-API-Key احراز هویت شوند
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login", auto_error=False)
+api_key_scheme = APIKeyHeader(name="X-API-Key", auto_error=False)
+
+async def _reseller_from_api_key(db: AsyncSession, api_key: str) -> Reseller:
+    """
+    احراز هویت ربات نماینده با کلید API: جستجوی هش کلید روی ستون یکتای api_key،
+    کش در حافظه پروسه (ابطال کلید از طریق Pub/Sub همان کش نمایندگان) و محدودیت نرخ به‌ازای هر کلید.
+    """
+    key_hash = hash_api_key(api_key)
+
+    # سقف درخواست هر کلید؛ درخواست‌های ردشده شمرده نمی‌شوند تا رباتی که از سقف گذشته با ادامه تلاش، همیشه پشت 429 نماند.
+    # (هر کلید ساختگی سطل جدای خودش را دارد، پس این محدودیت جلوی حدس زدن کلید را نمی‌گیرد؛ جستجوی هر کلید
+    # ناموجود فقط یک کوئری روی ایندکس یکتای api_key است)
+    allowed, retry_after = await rate_limit.acquire(rate_limit_key(key_hash), settings.API_KEY_RATE_LIMIT, settings.API_KEY_RATE_WINDOW)
+    if not allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="تعداد درخواست‌های این کلید API بیش از حد مجاز است.",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    cache_key = f"apikey:{key_hash}"
+    reseller = get_principal(cache_key)
+    if reseller is None:
+        query = await db.execute(select(Reseller).where(Reseller.api_key == key_hash))
+        reseller = query.scalar_one_or_none()
+        if reseller is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="کلید API نامعتبر است.")
+        # کلید تاریخ انقضا ندارد؛ تازگی کش با PRINCIPAL_CACHE_TTL و پیام ابطال تضمین می‌شود
+        put_principal(cache_key, reseller, math.inf)
+
+    await record_api_key_usage(reseller.id)
+    return reseller
 
 async def get_current_reseller(
     db: AsyncSession = Depends(get_db),
-    token: str = Depends(oauth2_scheme)
+    token: Optional[str] = Depends(oauth2_scheme),
+    api_key: Optional[str] = Depends(api_key_scheme)
 ) -> Reseller:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -23,21 +62,34 @@ async def get_current_reseller(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        # رمزگشایی توکن
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
-        reseller_id: str = payload.get("sub")
-        if reseller_id is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-
-    # پیدا کردن نماینده در دیتابیس
-    query = await db.execute(select(Reseller).where(Reseller.id == int(reseller_id)))
-    reseller = query.scalar_one_or_none()
-    
-    if reseller is None:
-        raise credentials_exception
+    if api_key:
+        reseller = await _reseller_from_api_key(db, api_key)
+    elif not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="احراز هویت انجام نشده است.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    else:
+        # اگر همین توکن به‌تازگی اعتبارسنجی شده، نماینده از کش حافظه خوانده می‌شود (بدون کوئری دیتابیس)
+        reseller = get_principal(token)
+        if reseller is None:
+            try:
+                # رمزگشایی توکن
+                payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
+                reseller_id: str = payload.get("sub")
+                if reseller_id is None:
+                    raise credentials_exception
+            except JWTError:
+                raise credentials_exception
+
+            # پیدا کردن نماینده در دیتابیس
+            query = await db.execute(select(Reseller).where(Reseller.id == int(reseller_id)))
+            reseller = query.scalar_one_or_none()
+            
+            if reseller is None:
+                raise credentials_exception
+            put_principal(token, reseller, payload.get("exp"))
         
     if reseller.status == "suspended":
         raise HTTPException(status_code=403, detail="اکانت شما مسدود شده است.")
@@ -0,0 +1,42 @@
+# app/api/ingest.py
+import hmac
+from fastapi import APIRouter, Depends, HTTPException, Request, Header
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import get_db
+from app.models import Node
+from app.services.usage_ingest import drop_duplicates, collect_events, ingest_node_usage, ingest_status_events
+
+router = APIRouter(prefix="/api/v1/ingest", tags=["Panel Webhooks"])
+
+@router.post("/{node_id}")
+async def ingest_panel_events(
+    node_id: int,
+    request: Request,
+    x_webhook_secret: str | None = Header(None),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    دریافت رخدادهای کاربران (مصرف و وضعیت) از وب‌هوک پنل.
+    مرزبان کلید را در هدر x-webhook-secret و رخدادها را به صورت لیست JSON ارسال می‌کند.
+    """
+    node = await db.get(Node, node_id)
+    if not node or not node.webhook_secret or not x_webhook_secret \
+            or not hmac.compare_digest(node.webhook_secret.encode("utf-8"), x_webhook_secret.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="کلید وب‌هوک نامعتبر است.")
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="بدنه درخواست JSON معتبر نیست.")
+    events = payload if isinstance(payload, list) else [payload]
+    events = [e for e in events if isinstance(e, dict)]
+
+    fresh_events = await drop_duplicates(node_id, events)
+    usage, statuses = collect_events(fresh_events)
+    # مصرف، تغییر وضعیت‌ها، غیرفعال‌سازی کاربران عبورکرده از سهمیه و دستورات مسدودی با یک کامیت ثبت می‌شوند
+    suspended = await ingest_node_usage(db, node_id, usage)
+    suspended += await ingest_status_events(db, node_id, statuses)
+    await db.commit()
+
+    return {"received": len(events), "applied": len(fresh_events), "suspended": suspended}
@@ -7,6 +7,8 @@ from app.core.database import get_db
 from app.models import Node, Reseller, NodeAllocation
 from app.api.deps import get_current_reseller
 from app.schemas.admin import NodeCreate
+from app.services.inbound_cache import invalidate_inbounds
+from app.services.node_health import get_health
 
 router = APIRouter(prefix="/api/v1/nodes", tags=["Nodes & Servers"])
 
@@ -26,7 +28,8 @@ async def add_new_node(
         api_url=node_data.api_url,
         api_token=node_data.api_token,
         status=node_data.status,
-        is_visible_in_sub=node_data.is_visible_in_sub
+        is_visible_in_sub=node_data.is_visible_in_sub,
+        webhook_secret=node_data.webhook_secret
     )
     
     db.add(new_node)
@@ -35,6 +38,34 @@ async def add_new_node(
     
     return {"message": "سرور با موفقیت به گاردینو متصل شد.", "node_id": new_node.id}
 
+@router.put("/{node_id}")
+async def edit_node(
+    node_id: int,
+    node_data: NodeCreate,
+    current_admin: Reseller = Depends(get_current_reseller),
+    db: AsyncSession = Depends(get_db)
+):
+    if current_admin.parent_id is not None:
+        raise HTTPException(status_code=403, detail="فقط ادمین کل اجازه ویرایش سرور دارد.")
+
+    node = await db.get(Node, node_id)
+    if not node:
+        raise HTTPException(status_code=404, detail="سرور یافت نشد.")
+
+    node.display_name = node_data.display_name
+    node.panel_type = node_data.panel_type
+    node.api_url = node_data.api_url
+    node.api_token = node_data.api_token
+    node.status = node_data.status
+    node.is_visible_in_sub = node_data.is_visible_in_sub
+    node.webhook_secret = node_data.webhook_secret
+    await db.commit()
+
+    # ممکن است پنل پشت این نود عوض شده باشد؛ کش اینباندها دیگر معتبر نیست
+    await invalidate_inbounds(node_id)
+
+    return {"message": "اطلاعات سرور بروزرسانی شد.", "node_id": node.id}
+
 @router.get("/list")
 async def list_available_nodes(
     current_reseller: Reseller = Depends(get_current_reseller),
@@ -54,3 +85,24 @@ async def list_available_nodes(
         nodes = result.scalars().all()
         
     return {"nodes": nodes}
+
+
+@router.get("/health")
+async def nodes_health(
+    current_admin: Reseller = Depends(get_current_reseller),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    وضعیت سلامت سرورها: کلید قطع‌کن، امتیاز سلامت، میانگین تاخیر و نرخ خطا (فقط ادمین کل)
+    """
+    if current_admin.parent_id is not None:
+        raise HTTPException(status_code=403, detail="فقط ادمین کل به وضعیت سلامت سرورها دسترسی دارد.")
+
+    result = await db.execute(select(Node).order_by(Node.id))
+    nodes = result.scalars().all()
+    health = await get_health(n.id for n in nodes)
+
+    return {"nodes": [
+        {"node_id": n.id, "display_name": n.display_name, "status": n.status, **health[n.id]}
+        for n in nodes
+    ]}
@@ -2,13 +2,16 @@
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update
 
 from app.core.database import get_db
-from app.core.security import get_password_hash
+from app.core.security import get_password_hash_async
 from app.models import Reseller, NodeAllocation, TransactionLog, TransactionType
 from app.api.deps import get_current_reseller
 from app.schemas.admin import ResellerCreate, NodeAllocationCreate
+from app.core.api_keys import generate_api_key, hash_api_key, get_api_key_usage
+from app.core.principal_cache import publish_invalidation
+from app.services.price_matrix import invalidate_price_matrix
 
 router = APIRouter(prefix="/api/v1/resellers", tags=["Resellers Management"])
 
@@ -33,7 +36,7 @@ async def create_reseller(
 
     new_reseller = Reseller(
         username=data.username,
-        password_hash=get_password_hash(data.password),
+        password_hash=await get_password_hash_async(data.password),
         parent_id=current_reseller.id, 
         daily_subscription_fee=data.daily_subscription_fee,
         base_price_per_gb=max(data.base_price_per_gb, current_reseller.base_price_per_gb), 
@@ -57,6 +60,8 @@ async def allocate_node_to_reseller(
     )
     db.add(allocation)
     await db.commit()
+    # قیمت‌های کش‌شده این نماینده دیگر معتبر نیستند
+    await invalidate_price_matrix(reseller_id)
     return {"message": "سرور به نماینده تخصیص داده شد."}
 
 # -------- API دریافت لیست نمایندگان --------
@@ -137,3 +142,39 @@ async def get_financial_history(
             "description": log.description, "date": log.created_at.isoformat()
         })
     return {"history": result}
+
+# -------- API کلید برای ربات‌های نمایندگان --------
+@router.post("/api-key")
+async def create_api_key(
+    current_reseller: Reseller = Depends(get_current_reseller),
+    db: AsyncSession = Depends(get_db)
+):
+    """ساخت (یا تعویض) کلید API؛ کلید خام فقط همین‌جا برگردانده می‌شود و کلید قبلی فوراً باطل است"""
+    api_key = generate_api_key()
+    await db.execute(update(Reseller).where(Reseller.id == current_reseller.id).values(api_key=hash_api_key(api_key)))
+    await db.commit()
+    # کلید قبلی ممکن است در کش پروسه‌های دیگر باشد
+    await publish_invalidation(current_reseller.id)
+    return {
+        "message": "کلید API ساخته شد. این کلید فقط یک‌بار نمایش داده می‌شود؛ آن را در جای امنی نگه دارید.",
+        "api_key": api_key,
+    }
+
+@router.delete("/api-key")
+async def revoke_api_key(
+    current_reseller: Reseller = Depends(get_current_reseller),
+    db: AsyncSession = Depends(get_db)
+):
+    await db.execute(update(Reseller).where(Reseller.id == current_reseller.id).values(api_key=None))
+    await db.commit()
+    await publish_invalidation(current_reseller.id)
+    return {"message": "کلید API باطل شد."}
+
+@router.get("/api-key/usage")
+async def api_key_usage(
+    current_reseller: Reseller = Depends(get_current_reseller),
+    db: AsyncSession = Depends(get_db)
+):
+    query = await db.execute(select(Reseller.api_key).where(Reseller.id == current_reseller.id))
+    usage = await get_api_key_usage(current_reseller.id)
+    return {"has_api_key": query.scalar_one_or_none() is not None, **usage}
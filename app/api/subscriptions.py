@@ -1,19 +1,175 @@
 # app/api/subscriptions.py
 import base64
-import httpx
 import asyncio
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import PlainTextResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.orm import selectinload
+from redis.exceptions import RedisError, LockError
 
-from app.core.database import get_db
+from app.core.database import get_db, AsyncSessionLocal
 from app.models import GuardinoUser, SubAccount
 from app.services.node_factory import NodeFactory
+from app.services.http_pool import get_client
+from app.services.node_health import unavailable_nodes
+from app.services.subscription_cache import (
+    client_class, get_fragment, set_fragment, is_fresh, fragment_lock, wait_for_fragment
+)
+from app.core.singleflight import SingleFlight
+from app.core.config import settings
 
 router = APIRouter(tags=["Subscriptions"])
 
+# کدهایی که نشان می‌دهند لینک ساب ذخیره‌شده دیگر معتبر نیست (حذف کاربر یا چرخش توکن ساب در پنل)
+STALE_SUB_URL_CODES = (403, 404)
+
+# نگه‌داشتن ارجاع به تسک‌های پس‌زمینه (تا GC آن‌ها را نیمه‌کاره جمع نکند)
+_background_tasks: set = set()
+# درخواست‌های همزمان برای یک ساب‌اکانت و یک نوع کلاینت فقط یک‌بار به پنل می‌روند
+_fragment_flights = SingleFlight()
+
+async def _store_subscription_url(sub_acc_id: int, sub_url: str):
+    """ذخیره لینک ساب بومی با سشن مستقل (چون fetch ها همزمان اجرا می‌شوند)"""
+    async with AsyncSessionLocal() as session:
+        await session.execute(update(SubAccount).where(SubAccount.id == sub_acc_id).values(subscription_url=sub_url))
+        await session.commit()
+
+async def resolve_subscription_url(sub_acc: SubAccount, adapter, force: bool = False) -> str:
+    """لینک ذخیره‌شده را برمی‌گرداند و فقط اگر نبود (یا force) از پنل می‌پرسد و ذخیره می‌کند"""
+    if sub_acc.subscription_url and not force:
+        return sub_acc.subscription_url
+    sub_url = await adapter.get_subscription_link(sub_acc.remote_identifier)
+    if sub_url and sub_url != sub_acc.subscription_url:
+        sub_acc.subscription_url = sub_url
+        await _store_subscription_url(sub_acc.id, sub_url)
+    return sub_url
+
+async def _hedged_get(client, url: str, headers: dict):
+    """
+    درخواست Hedged: اگر پاسخ اول تا SUB_HEDGE_DELAY نرسید، درخواست دوم هم فرستاده می‌شود
+    و اولین پاسخ موفق برداشته و دیگری لغو می‌شود.
+    """
+    first = asyncio.ensure_future(client.get(url, headers=headers, timeout=10.0))
+    done, _ = await asyncio.wait({first}, timeout=settings.SUB_HEDGE_DELAY)
+    if done:
+        return first.result()
+
+    pending = {first, asyncio.ensure_future(client.get(url, headers=headers, timeout=10.0))}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def fetch_fragment(sub_acc: SubAccount, user_agent: str) -> str:
+    """دریافت زنده و رمزگشایی ساب یک نود (در صورت خطا Exception می‌دهد)"""
+    node = sub_acc.node
+    adapter = NodeFactory.get_adapter(node)
+    # آدرس ساب بومی از دیتابیس خوانده می‌شود (بدون رفت‌وبرگشت اضافه به پنل)
+    sub_url = await resolve_subscription_url(sub_acc, adapter)
+    if not sub_url:
+        return ""
+    
+    # اتصال به سرور اصلی برای خواندن محتوای فایل ساب (از استخر اتصال ماندگار همان نود)
+    client = get_client(node)
+    # User-Agent کلاینت را به سرور اصلی پاس می‌دهیم تا اگر خروجی کلش یا xray متفاوت بود، درست عمل کند
+    headers = {"User-Agent": user_agent}
+    resp = await _hedged_get(client, sub_url, headers)
+    if resp.status_code in STALE_SUB_URL_CODES:
+        # لینک قدیمی شده؛ یک‌بار از پنل دوباره می‌پرسیم
+        fresh_url = await resolve_subscription_url(sub_acc, adapter, force=True)
+        if fresh_url and fresh_url != sub_url:
+            resp = await _hedged_get(client, fresh_url, headers)
+    resp.raise_for_status()
+    
+    b64_content = resp.text.strip()
+    
+    # رمزگشایی Base64 به متن خام (vless://...)
+    padding = len(b64_content) % 4
+    if padding:
+        b64_content += '=' * (4 - padding)
+    return base64.b64decode(b64_content).decode("utf-8")
+
+async def _fetch_and_store(sub_acc: SubAccount, user_agent: str, ua_class: str) -> str:
+    body = await fetch_fragment(sub_acc, user_agent)
+    if body.strip():
+        await set_fragment(sub_acc.id, ua_class, body)
+    return body
+
+async def _coalesced_refresh(sub_acc: SubAccount, user_agent: str, ua_class: str) -> str:
+    """اگر ورکر دیگری همین الان در حال دریافت است، به جای درخواست تکراری منتظر نتیجه او می‌مانیم"""
+    if not settings.SUB_FLIGHT_DISTRIBUTED:
+        return await _fetch_and_store(sub_acc, user_agent, ua_class)
+
+    lock = fragment_lock(sub_acc.id, ua_class)
+    try:
+        acquired = await lock.acquire(blocking=False)
+    except RedisError:
+        acquired = False
+        lock = None
+
+    if lock is not None and not acquired:
+        body = await wait_for_fragment(sub_acc.id, ua_class, settings.SUB_FLIGHT_WAIT)
+        if body is not None:
+            return body
+
+    try:
+        return await _fetch_and_store(sub_acc, user_agent, ua_class)
+    finally:
+        if acquired:
+            try:
+                await lock.release()
+            except (LockError, RedisError):
+                pass
+
+async def refresh_fragment(sub_acc: SubAccount, user_agent: str, ua_class: str) -> str:
+    """دریافت زنده (ادغام‌شده با درخواست‌های همزمان) و ذخیره آخرین خروجی سالم در کش"""
+    return await _fragment_flights.do(
+        (sub_acc.id, ua_class), lambda: _coalesced_refresh(sub_acc, user_agent, ua_class)
+    )
+
+async def _background_refresh(sub_acc: SubAccount, user_agent: str, ua_class: str):
+    if _fragment_flights.in_flight((sub_acc.id, ua_class)):
+        return
+    try:
+        await refresh_fragment(sub_acc, user_agent, ua_class)
+    except Exception as e:
+        # نسخه قبلی در کش می‌ماند و دفعه بعد دوباره تلاش می‌شود
+        print(f"Background refresh failed for Node {sub_acc.node.display_name}: {e}")
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def get_node_fragment(sub_acc: SubAccount, user_agent: str) -> str:
+    """
+    Stale-While-Revalidate: اگر نسخه تازه در کش بود همان برمی‌گردد،
+    اگر کهنه بود فوراً سرو و در پس‌زمینه بروزرسانی می‌شود و فقط در نبود کش، درخواست زنده زده می‌شود.
+    """
+    ua_class = client_class(user_agent)
+    cached = await get_fragment(sub_acc.id, ua_class)
+    if cached:
+        body, age = cached
+        if not is_fresh(age):
+            _spawn(_background_refresh(sub_acc, user_agent, ua_class))
+        return body
+
+    try:
+        return await refresh_fragment(sub_acc, user_agent, ua_class)
+    except Exception as e:
+        # اگر یک سرور تایم‌اوت داد، کل ساب خراب نمی‌شود، فقط کانفیگ آن سرور را رد می‌کنیم
+        print(f"Error fetching from Node {sub_acc.node.display_name}: {e}")
+        return ""
+
 @router.get("/sub/{token}", response_class=PlainTextResponse)
 async def get_master_subscription(token: str, request: Request, db: AsyncSession = Depends(get_db)):
     """
@@ -40,46 +196,38 @@ async def get_master_subscription(token: str, request: Request, db: AsyncSession
         msg = "vless://00000000-0000-0000-0000-000000000000@127.0.0.1:80?security=none&type=tcp#❌_Account_Suspended_or_Expired"
         return base64.b64encode(msg.encode("utf-8")).decode("utf-8")
 
-    # 3. تابع کمکی برای دریافت و رمزگشایی سابِ هر پنل
+    # 3. تابع کمکی برای دریافت سابِ هر پنل (از کش یا به صورت زنده)
+    user_agent = request.headers.get("User-Agent", "v2rayNG")
+    down_nodes = await unavailable_nodes(acc.node_id for acc in user.sub_accounts)
+
     async def fetch_and_decode(sub_acc: SubAccount):
         node = sub_acc.node
         
         # منطق طلایی: اگر ادمین نود را آفلاین کرده یا تیک "نمایش در ساب" را برداشته، هیچ‌چیز برنگردان
         if node.status != "active" or not node.is_visible_in_sub:
             return ""
-            
-        try:
-            adapter = NodeFactory.get_adapter(node)
-            # گرفتن آدرس ساب بومی از مرزبان/پاسارگاد
-            sub_url = await adapter.get_subscription_link(sub_acc.remote_identifier)
-            if not sub_url:
-                return ""
-            
-            # اتصال به سرور اصلی برای خواندن محتوای فایل ساب
-            async with httpx.AsyncClient(verify=False) as client:
-                # User-Agent کلاینت را به سرور اصلی پاس می‌دهیم تا اگر خروجی کلش یا xray متفاوت بود، درست عمل کند
-                headers = {"User-Agent": request.headers.get("User-Agent", "v2rayNG")}
-                resp = await client.get(sub_url, headers=headers, timeout=10.0)
-                resp.raise_for_status()
-                
-                b64_content = resp.text.strip()
-                
-                # رمزگشایی Base64 به متن خام (vless://...)
-                padding = len(b64_content) % 4
-                if padding:
-                    b64_content += '=' * (4 - padding)
-                raw_text = base64.b64decode(b64_content).decode("utf-8")
-                
-                return raw_text
-                
-        except Exception as e:
-            # اگر یک سرور تایم‌اوت داد، کل ساب خراب نمی‌شود، فقط کانفیگ آن سرور را رد می‌کنیم
-            print(f"Error fetching from Node {node.display_name}: {e}")
-            return ""
+        if node.id in down_nodes:
+            # کلید نود باز است؛ بدون انتظار برای تایم‌اوت، آخرین نسخه کش‌شده (هرچقدر کهنه) سرو می‌شود
+            cached = await get_fragment(sub_acc.id, client_class(user_agent))
+            return cached[0] if cached else ""
+        return await get_node_fragment(sub_acc, user_agent)
 
-    # 4. اجرای موازی (درخواست همزمان به تمام سرورهایی که این کاربر در آن‌ها اکانت دارد)
-    fetch_tasks = [fetch_and_decode(acc) for acc in user.sub_accounts]
-    results = await asyncio.gather(*fetch_tasks)
+    # 4. اجرای موازی (درخواست همزمان به تمام سرورهایی که این کاربر در آن‌ها اکانت دارد) با سقف زمانی کل
+    fetch_tasks = {asyncio.ensure_future(fetch_and_decode(acc)): acc for acc in user.sub_accounts}
+    results = []
+    if fetch_tasks:
+        done, _ = await asyncio.wait(fetch_tasks, timeout=settings.SUB_RESPONSE_DEADLINE)
+        ua_class = client_class(user_agent)
+        for task, acc in fetch_tasks.items():
+            if task in done:
+                results.append(task.result())
+                continue
+            # نودهای کند لغو نمی‌شوند؛ در پس‌زمینه تمام می‌شوند و نتیجه‌شان برای درخواست بعدی در کش می‌نشیند
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+            cached = await get_fragment(acc.id, ua_class)
+            if cached:
+                results.append(cached[0])
     
     # 5. ترکیب (Merge) تمام کانفیگ‌های خام
     combined_raw_text = "\n".join([r.strip() for r in results if r.strip()])
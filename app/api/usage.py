@@ -0,0 +1,50 @@
+# app/api/usage.py
+from datetime import datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import get_db
+from app.models import Reseller, GuardinoUser, UsageGranularity
+from app.api.deps import get_current_reseller
+from app.services.usage_history import query_series
+
+router = APIRouter(prefix="/api/v1/usage", tags=["Usage History"])
+
+@router.get("/users/{user_id}")
+async def get_user_usage_series(
+    user_id: int,
+    granularity: UsageGranularity = UsageGranularity.HOUR,
+    days: int = Query(7, ge=1, le=400),
+    current_reseller: Reseller = Depends(get_current_reseller),
+    db: AsyncSession = Depends(get_db)
+):
+    """نمودار مصرف یک کاربر (ساعتی یا روزانه)"""
+    user = await db.get(GuardinoUser, user_id)
+    if not user or (current_reseller.parent_id is not None and user.reseller_id != current_reseller.id):
+        raise HTTPException(status_code=404, detail="کاربر یافت نشد.")
+
+    since = datetime.utcnow() - timedelta(days=days)
+    series = await query_series(db, granularity, since, user_id=user_id)
+    return {"user_id": user_id, "granularity": granularity.value, "series": series}
+
+@router.get("/reseller")
+async def get_reseller_usage_series(
+    granularity: UsageGranularity = UsageGranularity.DAY,
+    days: int = Query(30, ge=1, le=400),
+    reseller_id: int | None = None,
+    current_reseller: Reseller = Depends(get_current_reseller),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    نمودار مجموع مصرف کاربران یک نماینده (برای صورتحساب دوره‌ای).
+    ادمین کل هر نماینده‌ای را می‌بیند و نماینده ارشد فقط خودش و زیرمجموعه‌هایش را.
+    """
+    target_id = reseller_id or current_reseller.id
+    if target_id != current_reseller.id and current_reseller.parent_id is not None:
+        target = await db.get(Reseller, target_id)
+        if not target or target.parent_id != current_reseller.id:
+            raise HTTPException(status_code=403, detail="شما فقط مجاز به مشاهده زیرمجموعه‌های خود هستید.")
+
+    since = datetime.utcnow() - timedelta(days=days)
+    series = await query_series(db, granularity, since, reseller_id=target_id)
+    return {"reseller_id": target_id, "granularity": granularity.value, "series": series}
@@ -2,21 +2,29 @@
 import asyncio
 import uuid
 from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from sqlalchemy.orm import selectinload
 
 from app.core.database import get_db
-from app.models import Reseller, Node, NodeAllocation, GuardinoUser, SubAccount, TransactionLog, TransactionType, UserStatus
+from app.models import (
+    Reseller, Node, GuardinoUser, TransactionLog, TransactionType, UserStatus, ProvisioningJob, ProvisioningJobStatus,
+    NodeCommand, NodeCommandAction, NodeCommandStatus,
+)
 from app.schemas.user import UserCreateRequest, UserCreateResponse
-from app.services.node_factory import NodeFactory
+from app.services.node_health import unavailable_nodes
+from app.services.price_matrix import get_price_matrix
+from app.services.user_list import build_users_query, page_query, decode_cursor, encode_cursor, user_row, stream_ndjson, stream_csv
+from app.services.provisioning import initial_node_results, job_updates, wait_for_job_update, job_view, FINISHED_STATUSES
+from app.tasks.provision_worker import provision_user
 from app.api.deps import get_current_reseller
 from app.core.config import settings
 
 router = APIRouter(prefix="/api/v1/users", tags=["Users"])
 
-@router.post("/create", response_model=UserCreateResponse)
+@router.post("/create", response_model=UserCreateResponse, status_code=status.HTTP_202_ACCEPTED)
 async def create_multi_node_user(
     request: UserCreateRequest,
     current_reseller: Reseller = Depends(get_current_reseller),
@@ -26,76 +34,64 @@ async def create_multi_node_user(
     data_limit_bytes = int(request.data_limit_gb * gb_to_bytes)
     expire_timestamp = int((datetime.utcnow() + timedelta(days=request.expire_days)).timestamp()) if request.expire_days > 0 else 0
 
-    reseller_query = await db.execute(select(Reseller).where(Reseller.id == current_reseller.id).with_for_update())
-    reseller = reseller_query.scalar_one_or_none()
-    
-    if not reseller or reseller.status != "active":
-        raise HTTPException(status_code=400, detail="اکانت شما مسدود است.")
-
-    existing_user = await db.execute(select(GuardinoUser).where(GuardinoUser.username == request.username))
-    if existing_user.scalar_one_or_none():
-        raise HTTPException(status_code=400, detail="این نام کاربری از قبل وجود دارد.")
+    # همه سرورهای درخواستی با یک کوئری و قیمت‌ها از ماتریس کش‌شده نماینده (قبل از گرفتن قفل نماینده)
+    node_ids = list(dict.fromkeys(request.node_ids))
+    nodes_query = await db.execute(select(Node).where(Node.id.in_(node_ids)))
+    nodes_by_id = {node.id: node for node in nodes_query.scalars().all()}
+    is_admin = current_reseller.parent_id is None
+    price_matrix = {} if is_admin else await get_price_matrix(db, current_reseller.id)
 
     total_cost = 0
     valid_nodes = []
     
-    for n_id in request.node_ids:
-        if current_reseller.parent_id is None:
+    for n_id in node_ids:
+        node = nodes_by_id.get(n_id)
+        if is_admin:
             # ادمین کل به همه سرورها دسترسی دارد
-            node_query = await db.execute(select(Node).where(Node.id == n_id))
-            node = node_query.scalar_one_or_none()
             if not node or node.status != "active":
                 raise HTTPException(status_code=400, detail=f"سرور {n_id} خاموش است.")
-            valid_nodes.append(node)
             cost_for_this_node = 0
         else:
-            alloc_query = await db.execute(
-                select(NodeAllocation).options(selectinload(NodeAllocation.node)).where(
-                    NodeAllocation.reseller_id == current_reseller.id,
-                    NodeAllocation.node_id == n_id
-                )
-            )
-            allocation = alloc_query.scalar_one_or_none()
-            if not allocation or allocation.node.status != "active":
+            if n_id not in price_matrix or not node or node.status != "active":
                 raise HTTPException(status_code=400, detail=f"شما به سرور {n_id} دسترسی ندارید.")
             
-            price_gb = allocation.custom_price_per_gb if allocation.custom_price_per_gb is not None else reseller.base_price_master_sub
-            price_day = allocation.custom_price_per_day if allocation.custom_price_per_day is not None else 0
+            price_gb, price_day = price_matrix[n_id]
             cost_for_this_node = (request.data_limit_gb * price_gb) + (request.expire_days * price_day)
-            valid_nodes.append(allocation.node)
-            
+        valid_nodes.append(node)
         total_cost += int(cost_for_this_node)
 
+    # نودی که کلیدش باز است، بدون انتظار برای تایم‌اوت رد می‌شود (قبل از هر درخواست به پنل‌ها)
+    down_nodes = await unavailable_nodes(n.id for n in valid_nodes)
+    if down_nodes:
+        names = "، ".join(n.display_name for n in valid_nodes if n.id in down_nodes)
+        raise HTTPException(status_code=503, detail=f"سرور(های) {names} موقتاً در دسترس نیست. لطفاً کمی بعد تلاش کنید.")
+
+    reseller_query = await db.execute(select(Reseller).where(Reseller.id == current_reseller.id).with_for_update())
+    reseller = reseller_query.scalar_one_or_none()
+    
+    if not reseller or reseller.status != "active":
+        raise HTTPException(status_code=400, detail="اکانت شما مسدود است.")
+
+    existing_user = await db.execute(select(GuardinoUser).where(GuardinoUser.username == request.username))
+    if existing_user.scalar_one_or_none():
+        raise HTTPException(status_code=400, detail="این نام کاربری از قبل وجود دارد.")
+
+    # نام کاربری یک ساخت ناموفق تا پایان حذفش از پنل‌ها رزرو می‌ماند، وگرنه حذف دیرهنگام حساب کاربر جدید را پاک می‌کرد
+    pending_cleanup = await db.execute(
+        select(NodeCommand.id).where(
+            NodeCommand.node_id.in_([n.id for n in valid_nodes]),
+            NodeCommand.remote_identifier == request.username,
+            NodeCommand.action == NodeCommandAction.DELETE,
+            NodeCommand.status == NodeCommandStatus.PENDING,
+        ).limit(1)
+    )
+    if pending_cleanup.scalar_one_or_none() is not None:
+        raise HTTPException(status_code=409, detail="این نام کاربری در حال آزادسازی روی سرورهاست. لطفاً کمی بعد دوباره تلاش کنید.")
+
     if current_reseller.parent_id is not None and reseller.balance < total_cost:
         raise HTTPException(status_code=400, detail=f"موجودی ناکافی. مبلغ مورد نیاز: {total_cost} تومان")
 
-    creation_tasks = []
-    for node in valid_nodes:
-        adapter = NodeFactory.get_adapter(node)
-        if node.panel_type == "marzban":
-            task = adapter.create_user(request.username, expire_timestamp, data_limit_bytes, request.proxies)
-        elif node.panel_type == "pasarguard":
-            task = adapter.create_user(request.username, expire_timestamp, data_limit_bytes, request.proxy_settings)
-        elif node.panel_type == "wgdashboard":
-            task = adapter.create_user(request.username)
-        creation_tasks.append(task)
-
-    results = await asyncio.gather(*creation_tasks, return_exceptions=True)
-
-    successful_nodes = []
-    failed = False
-    for i, result in enumerate(results):
-        if isinstance(result, Exception) or (isinstance(result, dict) and "detail" in result):
-            failed = True
-            break
-        successful_nodes.append(valid_nodes[i])
-
-    if failed:
-        rollback_tasks = [NodeFactory.get_adapter(s).delete_user(request.username) for s in successful_nodes]
-        if rollback_tasks:
-            await asyncio.gather(*rollback_tasks, return_exceptions=True)
-        raise HTTPException(status_code=502, detail="خطا در ارتباط با یکی از سرورها. عملیات به طور کامل لغو شد.")
-
+    # رزرو مبلغ و ثبت کاربر (غیرفعال تا پایان ساخت روی سرورها) و کار ساخت، همه در یک تراکنش کوتاه
     if current_reseller.parent_id is not None:
         reseller.balance -= total_cost
     
@@ -105,7 +101,7 @@ async def create_multi_node_user(
     new_user = GuardinoUser(
         reseller_id=current_reseller.id,
         username=request.username,
-        status=UserStatus.ACTIVE,
+        status=UserStatus.DISABLED,
         purchased_data_limit=data_limit_bytes,
         expire_date=expire_dt,
         total_cost=total_cost,
@@ -114,33 +110,108 @@ async def create_multi_node_user(
     db.add(new_user)
     await db.flush()
 
-    for snode in valid_nodes:
-        db.add(SubAccount(guardino_user_id=new_user.id, node_id=snode.id, remote_identifier=request.username))
+    job = ProvisioningJob(
+        id=uuid.uuid4().hex,
+        reseller_id=current_reseller.id,
+        guardino_user_id=new_user.id,
+        username=request.username,
+        status=ProvisioningJobStatus.PENDING,
+        total_cost=total_cost,
+        payload={
+            "expire": expire_timestamp, "data_limit": data_limit_bytes,
+            "proxies": request.proxies, "proxy_settings": request.proxy_settings,
+        },
+        node_results=initial_node_results(valid_nodes),
+    )
+    db.add(job)
 
     if total_cost > 0:
         db.add(TransactionLog(reseller_id=current_reseller.id, amount=-total_cost, transaction_type=TransactionType.BUY_VPN, description=f"ساخت کاربر {request.username}"))
 
     await db.commit()
+
+    # ساخت روی پنل‌ها در ورکر انجام می‌شود (اگر ارسال به صف شکست بخورد، تسک از سرگیری آن را برمی‌دارد)
+    try:
+        provision_user.delay(job.id)
+    except Exception as e:
+        print(f"Failed to queue provisioning job {job.id}: {e}")
+
     master_sub_link = f"{settings.SYSTEM_DOMAIN}/sub/{sub_token}"
+    return UserCreateResponse(
+        message="⏳ کاربر ثبت شد و در حال ساخت روی سرورهاست.", username=request.username,
+        total_cost=total_cost, sub_link=master_sub_link, job_id=job.id, status=job.status.value
+    )
 
-    return UserCreateResponse(message="✅ کاربر ساخته شد.", username=request.username, total_cost=total_cost, sub_link=master_sub_link)
+@router.get("/jobs/{job_id}")
+async def get_provisioning_job(
+    job_id: str,
+    wait: int = Query(0, ge=0, description="حداکثر ثانیه انتظار برای تغییر وضعیت (Long-Poll)"),
+    current_reseller: Reseller = Depends(get_current_reseller),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    وضعیت کار ساخت کاربر و پیشرفت هر سرور.
+    با wait > 0 پاسخ تا اولین تغییر وضعیت (یا پایان مهلت) نگه داشته می‌شود.
+    """
+    wait = min(wait, settings.PROVISION_LONG_POLL_MAX)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+
+    async with job_updates(job_id) as updates:
+        job = await db.get(ProvisioningJob, job_id)
+        if not job or job.reseller_id != current_reseller.id:
+            raise HTTPException(status_code=404, detail="کار ساخت یافت نشد.")
+
+        initial = (job.status, job.node_results)
+        while job.status not in FINISHED_STATUSES and loop.time() < deadline:
+            # پایان تراکنش خواندنی تا کانکشن دیتابیس در طول انتظار آزاد بماند
+            await db.commit()
+            await wait_for_job_update(updates, deadline - loop.time())
+            # خواندن نسخه تازه از دیتابیس (نه از حافظه سشن)
+            await db.refresh(job)
+            if (job.status, job.node_results) != initial:
+                break
+
+    return job_view(job)
 
 @router.get("/list")
 async def get_reseller_users(
+    limit: int = Query(settings.USERS_PAGE_SIZE, ge=1, le=settings.USERS_PAGE_MAX),
+    cursor: Optional[str] = Query(None, description="next_cursor صفحه قبل"),
+    status_filter: Optional[UserStatus] = Query(None, alias="status"),
+    username_prefix: Optional[str] = Query(None, max_length=100),
+    expiring_before: Optional[datetime] = Query(None),
+    over_quota: Optional[bool] = Query(None),
+    order: str = Query("desc", pattern="^(asc|desc)$", description="ترتیب بر اساس زمان ساخت"),
+    export_format: str = Query("json", alias="format", pattern="^(json|ndjson|csv)$"),
     current_reseller: Reseller = Depends(get_current_reseller),
     db: AsyncSession = Depends(get_db)
 ):
-    query = await db.execute(select(GuardinoUser).where(GuardinoUser.reseller_id == current_reseller.id).order_by(GuardinoUser.created_at.desc()))
-    users = query.scalars().all()
-    
-    result = []
-    for u in users:
-        result.append({
-            "id": u.id,
-            "username": u.username,
-            "status": u.status,
-            "purchased_gb": round(u.purchased_data_limit / 1073741824, 2),
-            "expire_date": u.expire_date.isoformat() if u.expire_date else None,
-            "sub_link": f"{settings.SYSTEM_DOMAIN}/sub/{u.sub_token}"
-        })
-    return {"users": result}
+    """
+    لیست کاربران نماینده با صفحه‌بندی Keyset و فیلترهای سمت سرور.
+    در قالب‌های ndjson و csv همه کاربران فیلترشده (از کرسر به بعد) به‌صورت جریانی ارسال می‌شوند.
+    """
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="کرسر صفحه‌بندی نامعتبر است.")
+    descending = order == "desc"
+    query = build_users_query(current_reseller.id, status_filter, username_prefix, expiring_before, over_quota)
+
+    if export_format == "ndjson":
+        return StreamingResponse(stream_ndjson(db, query, after, descending), media_type="application/x-ndjson")
+    if export_format == "csv":
+        return StreamingResponse(
+            stream_csv(db, query, after, descending), media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": 'attachment; filename="users.csv"'},
+        )
+
+    # یک ردیف اضافه خوانده می‌شود تا بدون COUNT معلوم شود صفحه بعدی وجود دارد یا نه
+    result = await db.execute(page_query(query, after, descending, limit + 1))
+    users = result.scalars().all()
+    has_more = len(users) > limit
+    users = users[:limit]
+    return {
+        "users": [user_row(u) for u in users],
+        "next_cursor": encode_cursor(users[-1]) if has_more else None,
+    }
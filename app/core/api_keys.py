@@ -0,0 +1,70 @@
+# app/core/api_keys.py
+import hashlib
+import secrets
+from datetime import datetime, timedelta
+from redis.exceptions import RedisError
+from app.core.config import settings
+from app.core.redis import get_redis
+
+# کلید خام فقط یک‌بار به نماینده نشان داده می‌شود؛ در دیتابیس فقط هش آن (ستون یکتا و ایندکس‌دار api_key) ذخیره می‌شود
+API_KEY_PREFIX = "gk_"
+
+
+def generate_api_key() -> str:
+    return API_KEY_PREFIX + secrets.token_urlsafe(32)
+
+
+def hash_api_key(api_key: str) -> str:
+    """کلید تصادفی با آنتروپی بالاست، پس SHA-256 (بدون bcrypt) برای ذخیره امن و جستجوی مستقیم کافی است"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def rate_limit_key(key_hash: str) -> str:
+    return f"guardino:apikey:rate:{key_hash}"
+
+
+def _usage_key(reseller_id: int) -> str:
+    return f"guardino:apikey:usage:{reseller_id}"
+
+
+def _daily_usage_key(reseller_id: int, day: str) -> str:
+    return f"guardino:apikey:usage:{reseller_id}:{day}"
+
+
+async def record_api_key_usage(reseller_id: int) -> None:
+    """شمارنده استفاده از کلید API: کل درخواست‌ها و آخرین استفاده، به‌علاوه شمارنده روزانه با انقضای خودکار"""
+    now = datetime.utcnow()
+    daily_key = _daily_usage_key(reseller_id, now.date().isoformat())
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hincrby(_usage_key(reseller_id), "total", 1)
+        pipe.hset(_usage_key(reseller_id), "last_used_at", now.isoformat())
+        pipe.incr(daily_key)
+        pipe.expire(daily_key, settings.API_KEY_USAGE_RETENTION_DAYS * 86400)
+        await pipe.execute()
+    except RedisError as e:
+        print(f"Failed to record API key usage for reseller {reseller_id}: {e}")
+
+
+async def get_api_key_usage(reseller_id: int, days: int = 7) -> dict:
+    """آمار استفاده از کلید API نماینده (کل، آخرین استفاده و تعداد درخواست‌های روزهای اخیر)"""
+    today = datetime.utcnow().date()
+    dates = [(today - timedelta(days=i)).isoformat() for i in range(days)]
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hgetall(_usage_key(reseller_id))
+        for day in dates:
+            pipe.get(_daily_usage_key(reseller_id, day))
+        raw, *daily = await pipe.execute()
+    except RedisError as e:
+        # آمار در دسترس نیست؛ به جای خطای 500، پاسخ خالی با علامت در دسترس نبودن برگردانده می‌شود
+        print(f"Failed to read API key usage for reseller {reseller_id}: {e}")
+        return {"total_requests": None, "last_used_at": None, "daily": {}, "available": False}
+    data = {k.decode("utf-8"): v.decode("utf-8") for k, v in raw.items()}
+    return {
+        "total_requests": int(data.get("total", 0)),
+        "last_used_at": data.get("last_used_at"),
+        "daily": {day: int(count or 0) for day, count in zip(dates, daily)},
+        "available": True,
+    }
+
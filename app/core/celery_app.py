@@ -1,13 +1,14 @@
 # app/core/celery_app.py
 from celery import Celery
 from celery.schedules import crontab
+from app.core.config import settings
 
 # اتصال به دیتابیس Redis (که در docker-compose ساختیم)
 celery_app = Celery(
     "guardino_worker",
-    broker="redis://redis:6379/0",
-    backend="redis://redis:6379/0",
-    include=['app.tasks.sync_worker']
+    broker=settings.REDIS_URL,
+    backend=settings.REDIS_URL,
+    include=['app.tasks.sync_worker', 'app.tasks.expiry_worker', 'app.tasks.health_worker', 'app.tasks.command_worker', 'app.tasks.provision_worker']
 )
 
 celery_app.conf.update(
@@ -20,10 +21,35 @@ celery_app.conf.update(
 
 # زمان‌بندی تسک‌ها (Cron Jobs)
 celery_app.conf.beat_schedule = {
-    # هر 5 دقیقه مصرف همه کاربران را چک کن
-    'sync-all-users-traffic-every-5-mins': {
+    # هر دقیقه مصرف کاربرانی که نوبتشان رسیده را چک کن (نوبت هر کاربر بر اساس سرعت مصرفش تعیین می‌شود)
+    'sync-due-users-traffic-every-minute': {
         'task': 'app.tasks.sync_worker.sync_all_traffic',
-        'schedule': crontab(minute='*/5'),
+        'schedule': crontab(minute='*'),
+    },
+    # هر دقیقه کاربرانی که تاریخ انقضایشان رسیده را منقضی کن (کوئری فقط روی ایندکس status/expire_date)
+    'enforce-user-expiry-every-minute': {
+        'task': 'app.tasks.expiry_worker.enforce_expiry',
+        'schedule': crontab(minute='*'),
+    },
+    # اجرای دستورات صف نودها (مسدودی، حذف و ...) با تلاش مجدد
+    'dispatch-node-commands': {
+        'task': 'app.tasks.command_worker.dispatch_node_commands',
+        'schedule': float(settings.NODE_COMMAND_DISPATCH_INTERVAL),
+    },
+    # از سرگیری کارهای ساخت کاربر که به ورکر نرسیده یا نیمه‌کاره مانده‌اند
+    'resume-provisioning-jobs-every-minute': {
+        'task': 'app.tasks.provision_worker.resume_provisioning_jobs',
+        'schedule': crontab(minute='*'),
+    },
+    # بررسی دوره‌ای سلامت نودها (بستن کلید نودهایی که دوباره در دسترس شده‌اند)
+    'probe-nodes-health': {
+        'task': 'app.tasks.health_worker.probe_nodes',
+        'schedule': float(settings.NODE_HEALTH_PROBE_INTERVAL),
+    },
+    # هر ساعت نمونه‌های مصرف را ساعتی/روزانه تجمیع و داده‌های قدیمی را پاک کن
+    'rollup-usage-history-hourly': {
+        'task': 'app.tasks.sync_worker.rollup_usage_history',
+        'schedule': crontab(minute=5),
     },
     # هر شب ساعت 12 حق اشتراک روزانه نمایندگان را کسر کن
     'deduct-daily-fees-midnight': {
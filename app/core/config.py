@@ -16,6 +16,109 @@ class Settings(BaseSettings):
     POSTGRES_PORT: str = "5432"
     
     SECRET_KEY: str = "YOUR_SUPER_SECRET_KEY_REPLACE_LATER_IN_PRODUCTION"
+
+    # ردیس مشترک (بروکر Celery و کش‌های بین پروسه‌ای)
+    REDIS_URL: str = "redis://redis:6379/0"
+
+    # تنظیمات استخر اتصال HTTP به پنل‌ها (برای هر نود یک کلاینت ماندگار ساخته می‌شود)
+    NODE_HTTP_MAX_CONNECTIONS: int = 50
+    NODE_HTTP_MAX_KEEPALIVE: int = 20
+    NODE_HTTP_KEEPALIVE_EXPIRY: float = 60.0
+    NODE_HTTP_CONNECT_TIMEOUT: float = 5.0
+    NODE_HTTP_TIMEOUT: float = 10.0
+    NODE_HTTP2_ENABLED: bool = False # نیازمند نصب پکیج h2
+
+    # توکن ادمین مرزبان چند ثانیه قبل از انقضا تمدید شود
+    MARZBAN_TOKEN_REFRESH_MARGIN: int = 300
+    # اگر توکن فیلد exp نداشت، چه مدت معتبر فرض شود
+    MARZBAN_TOKEN_DEFAULT_TTL: int = 3600
+    # مدت اعتبار کش لیست Inbound های مرزبان (ثانیه)
+    MARZBAN_INBOUNDS_CACHE_TTL: int = 600
+
+    # کش تکه‌های ساب هر نود: تا soft تازه محسوب می‌شود، تا hard به عنوان نسخه کهنه سرو می‌شود
+    SUB_CACHE_SOFT_TTL: int = 60
+    SUB_CACHE_HARD_TTL: int = 86400
+    # ادغام درخواست‌های همزمان ساب بین چند ورکر API از طریق قفل ردیس
+    SUB_FLIGHT_DISTRIBUTED: bool = True
+    SUB_FLIGHT_LOCK_TTL: int = 15
+    SUB_FLIGHT_WAIT: float = 10.0
+    # سقف زمان پاسخ /sub؛ نودهای کند بعد از این مهلت از کش سرو می‌شوند
+    SUB_RESPONSE_DEADLINE: float = 4.0
+    # اگر درخواست اول تا این مدت جواب نداد، یک درخواست موازی دوم (hedge) ارسال می‌شود
+    SUB_HEDGE_DELAY: float = 1.5
+
+    # همزمانی سینک ترافیک: سقف کل درخواست‌های همزمان و سقف هر نود
+    SYNC_MAX_CONCURRENCY: int = 20
+    SYNC_NODE_CONCURRENCY: int = 4
+    SYNC_PAGE_SIZE: int = 500
+    # تعداد کاربرانی که در هر دسته از دیتابیس خوانده و کامیت می‌شوند
+    SYNC_BATCH_SIZE: int = 1000
+    # زمان‌بندی تطبیقی: فاصله چک هر کاربر بین این دو مقدار (ثانیه) و بر اساس سرعت مصرف تعیین می‌شود
+    SYNC_MIN_INTERVAL: int = 60
+    SYNC_MAX_INTERVAL: int = 3600
+    # اگر تعداد ساب‌اکانت‌های سررسید یک نود کمتر از این باشد، به جای لیست کامل، تک‌تک خوانده می‌شوند
+    SYNC_BULK_THRESHOLD: int = 100
+
+    # نگه‌داری تاریخچه مصرف: نمونه‌های خام 5 دقیقه‌ای و تجمیع ساعتی/روزانه
+    USAGE_RAW_RETENTION_HOURS: int = 48
+    USAGE_HOURLY_RETENTION_DAYS: int = 35
+    USAGE_DAILY_RETENTION_DAYS: int = 400
+    # چند ساعت اخیر در هر اجرای تجمیع دوباره محاسبه شوند (برای نمونه‌های دیررس)
+    USAGE_ROLLUP_LOOKBACK_HOURS: int = 6
+    # مدت اجاره سینک (با تمدید خودکار) تا تیک بعدی Beat روی اجرای قبلی سوار نشود
+    SYNC_LEASE_TTL: int = 600
+    # تعداد کاربران منقضی‌شده‌ای که در هر دسته غیرفعال می‌شوند
+    EXPIRY_BATCH_SIZE: int = 500
+
+    # سلامت نودها: ضریب میانگین نمایی (EWMA) تاخیر و نرخ خطا
+    NODE_HEALTH_EWMA_ALPHA: float = 0.3
+    # تاخیر بیشتر از این مقدار (میلی‌ثانیه) از امتیاز سلامت نود کم می‌کند
+    NODE_HEALTH_LATENCY_TARGET_MS: int = 500
+    # وضعیت کلید نودها در هر پروسه چند ثانیه کش شود
+    NODE_HEALTH_LOCAL_TTL: float = 2.0
+    # بعد از این تعداد خطای پشت‌سرهم، نود موقتاً کنار گذاشته می‌شود (Circuit Breaker)
+    NODE_BREAKER_FAILURE_THRESHOLD: int = 5
+    # بعد از این مدت (ثانیه) یک درخواست آزمایشی دوباره به نود فرستاده می‌شود
+    NODE_BREAKER_COOLDOWN: int = 30
+    # در حالت نیمه‌باز فقط دارنده این توکن (یک فراخواننده) تا این مدت اجازه درخواست آزمایشی دارد
+    NODE_BREAKER_PROBE_TTL: int = 30
+    # فاصله و سقف زمان بررسی پس‌زمینه نودها
+    NODE_HEALTH_PROBE_INTERVAL: int = 30
+    NODE_HEALTH_PROBE_TIMEOUT: float = 5.0
+
+    # صف دستورات نودها: فاصله اجرای ورکر، اندازه هر دسته و سیاست تلاش مجدد (عقب‌نشینی نمایی)
+    NODE_COMMAND_DISPATCH_INTERVAL: int = 10
+    NODE_COMMAND_BATCH_SIZE: int = 200
+    NODE_COMMAND_RETRY_BASE: int = 30
+    NODE_COMMAND_RETRY_MAX: int = 3600
+    NODE_COMMAND_MAX_ATTEMPTS: int = 15
+
+    # کارهای ساخت کاربر: اگر ورکر تا این مدت (ثانیه) کار را تمام نکرد، دوباره از سر گرفته می‌شود
+    PROVISION_JOB_TIMEOUT: int = 300
+    # حداکثر زمان انتظار Long-Poll وضعیت کار ساخت
+    PROVISION_LONG_POLL_MAX: int = 30
+    # مدت اعتبار کش ماتریس قیمت نمایندگان (با تغییر تخصیص‌ها فوراً باطل می‌شود)
+    PRICE_MATRIX_CACHE_TTL: int = 300
+    # کش حافظه نماینده احراز هویت‌شده در هر پروسه API (تغییر وضعیت از طریق Pub/Sub ردیس فوراً اعمال می‌شود)
+    PRINCIPAL_CACHE_TTL: int = 15
+    PRINCIPAL_CACHE_SIZE: int = 10000
+
+    # تعداد رشته‌های هش رمز عبور (bcrypt) در هر پروسه API
+    PASSWORD_HASH_WORKERS: int = 2
+    # محدودیت لاگین: سقف تلاش هر IP و سقف رمز اشتباه هر نام کاربری از هر IP در پنجره لغزان (ثانیه)
+    LOGIN_IP_LIMIT: int = 20
+    LOGIN_IP_WINDOW: int = 60
+    LOGIN_USER_FAILURE_LIMIT: int = 5
+    LOGIN_USER_WINDOW: int = 300
+    # سقف درخواست هر کلید API (ربات‌های نمایندگان) در پنجره لغزان (ثانیه)
+    API_KEY_RATE_LIMIT: int = 600
+    API_KEY_RATE_WINDOW: int = 60
+    # مدت نگهداری شمارنده روزانه استفاده از کلید API (روز)
+    API_KEY_USAGE_RETENTION_DAYS: int = 30
+    # لیست کاربران: اندازه پیش‌فرض و حداکثر صفحه، و اندازه هر دسته در خروجی جریانی (NDJSON/CSV)
+    USERS_PAGE_SIZE: int = 100
+    USERS_PAGE_MAX: int = 500
+    USERS_EXPORT_BATCH_SIZE: int = 1000
     
     @property
     def DATABASE_URL(self) -> str:
@@ -0,0 +1,88 @@
+# app/core/principal_cache.py
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from redis.exceptions import RedisError
+from app.core.config import settings
+from app.core.redis import get_redis
+from app.models import Reseller
+
+# کانال ردیس برای باطل کردن کش نماینده در همه پروسه‌های API
+INVALIDATION_CHANNEL = "guardino:principal:invalidate"
+
+# فیلدهایی از نماینده که APIها از وابستگی احراز هویت استفاده می‌کنند (موجودی عمداً کش نمی‌شود)
+PRINCIPAL_FIELDS = ("id", "username", "parent_id", "can_create_sub", "status", "base_price_per_gb", "base_price_master_sub")
+
+# کش LRU محلی: توکن -> (فیلدهای نماینده، زمان انقضای توکن، زمان ذخیره)
+# توکن فقط بعد از اعتبارسنجی امضا وارد کش می‌شود، پس خود رشته توکن کلید امنی است
+_principals: "OrderedDict[str, Tuple[dict, float, float]]" = OrderedDict()
+
+
+def get_principal(token: str) -> Optional[Reseller]:
+    """نماینده کش‌شده برای این توکن (یا None اگر نبود، کهنه شده یا توکن منقضی شده)"""
+    entry = _principals.get(token)
+    if entry is None:
+        return None
+    fields, token_exp, cached_at = entry
+    if time.monotonic() - cached_at > settings.PRINCIPAL_CACHE_TTL or time.time() >= token_exp:
+        _principals.pop(token, None)
+        return None
+    _principals.move_to_end(token)
+    # هر درخواست نمونه جداگانه (خارج از سشن) می‌گیرد تا تغییر آن روی کش اثر نگذارد
+    return Reseller(**fields)
+
+
+def put_principal(token: str, reseller: Reseller, token_exp: Optional[float]) -> None:
+    if not token_exp:
+        return
+    _principals[token] = ({f: getattr(reseller, f) for f in PRINCIPAL_FIELDS}, float(token_exp), time.monotonic())
+    _principals.move_to_end(token)
+    while len(_principals) > settings.PRINCIPAL_CACHE_SIZE:
+        _principals.popitem(last=False)
+
+
+def evict_reseller(reseller_id: int) -> None:
+    """حذف همه توکن‌های کش‌شده یک نماینده از کش همین پروسه"""
+    for token in [t for t, (fields, _, _) in _principals.items() if fields["id"] == reseller_id]:
+        _principals.pop(token, None)
+
+
+async def publish_invalidation(reseller_id: int) -> None:
+    """
+    اعلام تغییر وضعیت/نقش/سلسله‌مراتب نماینده به همه پروسه‌های API.
+    اگر ردیس در دسترس نبود، تغییر حداکثر بعد از PRINCIPAL_CACHE_TTL اعمال می‌شود.
+    """
+    evict_reseller(reseller_id)
+    try:
+        await get_redis().publish(INVALIDATION_CHANNEL, str(reseller_id))
+    except RedisError as e:
+        print(f"Failed to publish principal invalidation for reseller {reseller_id}: {e}")
+
+
+async def listen_for_invalidations() -> None:
+    """شنونده پس‌زمینه هر پروسه API؛ بعد از قطع ارتباط، کل کش پاک می‌شود چون ممکن است پیامی از دست رفته باشد"""
+    while True:
+        pubsub = get_redis().pubsub()
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                # پیام خراب نباید شنونده را برای همیشه از کار بیندازد
+                try:
+                    evict_reseller(int(message["data"]))
+                except (TypeError, ValueError) as e:
+                    print(f"Ignoring malformed principal invalidation {message['data']!r}: {e}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # هر خطای غیرمنتظره دیگری هم ثبت می‌شود و شنونده دوباره وصل می‌شود
+            print(f"Principal invalidation listener disconnected: {e!r}")
+            _principals.clear()
+            await asyncio.sleep(5)
+        finally:
+            try:
+                await pubsub.close()
+            except RedisError:
+                pass
@@ -0,0 +1,105 @@
+# app/core/rate_limit.py
+import time
+import uuid
+from typing import Tuple
+from redis.exceptions import RedisError
+from app.core.redis import get_redis
+
+# محدودیت نرخ با پنجره لغزان روی Sorted Set ردیس (امتیاز هر عضو = زمان رخداد)
+
+
+async def hit(key: str, limit: int, window: int) -> Tuple[bool, int]:
+    """
+    ثبت یک رخداد و بررسی سقف آن در window ثانیه اخیر.
+    خروجی: (مجاز است؟، چند ثانیه بعد دوباره مجاز می‌شود)
+    رخدادهای ردشده هم شمرده می‌شوند تا ادامه حمله، پنجره را باز نگه ندارد.
+    اگر ردیس در دسترس نبود، درخواست مجاز فرض می‌شود.
+    """
+    now = time.time()
+    try:
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.zremrangebyscore(key, 0, now - window)
+        pipe.zadd(key, {f"{now}:{uuid.uuid4().hex[:8]}": now})
+        pipe.zcard(key)
+        pipe.zrange(key, 0, 0, withscores=True)
+        pipe.expire(key, window)
+        _, _, count, oldest, _ = await pipe.execute()
+    except RedisError as e:
+        print(f"Rate limiter unavailable for {key}: {e}")
+        return True, 0
+    if count <= limit:
+        return True, 0
+    return False, _retry_after(oldest, window, now)
+
+
+# نسخه بدون شمارش درخواست‌های ردشده: رخداد فقط وقتی ثبت می‌شود که زیر سقف باشد (بررسی و ثبت اتمی)
+_ACQUIRE_LUA = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now - window)
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    redis.call('EXPIRE', KEYS[1], window)
+    return {1, '0'}
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {0, oldest[2]}
+"""
+
+
+async def acquire(key: str, limit: int, window: int) -> Tuple[bool, int]:
+    """
+    مثل hit، ولی درخواست ردشده شمرده نمی‌شود؛ برای کلاینت‌های مجاز (ربات‌ها) که بعد از عبور از سقف
+    دوباره تلاش می‌کنند و نباید تا ابد پشت 429 بمانند.
+    """
+    now = time.time()
+    try:
+        script = get_redis().register_script(_ACQUIRE_LUA)
+        allowed, oldest = await script(keys=[key], args=[now, window, limit, f"{now}:{uuid.uuid4().hex[:8]}"])
+    except RedisError as e:
+        print(f"Rate limiter unavailable for {key}: {e}")
+        return True, 0
+    if allowed:
+        return True, 0
+    return False, max(int(float(oldest) + window - now) + 1, 1)
+
+
+async def count(key: str, window: int) -> Tuple[int, int]:
+    """تعداد رخدادهای window ثانیه اخیر (بدون ثبت رخداد جدید) و زمان باقی‌مانده تا خروج قدیمی‌ترین آن‌ها"""
+    now = time.time()
+    try:
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.zremrangebyscore(key, 0, now - window)
+        pipe.zcard(key)
+        pipe.zrange(key, 0, 0, withscores=True)
+        _, total, oldest = await pipe.execute()
+    except RedisError as e:
+        print(f"Rate limiter unavailable for {key}: {e}")
+        return 0, 0
+    return total, _retry_after(oldest, window, now)
+
+
+async def record(key: str, window: int) -> None:
+    """ثبت یک رخداد بدون بررسی سقف (مثلاً رمز اشتباه)"""
+    now = time.time()
+    try:
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.zadd(key, {f"{now}:{uuid.uuid4().hex[:8]}": now})
+        pipe.expire(key, window)
+        await pipe.execute()
+    except RedisError as e:
+        print(f"Rate limiter unavailable for {key}: {e}")
+
+
+async def clear(key: str) -> None:
+    """پاک کردن همه رخدادهای ثبت‌شده (مثلاً بعد از ورود موفق)"""
+    try:
+        await get_redis().delete(key)
+    except RedisError as e:
+        print(f"Rate limiter unavailable for {key}: {e}")
+
+
+def _retry_after(oldest, window: int, now: float) -> int:
+    if not oldest:
+        return 0
+    return max(int(oldest[0][1] + window - now) + 1, 1)
@@ -0,0 +1,50 @@
+# app/core/redis.py
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+import redis.asyncio as aioredis
+from redis.exceptions import LockError
+from app.core.config import settings
+
+# کلاینت ناهمگام ردیس که بین API و ورکرها مشترک است (خروجی به صورت bytes)
+_redis: aioredis.Redis | None = None
+
+def get_redis() -> aioredis.Redis:
+    global _redis
+    if _redis is None:
+        _redis = aioredis.from_url(settings.REDIS_URL, decode_responses=False)
+    return _redis
+
+async def close_redis() -> None:
+    """بستن اتصال‌های ردیس (کانکشن‌ها به حلقه رویداد سازنده‌شان وابسته‌اند)"""
+    global _redis
+    if _redis is not None:
+        client, _redis = _redis, None
+        await client.close()
+
+@asynccontextmanager
+async def lease(name: str, ttl: int) -> AsyncIterator[bool]:
+    """
+    اجاره انحصاری بین پروسه‌ها (برای جلوگیری از اجرای همپوشان تسک‌های زمان‌بندی‌شده).
+    خروجی True یعنی اجاره گرفته شد؛ تا پایان بلاک هر ttl/3 ثانیه تمدید می‌شود.
+    """
+    lock = get_redis().lock(f"guardino:lease:{name}", timeout=ttl)
+    acquired = await lock.acquire(blocking=False)
+    if not acquired:
+        yield False
+        return
+
+    async def _renew():
+        while True:
+            await asyncio.sleep(ttl / 3)
+            await lock.reacquire()
+
+    renewer = asyncio.create_task(_renew())
+    try:
+        yield True
+    finally:
+        renewer.cancel()
+        try:
+            await lock.release()
+        except LockError:
+            pass
@@ -1,4 +1,6 @@
 # app/core/security.py
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Any, Union
 from jose import jwt
@@ -8,6 +10,10 @@ from app.core.config import settings
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 ALGORITHM = "HS256"
 
+# bcrypt عمداً کند است؛ در استخر محدود اجرا می‌شود تا حلقه رویداد (و درخواست‌های /sub) متوقف نشود
+# و حتی در حمله، بیش از این تعداد هسته CPU صرف هش رمز نشود
+_hash_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
 def create_access_token(subject: Union[str, Any], expires_delta: timedelta = None) -> str:
     """ساخت توکن JWT برای نماینده"""
     if expires_delta:
@@ -28,3 +34,13 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     """هش کردن رمز عبور جدید"""
     return pwd_context.hash(password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """نسخه غیرمسدودکننده verify_password برای استفاده در APIها"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """نسخه غیرمسدودکننده get_password_hash برای استفاده در APIها"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, get_password_hash, password)
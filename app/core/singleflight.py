@@ -0,0 +1,32 @@
+# app/core/singleflight.py
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    ادغام فراخوانی‌های همزمان با کلید یکسان:
+    فقط اولین فراخوانی واقعاً اجرا می‌شود و بقیه منتظر همان نتیجه (یا خطا) می‌مانند.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        # shield: لغو شدن یک منتظر، درخواست مشترک بقیه را لغو نمی‌کند
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # جلوگیری از هشدار "Task exception was never retrieved" وقتی همه منتظرها لغو شده‌اند
+        if not task.cancelled():
+            task.exception()
@@ -1,7 +1,11 @@
 # app/main.py
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api import users, subscriptions, auth, nodes, resellers
+from app.api import users, subscriptions, auth, nodes, resellers, usage, ingest
+from app.services.http_pool import close_all_clients
+from app.core.redis import close_redis
+from app.core.principal_cache import listen_for_invalidations
 
 # 1. ابتدا هسته API را می‌سازیم
 app = FastAPI(
@@ -25,6 +29,23 @@ app.include_router(subscriptions.router)
 app.include_router(auth.router)
 app.include_router(nodes.router)
 app.include_router(resellers.router)
+app.include_router(usage.router)
+app.include_router(ingest.router)
+
+# 4. شنونده باطل‌سازی کش نمایندگان (تعلیق/قفل نماینده در چند ثانیه به همه پروسه‌ها می‌رسد)
+_background_tasks = []
+
+@app.on_event("startup")
+async def startup_event():
+    _background_tasks.append(asyncio.create_task(listen_for_invalidations()))
+
+# 5. بستن استخر اتصال‌های پنل‌ها و ردیس هنگام خاموش شدن سرویس
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in _background_tasks:
+        task.cancel()
+    await close_all_clients()
+    await close_redis()
 
 @app.get("/")
 async def root():
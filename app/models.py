@@ -1,7 +1,7 @@
 # app/models.py
 import enum
 from datetime import datetime
-from sqlalchemy import String, Integer, BigInteger, Boolean, ForeignKey, DateTime, Enum, Text
+from sqlalchemy import String, Integer, BigInteger, Boolean, ForeignKey, DateTime, Enum, Text, Index, JSON
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from app.core.database import Base
 
@@ -26,6 +26,28 @@ class UserStatus(str, enum.Enum):
     DISABLED = "disabled"
     EXPIRED = "expired"
 
+class UsageGranularity(str, enum.Enum):
+    HOUR = "hour"
+    DAY = "day"
+
+class NodeCommandAction(str, enum.Enum):
+    CREATE = "create"
+    MODIFY = "modify"
+    SUSPEND = "suspend"
+    DELETE = "delete"
+
+class NodeCommandStatus(str, enum.Enum):
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"   # بعد از اتمام تلاش‌ها؛ نیازمند بررسی دستی
+    CANCELLED = "cancelled"   # حذف لغو شد چون شناسه دوباره به کاربر زنده‌ای تعلق دارد
+
+class ProvisioningJobStatus(str, enum.Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
 class TransactionType(str, enum.Enum):
     BUY_VPN = "buy_vpn"
     REFUND = "refund"
@@ -71,6 +93,7 @@ class Node(Base):
     
     status: Mapped[NodeStatus] = mapped_column(Enum(NodeStatus), default=NodeStatus.ACTIVE)
     is_visible_in_sub: Mapped[bool] = mapped_column(Boolean, default=True) # حالت روح / مخفی در ساب
+    webhook_secret: Mapped[str | None] = mapped_column(String(128), nullable=True) # کلید وب‌هوک پنل (WEBHOOK_SECRET مرزبان)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     allocations = relationship("NodeAllocation", back_populates="node")
@@ -100,25 +123,42 @@ class GuardinoUser(Base):
     status: Mapped[UserStatus] = mapped_column(Enum(UserStatus), default=UserStatus.ACTIVE)
     
     purchased_data_limit: Mapped[int] = mapped_column(BigInteger) # به بایت
+    used_traffic: Mapped[int] = mapped_column(BigInteger, default=0) # مجموع مصرف همه ساب‌اکانت‌ها (پیش‌محاسبه برای چک سهمیه)
     expire_date: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     
     total_cost: Mapped[int] = mapped_column(Integer) # برای استرداد وجه دقیق
+    last_synced_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True) # آخرین بار که مصرف از پنل‌ها خوانده شد
+    next_sync_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True) # نوبت بعدی سینک (نال یعنی همین حالا)
     sub_token: Mapped[str] = mapped_column(String(64), unique=True, index=True) # توکن لینک ساب یکپارچه
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     reseller = relationship("Reseller", back_populates="users")
     sub_accounts = relationship("SubAccount", back_populates="guardino_user", cascade="all, delete-orphan")
 
+    # موتور انقضا فقط کاربران فعالی را که زمانشان رسیده از روی این ایندکس پیدا می‌کند
+    # و سینک ترافیک فقط کاربرانی را که نوبتشان رسیده از روی ایندکس دوم برمی‌دارد
+    # سه ایندکس آخر مخصوص صفحه‌بندی Keyset لیست کاربران نماینده (با و بدون فیلتر وضعیت) و جستجوی پیشوند نام کاربری است
+    __table_args__ = (
+        Index("ix_guardino_users_status_expire", "status", "expire_date"),
+        Index("ix_guardino_users_status_next_sync", "status", "next_sync_at"),
+        Index("ix_guardino_users_reseller_created", "reseller_id", "created_at", "id"),
+        Index("ix_guardino_users_reseller_status_created", "reseller_id", "status", "created_at", "id"),
+        Index("ix_guardino_users_reseller_username", "reseller_id", "username", postgresql_ops={"username": "varchar_pattern_ops"}),
+    )
+
 # ================= 5. جدول اکانت‌های زیرمجموعه (اتصال کاربر به نودهای واقعی) =================
 class SubAccount(Base):
     __tablename__ = "sub_accounts"
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
-    guardino_user_id: Mapped[int] = mapped_column(ForeignKey("guardino_users.id"))
+    guardino_user_id: Mapped[int] = mapped_column(ForeignKey("guardino_users.id"), index=True)
     node_id: Mapped[int] = mapped_column(ForeignKey("nodes.id"))
     
     remote_identifier: Mapped[str] = mapped_column(String(255)) # UUID یا Username در پنل مقصد
-    used_traffic: Mapped[int] = mapped_column(BigInteger, default=0) # سینک شده از مرزبان/پاسارگاد
+    used_traffic: Mapped[int] = mapped_column(BigInteger, default=0) # مصرف تجمعی (جمع دلتاها، با ریست پنل از دست نمی‌رود)
+    last_raw_traffic: Mapped[int] = mapped_column(BigInteger, default=0) # آخرین شمارنده خام گزارش‌شده توسط پنل (مبنای دلتا)
+    last_event_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True) # زمان آخرین رخداد وب‌هوک پذیرفته‌شده (رخدادهای قدیمی‌تر کنار گذاشته می‌شوند)
+    subscription_url: Mapped[str | None] = mapped_column(Text, nullable=True) # لینک ساب بومی (یک‌بار هنگام ساخت گرفته می‌شود)
     
     guardino_user = relationship("GuardinoUser", back_populates="sub_accounts")
     node = relationship("Node")
@@ -135,3 +175,74 @@ class TransactionLog(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     reseller = relationship("Reseller", back_populates="transactions")
+
+# ================= 7. تاریخچه مصرف (سری زمانی) =================
+# نمونه‌های خام 5 دقیقه‌ای: فقط دلتای مصرف هر کاربر در هر بازه (ردیف صفر ذخیره نمی‌شود)
+class UsageSample(Base):
+    __tablename__ = "usage_samples"
+
+    guardino_user_id: Mapped[int] = mapped_column(ForeignKey("guardino_users.id", ondelete="CASCADE"), primary_key=True)
+    bucket: Mapped[datetime] = mapped_column(DateTime, primary_key=True) # شروع بازه 5 دقیقه‌ای (UTC)
+    reseller_id: Mapped[int] = mapped_column(Integer)
+    bytes: Mapped[int] = mapped_column(BigInteger, default=0)
+
+    __table_args__ = (Index("ix_usage_samples_bucket", "bucket"),)
+
+# تجمیع ساعتی و روزانه نمونه‌ها (نمودارها و صورتحساب دوره‌ای از این جدول خوانده می‌شوند)
+class UsageRollup(Base):
+    __tablename__ = "usage_rollups"
+
+    granularity: Mapped[UsageGranularity] = mapped_column(Enum(UsageGranularity), primary_key=True)
+    guardino_user_id: Mapped[int] = mapped_column(ForeignKey("guardino_users.id", ondelete="CASCADE"), primary_key=True)
+    bucket: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    reseller_id: Mapped[int] = mapped_column(Integer)
+    bytes: Mapped[int] = mapped_column(BigInteger, default=0)
+
+    __table_args__ = (Index("ix_usage_rollups_reseller", "reseller_id", "granularity", "bucket"),)
+
+# ================= 8. صف دستورات نودها (Outbox) =================
+# هر تغییری که باید روی پنل‌ها اعمال شود، در همان تراکنش تغییر دیتابیس اینجا ثبت
+# و بعداً توسط ورکر با تلاش مجدد اجرا می‌شود (از دست نمی‌رود)
+class NodeCommand(Base):
+    __tablename__ = "node_commands"
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    node_id: Mapped[int] = mapped_column(ForeignKey("nodes.id"))
+    action: Mapped[NodeCommandAction] = mapped_column(Enum(NodeCommandAction))
+    remote_identifier: Mapped[str] = mapped_column(String(255))
+    payload: Mapped[dict | None] = mapped_column(JSON, nullable=True) # آرگومان‌های ساخت/ویرایش
+
+    status: Mapped[NodeCommandStatus] = mapped_column(Enum(NodeCommandStatus), default=NodeCommandStatus.PENDING)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    completed_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_node_commands_status_next_attempt", "status", "next_attempt_at"),
+        Index("ix_node_commands_target", "node_id", "remote_identifier", "status"),
+    )
+
+# ================= 9. کارهای ساخت کاربر روی نودها (Provisioning Jobs) =================
+# موجودی و رکورد کاربر فوراً ثبت می‌شوند و ساخت روی پنل‌ها در ورکر انجام و پیشرفت هر نود اینجا نگه‌داری می‌شود
+class ProvisioningJob(Base):
+    __tablename__ = "provisioning_jobs"
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True) # شناسه تصادفی (uuid hex)
+    reseller_id: Mapped[int] = mapped_column(ForeignKey("resellers.id"), index=True)
+    guardino_user_id: Mapped[int | None] = mapped_column(ForeignKey("guardino_users.id", ondelete="SET NULL"), nullable=True)
+    username: Mapped[str] = mapped_column(String(100))
+    status: Mapped[ProvisioningJobStatus] = mapped_column(Enum(ProvisioningJobStatus), default=ProvisioningJobStatus.PENDING)
+
+    total_cost: Mapped[int] = mapped_column(Integer, default=0) # مبلغ رزروشده (در صورت شکست بازگردانده می‌شود)
+    payload: Mapped[dict] = mapped_column(JSON) # آرگومان‌های ساخت روی پنل‌ها
+    node_results: Mapped[dict] = mapped_column(JSON) # node_id -> {status, error}
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (Index("ix_provisioning_jobs_status_created", "status", "created_at"),)
@@ -11,6 +11,7 @@ class NodeCreate(BaseModel):
     api_token: str = Field(..., description="توکن ادمین پنل مقصد")
     status: NodeStatus = NodeStatus.ACTIVE
     is_visible_in_sub: bool = True
+    webhook_secret: Optional[str] = Field(None, description="کلید وب‌هوک پنل برای ارسال رخدادهای مصرف (اختیاری)")
 
 # ---- فرم ساخت نماینده جدید ----
 class ResellerCreate(BaseModel):
@@ -18,6 +18,8 @@ class UserCreateResponse(BaseModel):
     username: str
     total_cost: int
     sub_link: str
+    job_id: str      # پیگیری ساخت روی سرورها از /api/v1/users/jobs/{job_id}
+    status: str
 
     class Config:
         from_attributes = True
@@ -0,0 +1,90 @@
+# app/services/http_pool.py
+import asyncio
+import time
+import httpx
+from typing import Dict, Set, Tuple
+from app.core.config import settings
+from app.models import Node
+from app.services.node_health import record_result
+
+# رجیستری سراسری کلاینت‌ها: برای هر نود یک کلاینت با استخر اتصال Keep-Alive (همراه آدرس پنلی که برایش ساخته شده)
+_clients: Dict[int, Tuple[str, httpx.AsyncClient]] = {}
+# بستن کلاینت‌های جایگزین‌شده در پس‌زمینه؛ ارجاع تسک‌ها نگه داشته می‌شود تا قبل از اتمام جمع‌آوری نشوند
+_closing: Set[asyncio.Task] = set()
+
+
+def _http2_available() -> bool:
+    if not settings.NODE_HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class _HealthTrackingTransport(httpx.AsyncBaseTransport):
+    """
+    ثبت نتیجه و تاخیر هر درخواست به پنل در سیستم سلامت نودها.
+    خطای شبکه/تایم‌اوت و پاسخ 5xx خطا حساب می‌شوند؛ بقیه پاسخ‌ها یعنی پنل زنده است.
+    """
+    def __init__(self, node_id: int, transport: httpx.AsyncBaseTransport):
+        self._node_id = node_id
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.monotonic()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except httpx.TransportError as e:
+            await record_result(self._node_id, False, time.monotonic() - started, repr(e))
+            raise
+        ok = response.status_code < 500
+        await record_result(self._node_id, ok, time.monotonic() - started, None if ok else f"HTTP {response.status_code}")
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def _build_client(node_id: int) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=settings.NODE_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.NODE_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=settings.NODE_HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(settings.NODE_HTTP_TIMEOUT, connect=settings.NODE_HTTP_CONNECT_TIMEOUT)
+    # وقتی transport سفارشی داده شود، تنظیمات اتصال باید روی خود transport باشد
+    transport = httpx.AsyncHTTPTransport(verify=False, limits=limits, http2=_http2_available())
+    return httpx.AsyncClient(transport=_HealthTrackingTransport(node_id, transport), timeout=timeout)
+
+
+def get_client(node: Node) -> httpx.AsyncClient:
+    """
+    کلاینت ماندگار مخصوص این نود را برمی‌گرداند (در صورت نبود، می‌سازد).
+    به این ترتیب هزینه دست‌دهی TCP/TLS فقط یک‌بار برای هر نود پرداخت می‌شود.
+    اگر آدرس نود ویرایش شده باشد، کلاینت قبلی بسته و با کلاینت جدید جایگزین می‌شود (اتصال‌های آن باز نمی‌مانند).
+    """
+    entry = _clients.get(node.id)
+    if entry is not None:
+        api_url, client = entry
+        if api_url == node.api_url and not client.is_closed:
+            return client
+        if not client.is_closed:
+            _close_in_background(client)
+    client = _build_client(node.id)
+    _clients[node.id] = (node.api_url, client)
+    return client
+
+
+def _close_in_background(client: httpx.AsyncClient) -> None:
+    task = asyncio.get_running_loop().create_task(client.aclose())
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+async def close_all_clients() -> None:
+    """بستن تمام کلاینت‌ها (هنگام خاموش شدن API یا پایان تسک Celery)"""
+    clients = [client for _, client in _clients.values()]
+    _clients.clear()
+    await asyncio.gather(*(c.aclose() for c in clients), *_closing, return_exceptions=True)
@@ -0,0 +1,39 @@
+# app/services/inbound_cache.py
+import json
+from typing import Awaitable, Callable, Dict
+from redis.exceptions import RedisError
+from app.core.config import settings
+from app.core.redis import get_redis
+
+
+def _key(node_id: int) -> str:
+    return f"guardino:marzban_inbounds:{node_id}"
+
+
+async def get_cached_inbounds(node_id: int, fetch: Callable[[], Awaitable[Dict]]) -> Dict:
+    """
+    لیست Inbound های نود از کش ردیس خوانده می‌شود و فقط در صورت نبود/انقضا از پنل دریافت می‌شود.
+    پاسخ‌های خطادار (دارای detail) کش نمی‌شوند.
+    """
+    try:
+        raw = await get_redis().get(_key(node_id))
+        if raw:
+            return json.loads(raw)
+    except RedisError as e:
+        print(f"Inbound cache unavailable for node {node_id}: {e}")
+
+    inbounds = await fetch()
+    if isinstance(inbounds, dict) and "detail" not in inbounds:
+        try:
+            await get_redis().set(_key(node_id), json.dumps(inbounds), ex=settings.MARZBAN_INBOUNDS_CACHE_TTL)
+        except RedisError:
+            pass
+    return inbounds
+
+
+async def invalidate_inbounds(node_id: int) -> None:
+    """حذف کش Inbound های یک نود (بعد از ویرایش نود یا خطای 400 مرزبان)"""
+    try:
+        await get_redis().delete(_key(node_id))
+    except RedisError as e:
+        print(f"Failed to invalidate inbound cache for node {node_id}: {e}")
@@ -1,52 +1,66 @@
 # app/services/marzban_adapter.py
 import httpx
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 from app.models import Node
+from app.services.http_pool import get_client
+from app.services.token_store import get_cached_token, token_key
+from app.services.inbound_cache import get_cached_inbounds, invalidate_inbounds
 
 class MarzbanAdapter:
     def __init__(self, node: Node):
         self.base_url = node.api_url.rstrip("/") + "/api"
+        self.node_id = node.id
         self.api_token = node.api_token
+        self.client = get_client(node)
         self.headers = {"Accept": "application/json"}
         
         # سیستم لاگین هوشمند
         if self.api_token and ":" in self.api_token and len(self.api_token) < 100:
             self.username, self.password = self.api_token.split(":", 1)
             self.is_auto_auth = True
+            # توکن بین تمام نمونه‌های آداپتور، پروسه‌های API و ورکرهای Celery مشترک است
+            self.token_key = token_key(node.id, node.api_url, self.api_token)
+            self.api_token = None
         else:
             self.is_auto_auth = False
             if self.api_token:
                 self.headers["Authorization"] = f"Bearer {self.api_token}"
 
-    async def get_token(self) -> str:
-        """دریافت خودکار توکن ادمین از مرزبان"""
+    async def _login(self) -> str:
+        """لاگین مستقیم در مرزبان و دریافت توکن ادمین"""
         url = f"{self.base_url}/admin/token"
         data = {"grant_type": "password", "username": self.username, "password": self.password}
-        async with httpx.AsyncClient(verify=False) as client:
-            response = await client.post(url, data=data)
-            response.raise_for_status()
-            token_data = response.json()
-            self.api_token = token_data.get("access_token")
-            self.headers["Authorization"] = f"Bearer {self.api_token}"
-            return self.api_token
+        response = await self.client.post(url, data=data)
+        response.raise_for_status()
+        return response.json().get("access_token")
+
+    async def get_token(self, force: bool = False) -> str:
+        """
+        دریافت توکن ادمین از کش مشترک (و لاگین فقط در صورت انقضا).
+        با force=True توکن فعلی که پنل رد کرده کنار گذاشته می‌شود.
+        """
+        rejected = self.api_token if force else None
+        self.api_token = await get_cached_token(self.token_key, self._login, rejected=rejected)
+        self.headers["Authorization"] = f"Bearer {self.api_token}"
+        return self.api_token
 
     async def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None) -> Dict[str, Any]:
-        if self.is_auto_auth and "Authorization" not in self.headers:
+        if self.is_auto_auth:
+            # از کش محلی خوانده می‌شود و فقط نزدیک انقضا به لاگین مجدد می‌رسد
             await self.get_token()
 
         url = f"{self.base_url}{endpoint}"
-        async with httpx.AsyncClient(verify=False) as client:
-            response = await client.request(method=method, url=url, headers=self.headers, json=data)
+        response = await self.client.request(method=method, url=url, headers=self.headers, json=data)
+        
+        if response.status_code == 401 and self.is_auto_auth:
+            await self.get_token(force=True)
+            response = await self.client.request(method=method, url=url, headers=self.headers, json=data)
             
-            if response.status_code == 401 and self.is_auto_auth:
-                await self.get_token()
-                response = await client.request(method=method, url=url, headers=self.headers, json=data)
-                
-            response.raise_for_status()
-            try:
-                return response.json()
-            except ValueError:
-                return {"detail": response.text}
+        response.raise_for_status()
+        try:
+            return response.json()
+        except ValueError:
+            return {"detail": response.text}
 
     async def get_inbounds(self) -> Dict:
         """دریافت لیست Inbound های فعال از مرزبان"""
@@ -57,27 +71,62 @@ class MarzbanAdapter:
         if proxies is None or not proxies:
             proxies = {"vless": {}, "vmess": {}, "trojan": {}}
 
-        # دریافت خودکار اینباندها برای جلوگیری از ارور 400 مرزبان
-        inbounds_data = await self.get_inbounds()
+        # دریافت اینباندها (از کش) برای جلوگیری از ارور 400 مرزبان
+        inbounds_data = await get_cached_inbounds(self.node_id, self.get_inbounds)
+        payload = self._build_user_payload(username, expire, data_limit, proxies, inbounds_data)
+        try:
+            return await self._make_request("POST", "/user", data=payload)
+        except httpx.HTTPStatusError as e:
+            # اگر اینباندهای کش‌شده قدیمی باشند، کش باطل و یک‌بار دیگر با لیست تازه تلاش می‌شود
+            if e.response.status_code != 400 or "inbound" not in e.response.text.lower():
+                raise
+            await invalidate_inbounds(self.node_id)
+            inbounds_data = await get_cached_inbounds(self.node_id, self.get_inbounds)
+            payload = self._build_user_payload(username, expire, data_limit, proxies, inbounds_data)
+            return await self._make_request("POST", "/user", data=payload)
+
+    @staticmethod
+    def _build_user_payload(username: str, expire: int, data_limit: int, proxies: Dict, inbounds_data: Dict) -> Dict:
         inbounds = {}
-        
         if isinstance(inbounds_data, dict) and "detail" not in inbounds_data:
             for proto, list_inbounds in inbounds_data.items():
                 if proto in proxies:
                     inbounds[proto] = [ib["tag"] for ib in list_inbounds]
         
-        payload = {
+        return {
             "username": username,
             "proxies": proxies,
             "inbounds": inbounds,
             "expire": expire,
             "data_limit": data_limit
         }
-        return await self._make_request("POST", "/user", data=payload)
 
     async def get_user(self, username: str) -> Dict:
         return await self._make_request("GET", f"/user/{username}")
 
+    async def get_user_usage(self, username: str) -> Optional[int]:
+        """مصرف خام یک کاربر (برای نودهایی که تعداد کاربران سررسیدشان کم است و لیست کامل نمی‌ارزد)"""
+        user_data = await self.get_user(username)
+        # پاسخ بدون شمارنده معتبر (مثلاً بدنه غیر JSON) یعنی «خوانده نشد»، نه مصرف صفر؛
+        # صفر در حسابداری دلتا ریست شمارنده حساب می‌شد و خوانش بعدی کل مصرف را دوباره اضافه می‌کرد
+        used = user_data.get("used_traffic")
+        return used if isinstance(used, int) else None
+
+    async def get_users_usage_page(self, offset: int, limit: int) -> Tuple[Dict[str, int], int]:
+        """
+        یک صفحه از لیست کاربران مرزبان (برای سینک انبوه مصرف به جای get_user تک‌تک)
+        خروجی: (نام کاربری -> used_traffic، تعداد کل کاربران نود)
+        """
+        data = await self._make_request("GET", f"/users?offset={offset}&limit={limit}")
+        if not isinstance(data, dict):
+            return {}, 0
+        # کاربری که شمارنده معتبر ندارد در خروجی نمی‌آید تا مثل get_user_usage «خوانده‌نشده» حساب شود
+        usage = {
+            u["username"]: u["used_traffic"] for u in data.get("users", [])
+            if isinstance(u, dict) and "username" in u and isinstance(u.get("used_traffic"), int)
+        }
+        return usage, data.get("total", 0)
+
     async def modify_user(self, username: str, data_limit: int, expire: int) -> Dict:
         payload = {"data_limit": data_limit, "expire": expire}
         return await self._make_request("PUT", f"/user/{username}", data=payload)
@@ -89,9 +138,13 @@ class MarzbanAdapter:
         payload = {"status": "disabled"}
         return await self._make_request("PUT", f"/user/{username}", data=payload)
 
-    async def get_subscription_link(self, username: str) -> str:
-        user_data = await self.get_user(username)
+    def extract_subscription_link(self, username: str, user_data: Dict) -> str:
+        """استخراج لینک ساب از اطلاعات کاربر (خروجی ساخت یا دریافت کاربر)"""
         sub_url = user_data.get("subscription_url")
         if not sub_url and "links" in user_data and len(user_data["links"]) > 0:
             sub_url = user_data["links"][0]
         return sub_url
+
+    async def get_subscription_link(self, username: str) -> str:
+        user_data = await self.get_user(username)
+        return self.extract_subscription_link(username, user_data)
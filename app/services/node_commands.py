@@ -0,0 +1,209 @@
+# app/services/node_commands.py
+import asyncio
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import httpx
+from sqlalchemy import select, update, func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models import Node, NodeStatus, PanelType, NodeCommand, NodeCommandAction, NodeCommandStatus, SubAccount, GuardinoUser
+from app.services.node_factory import NodeFactory
+from app.services.node_limiter import NodeLimiter
+from app.services.node_health import unavailable_nodes
+
+# پاسخ‌هایی که یعنی نتیجه دستور از قبل روی پنل برقرار است (اجرای تکراری بی‌خطر است)
+ALREADY_APPLIED_CODES = {
+    NodeCommandAction.CREATE: (409,),
+    NodeCommandAction.SUSPEND: (404,),
+    NodeCommandAction.DELETE: (404,),
+}
+
+
+def enqueue_command(db: AsyncSession, node_id: int, action: NodeCommandAction, remote_identifier: str,
+                    payload: Optional[Dict] = None) -> NodeCommand:
+    """
+    ثبت دستور در صف. کامیت نمی‌کند تا دستور همراه همان تغییر دیتابیس (و فقط در صورت موفقیت آن) ثبت شود.
+    """
+    command = NodeCommand(
+        node_id=node_id, action=action, remote_identifier=remote_identifier,
+        payload=payload, next_attempt_at=datetime.utcnow(),
+    )
+    db.add(command)
+    return command
+
+
+def enqueue_suspends(db: AsyncSession, targets: Iterable[Tuple[int, str]]) -> int:
+    """ثبت دستور مسدودی برای لیست (node_id, remote_identifier)"""
+    count = 0
+    for node_id, remote_identifier in targets:
+        enqueue_command(db, node_id, NodeCommandAction.SUSPEND, remote_identifier)
+        count += 1
+    return count
+
+
+async def create_remote_user(node: Node, username: str, payload: Dict) -> Dict:
+    """ساخت کاربر روی پنل با آرگومان‌های مخصوص هر نوع پنل"""
+    adapter = NodeFactory.get_adapter(node)
+    if node.panel_type == PanelType.MARZBAN:
+        return await adapter.create_user(username, payload["expire"], payload["data_limit"], payload.get("proxies"))
+    if node.panel_type == PanelType.PASARGUARD:
+        return await adapter.create_user(username, payload["expire"], payload["data_limit"], payload.get("proxy_settings"))
+    return await adapter.create_user(username)
+
+
+async def execute_command(node: Node, command: NodeCommand) -> None:
+    """اجرای یک دستور روی پنل؛ خطا یعنی باید دوباره تلاش شود"""
+    adapter = NodeFactory.get_adapter(node)
+    payload = command.payload or {}
+    try:
+        if command.action == NodeCommandAction.CREATE:
+            await create_remote_user(node, command.remote_identifier, payload)
+        elif command.action == NodeCommandAction.MODIFY:
+            # وایرگارد حجم و زمان ندارد؛ گاردینو خودش آن را کنترل می‌کند
+            if node.panel_type != PanelType.WGDASHBOARD:
+                await adapter.modify_user(command.remote_identifier, payload["data_limit"], payload["expire"])
+        elif command.action == NodeCommandAction.SUSPEND:
+            await adapter.suspend_user(command.remote_identifier)
+        elif command.action == NodeCommandAction.DELETE:
+            await adapter.delete_user(command.remote_identifier)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code not in ALREADY_APPLIED_CODES.get(command.action, ()):
+            raise
+
+
+async def owned_targets(db: AsyncSession, targets: Iterable[Tuple[int, str]]) -> set:
+    """
+    (node_id, remote_identifier)هایی که هنوز به کاربر زنده‌ای تعلق دارند: ساب‌اکانت همان نود با همان شناسه،
+    یا کاربر گاردینویی با همان نام کاربری (که ممکن است همین حالا در حال ساخت روی نودها باشد).
+    دستور حذف این‌ها اجرا نمی‌شود؛ دستور حذف همیشه بعد از حذف رکورد کاربر ثبت می‌شود، پس مالک فعلی کاربر تازه‌ای است.
+    """
+    targets = set(targets)
+    if not targets:
+        return set()
+    subs_query = await db.execute(
+        select(SubAccount.node_id, SubAccount.remote_identifier)
+        .where(tuple_(SubAccount.node_id, SubAccount.remote_identifier).in_(list(targets)))
+    )
+    owned = set(subs_query.all())
+    users_query = await db.execute(
+        select(GuardinoUser.username).where(GuardinoUser.username.in_({rid for _, rid in targets}))
+    )
+    live_usernames = set(users_query.scalars().all())
+    owned |= {(n_id, rid) for n_id, rid in targets if rid in live_usernames}
+    return owned
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """عقب‌نشینی نمایی با کمی نوسان تا تلاش‌های مجدد همه با هم به پنل نخورند"""
+    delay = min(settings.NODE_COMMAND_RETRY_BASE * 2 ** max(attempts - 1, 0), settings.NODE_COMMAND_RETRY_MAX)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+async def dispatch_pending(limiter: NodeLimiter) -> int:
+    """
+    اجرای یک دسته از دستورات سررسید.
+    دستورات هر کاربر روی هر نود به ترتیب ثبت اجرا می‌شوند و با اولین خطا، بقیه دستورات همان کاربر منتظر می‌مانند.
+    نودهای غیرفعال یا با کلید باز بدون مصرف تلاش به تعویق می‌افتند.
+    خروجی: تعداد دستورات برداشته‌شده (صفر یعنی صف خالی است)
+    """
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        query = await db.execute(
+            select(NodeCommand)
+            .where(NodeCommand.status == NodeCommandStatus.PENDING, NodeCommand.next_attempt_at <= now)
+            .order_by(NodeCommand.id)
+            .limit(settings.NODE_COMMAND_BATCH_SIZE)
+        )
+        commands = query.scalars().all()
+        if not commands:
+            return 0
+
+        node_ids = {c.node_id for c in commands}
+        nodes_query = await db.execute(select(Node).where(Node.id.in_(node_ids)))
+        nodes = {n.id: n for n in nodes_query.scalars().all()}
+
+        # دستور قدیمی‌تری از همان کاربر که هنوز در انتظار تلاش مجدد است، جلوی دستورات بعدی را می‌گیرد
+        blocked_query = await db.execute(
+            select(NodeCommand.node_id, NodeCommand.remote_identifier, func.min(NodeCommand.id))
+            .where(
+                NodeCommand.status == NodeCommandStatus.PENDING, NodeCommand.next_attempt_at > now,
+                NodeCommand.node_id.in_(node_ids),
+                NodeCommand.remote_identifier.in_({c.remote_identifier for c in commands}),
+            )
+            .group_by(NodeCommand.node_id, NodeCommand.remote_identifier)
+        )
+        blocked_before = {(n_id, rid): min_id for n_id, rid, min_id in blocked_query.all()}
+
+        # دستور حذف هر قدر هم قدیمی باشد، بدون بررسی مالکیت اجرا نمی‌شود
+        owned = await owned_targets(
+            db, ((c.node_id, c.remote_identifier) for c in commands if c.action == NodeCommandAction.DELETE)
+        )
+
+    down_nodes = await unavailable_nodes(nodes)
+    chains: Dict[Tuple[int, str], List[NodeCommand]] = defaultdict(list)
+    for command in commands:
+        chains[(command.node_id, command.remote_identifier)].append(command)
+
+    outcomes: Dict[int, Optional[str]] = {}  # command_id -> None (موفق) یا متن خطا
+    cancelled = set()
+
+    async def run_chain(key: Tuple[int, str], chain: List[NodeCommand]):
+        node = nodes.get(key[0])
+        if node is None or node.status != NodeStatus.ACTIVE or node.id in down_nodes:
+            return
+        if key in blocked_before and blocked_before[key] < chain[0].id:
+            return
+        for command in chain:
+            if command.action == NodeCommandAction.DELETE and key in owned:
+                cancelled.add(command.id)
+                continue
+            try:
+                async with limiter.slot(node.id):
+                    await execute_command(node, command)
+                outcomes[command.id] = None
+            except Exception as e:
+                outcomes[command.id] = repr(e)[:500]
+                return
+
+    await asyncio.gather(*(run_chain(key, chain) for key, chain in chains.items()))
+
+    updates = []
+    for command in commands:
+        if command.id in cancelled:
+            print(f"Node command {command.id} (delete {command.remote_identifier} on node {command.node_id}) "
+                  f"cancelled: identifier belongs to a live user")
+            updates.append({
+                "id": command.id, "status": NodeCommandStatus.CANCELLED,
+                "completed_at": datetime.utcnow(), "last_error": "identifier owned by a live user",
+            })
+        elif command.id not in outcomes:
+            # اجرا نشد (نود در دسترس نیست یا دستور قبلی کاربر هنوز انجام نشده)؛ بدون مصرف تلاش به تعویق می‌افتد
+            node = nodes.get(command.node_id)
+            wait = settings.NODE_BREAKER_COOLDOWN if node is not None and node.status == NodeStatus.ACTIVE \
+                else settings.NODE_COMMAND_RETRY_MAX
+            updates.append({"id": command.id, "next_attempt_at": now + timedelta(seconds=wait)})
+        elif outcomes[command.id] is None:
+            updates.append({
+                "id": command.id, "status": NodeCommandStatus.DONE,
+                "attempts": command.attempts + 1, "completed_at": datetime.utcnow(), "last_error": None,
+            })
+        else:
+            attempts = command.attempts + 1
+            failed = attempts >= settings.NODE_COMMAND_MAX_ATTEMPTS
+            if failed:
+                print(f"Node command {command.id} ({command.action.value} {command.remote_identifier} on node {command.node_id}) "
+                      f"gave up after {attempts} attempts: {outcomes[command.id]}")
+            updates.append({
+                "id": command.id,
+                "status": NodeCommandStatus.FAILED if failed else NodeCommandStatus.PENDING,
+                "attempts": attempts, "last_error": outcomes[command.id],
+                "next_attempt_at": datetime.utcnow() + retry_delay(attempts),
+            })
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(NodeCommand), updates)
+        await db.commit()
+    return len(commands)
@@ -18,3 +18,11 @@ class NodeFactory:
             return WGDashboardAdapter(node)
         else:
             raise ValueError(f"Unknown panel type: {node.panel_type}")
+
+    @staticmethod
+    def reports_usage(node: Node) -> bool:
+        """
+        آیا پنل این نود مصرف کاربران را گزارش می‌کند؟ (وایرگارد نه)
+        ساب‌اکانت روی نودی که مصرف گزارش نمی‌کند در سینک «خوانده‌نشده» حساب نمی‌شود.
+        """
+        return node.panel_type in (PanelType.MARZBAN, PanelType.PASARGUARD)
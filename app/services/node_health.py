@@ -0,0 +1,196 @@
+# app/services/node_health.py
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Set, Tuple
+from redis.exceptions import RedisError
+from app.core.config import settings
+from app.core.redis import get_redis
+
+# وضعیت کلید قطع‌کن (Circuit Breaker) هر نود
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+# فقط در خروجی API: وضعیت از ردیس خوانده نشد (مسیر درخواست‌ها در این حالت نود را سالم فرض می‌کند)
+STATE_UNKNOWN = "unknown"
+
+# کش محلی هر پروسه: node_id -> (وضعیت، زمان باز شدن، زمان خواندن)
+# تا مسیر داغ /sub برای هر درخواست به ردیس نرود
+_local_states: Dict[int, Tuple[str, float, float]] = {}
+
+
+def _key(node_id: int) -> str:
+    return f"guardino:node_health:{node_id}"
+
+
+def _probe_key(node_id: int) -> str:
+    return f"guardino:node_health:{node_id}:probe"
+
+
+# بروزرسانی اتمی سلامت نود داخل ردیس: همه ورکرها و پروسه‌های API همزمان نتیجه ثبت می‌کنند
+# و خواندن/نوشتن جدا (HGETALL سپس HSET) شمارش‌های یکدیگر را بازنویسی می‌کرد.
+# KEYS: هش سلامت، توکن آزمایش نیمه‌باز | ARGV: موفق؟، تاخیر (ms)، خطا، اکنون، alpha، آستانه خطا
+# خروجی: وضعیت قبلی، وضعیت جدید، زمان باز شدن، تعداد خطای پشت‌سرهم
+_RECORD_RESULT_LUA = """
+local alpha = tonumber(ARGV[5])
+local prev_state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+local error_rate = tonumber(redis.call('HGET', KEYS[1], 'error_rate') or '0')
+local sample = 1
+if ARGV[1] == '1' then sample = 0 end
+error_rate = alpha * sample + (1 - alpha) * error_rate
+redis.call('HSET', KEYS[1], 'error_rate', tostring(error_rate), 'last_checked_at', ARGV[4])
+
+local state = prev_state
+local opened_at = redis.call('HGET', KEYS[1], 'opened_at') or '0'
+local failures = 0
+if ARGV[1] == '1' then
+    local latency = tonumber(ARGV[2])
+    local prev_latency = redis.call('HGET', KEYS[1], 'latency_ms')
+    if prev_latency then latency = alpha * latency + (1 - alpha) * tonumber(prev_latency) end
+    redis.call('HSET', KEYS[1], 'latency_ms', tostring(latency), 'failures', 0, 'state', 'closed', 'opened_at', 0)
+    state = 'closed'
+    opened_at = '0'
+    redis.call('DEL', KEYS[2])
+else
+    failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+    redis.call('HSET', KEYS[1], 'last_error', ARGV[3])
+    if failures >= tonumber(ARGV[6]) then
+        -- خطای دوباره در حالت نیمه‌باز، زمان استراحت را از نو شروع می‌کند و آزمایش بعدی آزاد می‌شود
+        redis.call('HSET', KEYS[1], 'state', 'open', 'opened_at', ARGV[4])
+        state = 'open'
+        opened_at = ARGV[4]
+        redis.call('DEL', KEYS[2])
+    end
+end
+return {prev_state, state, opened_at, failures}
+"""
+
+
+def _decode(raw: Dict[bytes, bytes]) -> Dict[str, str]:
+    return {k.decode("utf-8"): v.decode("utf-8") for k, v in raw.items()}
+
+
+def _effective_state(state: str, opened_at: float) -> str:
+    """بعد از گذشت زمان استراحت، کلید نیمه‌باز می‌شود تا درخواست آزمایشی عبور کند"""
+    if state == STATE_OPEN and time.time() - opened_at >= settings.NODE_BREAKER_COOLDOWN:
+        return STATE_HALF_OPEN
+    return state
+
+
+def _score(error_rate: float, latency_ms: Optional[float]) -> int:
+    """امتیاز سلامت 0 تا 100: نرخ موفقیت، با جریمه برای تاخیر بیشتر از حد هدف"""
+    score = 100 * (1 - error_rate)
+    if latency_ms and latency_ms > settings.NODE_HEALTH_LATENCY_TARGET_MS:
+        score *= settings.NODE_HEALTH_LATENCY_TARGET_MS / latency_ms
+    return round(score)
+
+
+async def record_result(node_id: int, ok: bool, latency: float, error: Optional[str] = None) -> None:
+    """
+    ثبت نتیجه یک درخواست به پنل: میانگین نمایی (EWMA) تاخیر و نرخ خطا بروزرسانی می‌شود
+    و بعد از NODE_BREAKER_FAILURE_THRESHOLD خطای پشت‌سرهم، کلید نود باز می‌شود (همه در یک اسکریپت اتمی).
+    """
+    try:
+        redis = get_redis()
+        script = redis.register_script(_RECORD_RESULT_LUA)
+        prev_state, state, opened_at, failures = await script(
+            keys=[_key(node_id), _probe_key(node_id)],
+            args=[
+                1 if ok else 0, latency * 1000, (error or "")[:200], time.time(),
+                settings.NODE_HEALTH_EWMA_ALPHA, settings.NODE_BREAKER_FAILURE_THRESHOLD,
+            ],
+        )
+        prev_state, state = prev_state.decode("utf-8"), state.decode("utf-8")
+        if state != prev_state:
+            if state == STATE_CLOSED:
+                print(f"Circuit closed for node {node_id}")
+            else:
+                print(f"Circuit opened for node {node_id} after {failures} failures: {error}")
+        _local_states[node_id] = (state, float(opened_at), time.monotonic())
+    except RedisError as e:
+        print(f"Node health store unavailable for node {node_id}: {e}")
+
+
+async def unavailable_nodes(node_ids: Iterable[int]) -> Set[int]:
+    """
+    نودهایی که کلیدشان باز است (و هنوز زمان استراحتشان تمام نشده، یا نیمه‌باز است و آزمایش آن دست دیگری است)
+    تا فراخواننده فوراً از آن‌ها بگذرد.
+    اگر ردیس در دسترس نبود، هیچ نودی کنار گذاشته نمی‌شود.
+    """
+    node_ids = set(node_ids)
+    states = {}
+    missing = []
+    for node_id in node_ids:
+        cached = _local_states.get(node_id)
+        if cached and time.monotonic() - cached[2] < settings.NODE_HEALTH_LOCAL_TTL:
+            states[node_id] = cached[:2]
+        else:
+            missing.append(node_id)
+
+    if missing:
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for node_id in missing:
+                pipe.hmget(_key(node_id), "state", "opened_at")
+            for node_id, (state, opened_at) in zip(missing, await pipe.execute()):
+                state = state.decode("utf-8") if state else STATE_CLOSED
+                opened_at = float(opened_at) if opened_at else 0.0
+                _local_states[node_id] = (state, opened_at, time.monotonic())
+                states[node_id] = (state, opened_at)
+        except RedisError as e:
+            print(f"Node health store unavailable: {e}")
+
+    down = set()
+    half_open = []
+    for n_id, (state, opened_at) in states.items():
+        effective = _effective_state(state, opened_at)
+        if effective == STATE_OPEN:
+            down.add(n_id)
+        elif effective == STATE_HALF_OPEN:
+            half_open.append(n_id)
+
+    # در حالت نیمه‌باز فقط یک فراخواننده (برنده SET NX) درخواست آزمایشی می‌فرستد؛ بقیه نود را هنوز قطع می‌بینند.
+    # نتیجه آن درخواست در record_result کلید را می‌بندد یا دوباره باز می‌کند و توکن را آزاد می‌کند.
+    if half_open:
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for n_id in half_open:
+                pipe.set(_probe_key(n_id), 1, nx=True, ex=settings.NODE_BREAKER_PROBE_TTL)
+            for n_id, acquired in zip(half_open, await pipe.execute()):
+                if not acquired:
+                    down.add(n_id)
+        except RedisError as e:
+            print(f"Node health store unavailable: {e}")
+    return down
+
+
+async def get_health(node_ids: Iterable[int]) -> Dict[int, dict]:
+    """وضعیت کامل سلامت نودها برای نمایش در API"""
+    node_ids = list(node_ids)
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for node_id in node_ids:
+            pipe.hgetall(_key(node_id))
+        results = await pipe.execute()
+    except RedisError as e:
+        print(f"Node health store unavailable: {e}")
+        return {node_id: {
+            "state": STATE_UNKNOWN, "score": None, "latency_ms": None, "error_rate": None,
+            "consecutive_failures": None, "last_checked_at": None, "last_error": None,
+        } for node_id in node_ids}
+
+    health = {}
+    for node_id, raw in zip(node_ids, results):
+        data = _decode(raw)
+        error_rate = float(data.get("error_rate", 0))
+        latency_ms = float(data["latency_ms"]) if "latency_ms" in data else None
+        last_checked_at = float(data.get("last_checked_at", 0))
+        health[node_id] = {
+            "state": _effective_state(data.get("state", STATE_CLOSED), float(data.get("opened_at", 0))),
+            "score": _score(error_rate, latency_ms),
+            "latency_ms": round(latency_ms, 1) if latency_ms is not None else None,
+            "error_rate": round(error_rate, 3),
+            "consecutive_failures": int(data.get("failures", 0)),
+            "last_checked_at": datetime.utcfromtimestamp(last_checked_at).isoformat() if last_checked_at else None,
+            "last_error": data.get("last_error") or None,
+        }
+    return health
@@ -0,0 +1,22 @@
+# app/services/node_limiter.py
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict
+
+
+class NodeLimiter:
+    """
+    محدودکننده همزمانی درخواست‌ها به پنل‌ها: یک سقف کلی و یک سقف جداگانه برای هر نود،
+    تا یک پنل کند همه ظرفیت را اشغال نکند و بقیه نودها منتظر آن نمانند.
+    """
+
+    def __init__(self, total: int, per_node: int):
+        self._total = asyncio.Semaphore(total)
+        self._per_node: Dict[int, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(per_node))
+
+    @asynccontextmanager
+    async def slot(self, node_id: int) -> AsyncIterator[None]:
+        async with self._per_node[node_id]:
+            async with self._total:
+                yield
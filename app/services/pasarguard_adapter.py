@@ -1,7 +1,7 @@
 # app/services/pasarguard_adapter.py
-import httpx
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 from app.models import Node
+from app.services.http_pool import get_client
 
 class PasarguardAdapter:
     def __init__(self, node: Node):
@@ -10,19 +10,19 @@ class PasarguardAdapter:
         """
         self.base_url = node.api_url.rstrip("/")
         self.api_token = node.api_token
+        self.client = get_client(node)
         self.headers = {"Accept": "application/json"}
         if self.api_token:
             self.headers["Authorization"] = f"Bearer {self.api_token}"
 
     async def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None) -> Dict[str, Any]:
         url = f"{self.base_url}{endpoint}"
-        async with httpx.AsyncClient(verify=False) as client:
-            response = await client.request(method=method, url=url, headers=self.headers, json=data)
-            response.raise_for_status()
-            try:
-                return response.json()
-            except ValueError:
-                return {"detail": response.text}
+        response = await self.client.request(method=method, url=url, headers=self.headers, json=data)
+        response.raise_for_status()
+        try:
+            return response.json()
+        except ValueError:
+            return {"detail": response.text}
 
     async def create_user(self, username: str, expire: int, data_limit: int, proxy_settings: Dict) -> Dict:
         """
@@ -42,6 +42,29 @@ class PasarguardAdapter:
         """دریافت اطلاعات کاربر از پاسارگاد"""
         return await self._make_request("GET", f"/api/user/{username}")
 
+    async def get_user_usage(self, username: str) -> Optional[int]:
+        """مصرف خام یک کاربر (برای نودهایی که تعداد کاربران سررسیدشان کم است و لیست کامل نمی‌ارزد)"""
+        user_data = await self.get_user(username)
+        # پاسخ بدون شمارنده معتبر (مثلاً بدنه غیر JSON) یعنی «خوانده نشد»، نه مصرف صفر؛
+        # صفر در حسابداری دلتا ریست شمارنده حساب می‌شد و خوانش بعدی کل مصرف را دوباره اضافه می‌کرد
+        used = user_data.get("used_traffic")
+        return used if isinstance(used, int) else None
+
+    async def get_users_usage_page(self, offset: int, limit: int) -> Tuple[Dict[str, int], int]:
+        """
+        یک صفحه از لیست کاربران پاسارگاد (برای سینک انبوه مصرف به جای get_user تک‌تک)
+        خروجی: (نام کاربری -> used_traffic، تعداد کل کاربران نود)
+        """
+        data = await self._make_request("GET", f"/api/users?offset={offset}&limit={limit}")
+        if not isinstance(data, dict):
+            return {}, 0
+        # کاربری که شمارنده معتبر ندارد در خروجی نمی‌آید تا مثل get_user_usage «خوانده‌نشده» حساب شود
+        usage = {
+            u["username"]: u["used_traffic"] for u in data.get("users", [])
+            if isinstance(u, dict) and "username" in u and isinstance(u.get("used_traffic"), int)
+        }
+        return usage, data.get("total", 0)
+
     async def modify_user(self, username: str, data_limit: int, expire: int) -> Dict:
         """ویرایش حجم و زمان"""
         payload = {"data_limit": data_limit, "expire": expire}
@@ -56,8 +79,12 @@ class PasarguardAdapter:
         payload = {"status": "disabled"}
         return await self._make_request("PUT", f"/api/user/{username}", data=payload)
 
+    def extract_subscription_link(self, username: str, user_data: Dict) -> str:
+        """استخراج لینک ساب از اطلاعات کاربر (خروجی ساخت یا دریافت کاربر)"""
+        # پاسارگاد لینک ساب را معمولاً در فیلد subscription_url برمی‌گرداند
+        return user_data.get("subscription_url", "")
+
     async def get_subscription_link(self, username: str) -> str:
         """دریافت لینک ساب از پاسارگاد"""
         user_data = await self.get_user(username)
-        # پاسارگاد لینک ساب را معمولاً در فیلد subscription_url برمی‌گرداند
-        return user_data.get("subscription_url", "")
+        return self.extract_subscription_link(username, user_data)
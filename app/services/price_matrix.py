@@ -0,0 +1,61 @@
+# app/services/price_matrix.py
+import json
+from typing import Dict, Tuple
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.redis import get_redis
+from app.models import NodeAllocation, Reseller
+
+# node_id -> (قیمت هر گیگ، قیمت هر روز)
+PriceMatrix = Dict[int, Tuple[int, int]]
+
+
+def _key(reseller_id: int) -> str:
+    return f"guardino:price_matrix:{reseller_id}"
+
+
+async def _build_price_matrix(db: AsyncSession, reseller_id: int) -> PriceMatrix:
+    """ماتریس قیمت نماینده با یک کوئری: قیمت اختصاصی هر تخصیص، یا قیمت پایه نماینده اگر تعیین نشده باشد"""
+    result = await db.execute(
+        select(NodeAllocation.node_id, NodeAllocation.custom_price_per_gb, NodeAllocation.custom_price_per_day,
+               Reseller.base_price_master_sub)
+        .join(Reseller, Reseller.id == NodeAllocation.reseller_id)
+        .where(NodeAllocation.reseller_id == reseller_id)
+    )
+    matrix = {}
+    for node_id, price_gb, price_day, base_price in result.all():
+        matrix[node_id] = (
+            price_gb if price_gb is not None else base_price,
+            price_day if price_day is not None else 0,
+        )
+    return matrix
+
+
+async def get_price_matrix(db: AsyncSession, reseller_id: int) -> PriceMatrix:
+    """
+    ماتریس قیمت نماینده از کش ردیس (و در صورت نبود، ساخت و ذخیره آن).
+    فقط نودهایی که به نماینده تخصیص داده شده‌اند در ماتریس هستند.
+    """
+    try:
+        raw = await get_redis().get(_key(reseller_id))
+        if raw:
+            return {int(node_id): tuple(prices) for node_id, prices in json.loads(raw).items()}
+    except RedisError as e:
+        print(f"Price matrix cache unavailable for reseller {reseller_id}: {e}")
+
+    matrix = await _build_price_matrix(db, reseller_id)
+    try:
+        await get_redis().set(_key(reseller_id), json.dumps(matrix), ex=settings.PRICE_MATRIX_CACHE_TTL)
+    except RedisError:
+        pass
+    return matrix
+
+
+async def invalidate_price_matrix(reseller_id: int) -> None:
+    """حذف کش ماتریس قیمت (بعد از تغییر تخصیص‌ها یا قیمت پایه نماینده)"""
+    try:
+        await get_redis().delete(_key(reseller_id))
+    except RedisError as e:
+        print(f"Failed to invalidate price matrix for reseller {reseller_id}: {e}")
@@ -0,0 +1,91 @@
+# app/services/provisioning.py
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict
+from redis.exceptions import RedisError
+from app.core.redis import get_redis
+from app.models import ProvisioningJob, ProvisioningJobStatus
+
+# وضعیت ساخت روی هر نود در node_results
+NODE_PENDING = "pending"
+NODE_CREATING = "creating"
+NODE_DONE = "done"
+NODE_FAILED = "failed"
+
+FINISHED_STATUSES = (ProvisioningJobStatus.SUCCEEDED, ProvisioningJobStatus.FAILED)
+
+
+def job_channel(job_id: str) -> str:
+    return f"guardino:job:{job_id}"
+
+
+def initial_node_results(nodes) -> Dict[str, dict]:
+    return {str(n.id): {"name": n.display_name, "status": NODE_PENDING, "error": None} for n in nodes}
+
+
+async def notify_job_update(job_id: str) -> None:
+    """اطلاع به درخواست‌های Long-Poll که وضعیت کار تغییر کرده است"""
+    try:
+        await get_redis().publish(job_channel(job_id), b"1")
+    except RedisError as e:
+        print(f"Failed to publish job update for {job_id}: {e}")
+
+
+@asynccontextmanager
+async def job_updates(job_id: str):
+    """
+    اشتراک روی کانال تغییرات کار. باید قبل از خواندن وضعیت از دیتابیس باز شود
+    تا تغییری که بین خواندن و انتظار رخ می‌دهد از دست نرود. اگر ردیس در دسترس نبود None می‌دهد.
+    """
+    pubsub = None
+    try:
+        pubsub = get_redis().pubsub()
+        await pubsub.subscribe(job_channel(job_id))
+    except RedisError as e:
+        print(f"Job updates unavailable for {job_id}: {e}")
+        pubsub = None
+    try:
+        yield pubsub
+    finally:
+        if pubsub is not None:
+            try:
+                await pubsub.unsubscribe()
+                await pubsub.close()
+            except RedisError:
+                pass
+
+
+async def wait_for_job_update(pubsub, timeout: float) -> None:
+    """انتظار تا اولین پیام تغییر یا پایان مهلت (بدون ردیس، نظرسنجی هر یک ثانیه)"""
+    if pubsub is None:
+        await asyncio.sleep(min(timeout, 1.0))
+        return
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            if await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining) is not None:
+                return
+    except RedisError:
+        await asyncio.sleep(min(max(deadline - loop.time(), 0), 1.0))
+
+
+def job_view(job: ProvisioningJob) -> dict:
+    nodes = job.node_results or {}
+    return {
+        "job_id": job.id,
+        "username": job.username,
+        "status": job.status,
+        "total_cost": job.total_cost,
+        "nodes": [
+            {"node_id": int(n_id), "name": r.get("name"), "status": r["status"], "error": r.get("error")}
+            for n_id, r in nodes.items()
+        ],
+        "completed_nodes": sum(1 for r in nodes.values() if r["status"] == NODE_DONE),
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -0,0 +1,80 @@
+# app/services/subscription_cache.py
+import asyncio
+import struct
+import time
+import zlib
+from typing import Optional, Tuple
+from redis.exceptions import RedisError
+from app.core.config import settings
+from app.core.redis import get_redis
+
+# هدر هر رکورد کش: زمان دریافت از پنل (float)
+_HEADER = struct.Struct("!d")
+
+# دسته‌بندی کلاینت‌ها بر اساس User-Agent (پنل‌ها برای هر دسته خروجی متفاوتی می‌سازند)
+_UA_CLASSES = (
+    ("clash_meta", ("clash.meta", "clash-meta", "clashmeta", "clash-verge", "mihomo", "flclash")),
+    ("clash", ("clash", "stash")),
+    ("singbox", ("sing-box", "sfa", "sfi", "sfm", "sft", "karing", "hiddify")),
+    ("outline", ("outline",)),
+)
+
+
+def client_class(user_agent: str) -> str:
+    ua = (user_agent or "").lower()
+    for name, markers in _UA_CLASSES:
+        if any(ua.startswith(m) for m in markers):
+            return name
+    # خروجی کلاینت‌های خانواده v2ray به نسخه برنامه هم بستگی دارد (json یا base64)، پس نام و نسخه جزو کلید است
+    product = ua.split(" ", 1)[0][:40]
+    return f"v2ray:{product}" if product else "v2ray"
+
+
+def _key(sub_acc_id: int, ua_class: str) -> str:
+    return f"guardino:subfrag:{sub_acc_id}:{ua_class}"
+
+
+async def get_fragment(sub_acc_id: int, ua_class: str) -> Optional[Tuple[str, float]]:
+    """خروجی: (متن رمزگشایی‌شده، سن رکورد به ثانیه) یا None"""
+    try:
+        raw = await get_redis().get(_key(sub_acc_id, ua_class))
+    except RedisError as e:
+        print(f"Subscription cache unavailable: {e}")
+        return None
+    if not raw:
+        return None
+    (fetched_at,) = _HEADER.unpack_from(raw)
+    body = zlib.decompress(raw[_HEADER.size:]).decode("utf-8")
+    return body, time.time() - fetched_at
+
+
+async def set_fragment(sub_acc_id: int, ua_class: str, body: str) -> None:
+    """ذخیره فشرده آخرین خروجی سالم نود تا سقف hard TTL"""
+    raw = _HEADER.pack(time.time()) + zlib.compress(body.encode("utf-8"))
+    try:
+        await get_redis().set(_key(sub_acc_id, ua_class), raw, ex=settings.SUB_CACHE_HARD_TTL)
+    except RedisError as e:
+        print(f"Failed to cache subscription fragment {sub_acc_id}: {e}")
+
+
+def is_fresh(age: float) -> bool:
+    return age < settings.SUB_CACHE_SOFT_TTL
+
+
+def fragment_lock(sub_acc_id: int, ua_class: str):
+    """قفل ردیس برای اینکه فقط یک ورکر در هر لحظه ساب این نود را از پنل بگیرد"""
+    return get_redis().lock(f"{_key(sub_acc_id, ua_class)}:lock", timeout=settings.SUB_FLIGHT_LOCK_TTL)
+
+
+async def wait_for_fragment(sub_acc_id: int, ua_class: str, timeout: float) -> Optional[str]:
+    """
+    صبر برای ورکری که قفل را گرفته: به محض اینکه رکوردی بعد از شروع انتظار در کش نشست برگردانده می‌شود.
+    اگر تا timeout نرسید None برمی‌گردد.
+    """
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        await asyncio.sleep(0.1)
+        cached = await get_fragment(sub_acc_id, ua_class)
+        if cached and cached[1] <= time.monotonic() - started:
+            return cached[0]
+    return None
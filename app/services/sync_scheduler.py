@@ -0,0 +1,27 @@
+# app/services/sync_scheduler.py
+from datetime import datetime, timedelta
+from typing import Optional
+from app.core.config import settings
+
+
+def next_sync_time(
+    now: datetime, used: int, limit: int, delta: int, last_synced_at: Optional[datetime]
+) -> datetime:
+    """
+    زمان چک بعدی کاربر بر اساس حجم باقی‌مانده و سرعت مصرف اخیر:
+    کاربری که با این سرعت زود به سقف می‌رسد زودتر چک می‌شود و کاربر بیکار یا نامحدود دیرتر.
+    """
+    interval = settings.SYNC_MAX_INTERVAL
+    elapsed = (now - last_synced_at).total_seconds() if last_synced_at else 0
+    if last_synced_at is None and limit > 0:
+        # هنوز سرعت مصرفی نداریم؛ چک بعدی زود انجام می‌شود تا نرخ مصرف معلوم شود
+        interval = settings.SYNC_MIN_INTERVAL
+    elif limit > 0 and delta > 0 and elapsed > 0:
+        rate = delta / elapsed  # بایت بر ثانیه
+        seconds_to_limit = max(limit - used, 0) / rate
+        # نصف زمان باقی‌مانده تا سقف، تا قبل از عبور از سهمیه حتماً یک چک دیگر انجام شود
+        interval = seconds_to_limit / 2
+    elif limit > 0 and used >= limit:
+        interval = settings.SYNC_MIN_INTERVAL
+    interval = min(max(interval, settings.SYNC_MIN_INTERVAL), settings.SYNC_MAX_INTERVAL)
+    return now + timedelta(seconds=interval)
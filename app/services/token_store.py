@@ -0,0 +1,97 @@
+# app/services/token_store.py
+import asyncio
+import hashlib
+import time
+import weakref
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from jose import jwt, JWTError
+from redis.exceptions import RedisError
+from app.core.config import settings
+from app.core.redis import get_redis
+
+# کش محلی هر پروسه: کلید نود -> (توکن، زمان انقضا)
+_local_tokens: Dict[str, Tuple[str, float]] = {}
+# قفل‌های asyncio به حلقه رویداد وابسته‌اند، پس برای هر حلقه جداگانه نگه‌داری می‌شوند
+_loop_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Lock]]" = weakref.WeakKeyDictionary()
+
+
+def token_key(node_id: int, api_url: str, credentials: str) -> str:
+    """کلید ذخیره توکن؛ با تغییر آدرس یا رمز نود، کلید هم عوض می‌شود"""
+    digest = hashlib.sha256(f"{api_url}|{credentials}".encode("utf-8")).hexdigest()[:16]
+    return f"guardino:marzban_token:{node_id}:{digest}"
+
+
+def token_expiry(token: str) -> float:
+    """خواندن زمان انقضای JWT بدون اعتبارسنجی امضا"""
+    try:
+        exp = jwt.get_unverified_claims(token).get("exp")
+        if exp:
+            return float(exp)
+    except JWTError:
+        pass
+    return time.time() + settings.MARZBAN_TOKEN_DEFAULT_TTL
+
+
+def _is_fresh(expires_at: float) -> bool:
+    return expires_at - settings.MARZBAN_TOKEN_REFRESH_MARGIN > time.time()
+
+
+def _get_lock(key: str) -> asyncio.Lock:
+    locks = _loop_locks.setdefault(asyncio.get_running_loop(), {})
+    if key not in locks:
+        locks[key] = asyncio.Lock()
+    return locks[key]
+
+
+async def _read_shared(key: str, rejected: Optional[str]) -> Optional[Tuple[str, float]]:
+    raw = await get_redis().get(key)
+    if not raw:
+        return None
+    token = raw.decode("utf-8")
+    expires_at = token_expiry(token)
+    if token == rejected or not _is_fresh(expires_at):
+        return None
+    return token, expires_at
+
+
+async def _login_and_store(key: str, login: Callable[[], Awaitable[str]]) -> Tuple[str, float]:
+    token = await login()
+    expires_at = token_expiry(token)
+    ttl = int(expires_at - time.time())
+    if ttl > 0:
+        await get_redis().set(key, token, ex=ttl)
+    return token, expires_at
+
+
+async def get_cached_token(key: str, login: Callable[[], Awaitable[str]], rejected: Optional[str] = None) -> str:
+    """
+    دریافت توکن ادمین از کش (محلی، سپس ردیس) و در صورت نیاز لاگین مجدد.
+    rejected توکنی است که پنل آن را رد کرده (401) و نباید دوباره استفاده شود.
+    در هر لحظه فقط یک لاگین برای هر نود انجام می‌شود (قفل محلی + قفل ردیس).
+    """
+    cached = _local_tokens.get(key)
+    if cached and cached[0] != rejected and _is_fresh(cached[1]):
+        return cached[0]
+
+    async with _get_lock(key):
+        # شاید درخواست دیگری در همین پروسه توکن را تازه کرده باشد
+        cached = _local_tokens.get(key)
+        if cached and cached[0] != rejected and _is_fresh(cached[1]):
+            return cached[0]
+
+        try:
+            shared = await _read_shared(key, rejected)
+            if shared is None:
+                async with get_redis().lock(f"{key}:lock", timeout=30, blocking_timeout=15):
+                    # شاید پروسه دیگری (API یا ورکر) در این فاصله لاگین کرده باشد
+                    shared = await _read_shared(key, rejected)
+                    if shared is None:
+                        shared = await _login_and_store(key, login)
+        except RedisError as e:
+            # اگر ردیس در دسترس نبود، لاگین مستقیم انجام می‌شود تا سرویس متوقف نشود
+            print(f"Token store unavailable for {key}: {e}")
+            token = await login()
+            shared = (token, token_expiry(token))
+
+        _local_tokens[key] = shared
+        return shared[0]
@@ -0,0 +1,134 @@
+# app/services/usage_accounting.py
+from typing import Dict, List, Iterable
+from sqlalchemy import BigInteger, DateTime, select, update, bindparam, case, func, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import GuardinoUser, SubAccount, UserStatus
+
+_subs = SubAccount.__table__
+_users = GuardinoUser.__table__
+
+# مصرف به صورت دلتا جمع می‌شود: اگر شمارنده خام پنل کمتر از مبنای قبلی شد (ریست مصرف یا بازسازی نود)
+# کل مقدار جدید به عنوان مصرف تازه حساب می‌شود و مصرف قبلی از دست نمی‌رود.
+# محاسبه دلتا داخل خود دیتابیس انجام می‌شود تا سینک و وب‌هوک‌های همزمان مصرف را دوبار نشمارند.
+_raw = bindparam("b_raw", type_=BigInteger)
+_apply_delta_stmt = (
+    update(_subs)
+    .where(_subs.c.id == bindparam("b_id"))
+    .values(
+        used_traffic=_subs.c.used_traffic + case(
+            (_raw >= _subs.c.last_raw_traffic, _raw - _subs.c.last_raw_traffic),
+            else_=_raw,
+        ),
+        last_raw_traffic=_raw,
+    )
+)
+
+# رخدادهای وب‌هوک ممکن است تکراری، با تأخیر یا خارج از ترتیب برسند؛ پس:
+# - رخدادی که زمانش از آخرین رخداد پذیرفته‌شده همان ساب‌اکانت قدیمی‌تر است کنار گذاشته می‌شود
+# - شمارنده کمتر فقط در رخداد صریح ریست (data_usage_reset و ساخت دوباره کاربر) به معنی ریست است؛
+#   در بقیه رخدادها شمارنده کمتر یعنی گزارش کهنه و نادیده گرفته می‌شود
+_at = bindparam("b_at", type_=DateTime)
+_fresh_event = or_(_subs.c.last_event_at.is_(None), _subs.c.last_event_at < _at)
+_apply_event_stmt = (
+    update(_subs)
+    .where(_subs.c.id == bindparam("b_id"), _fresh_event, _raw >= _subs.c.last_raw_traffic)
+    .values(
+        used_traffic=_subs.c.used_traffic + (_raw - _subs.c.last_raw_traffic),
+        last_raw_traffic=_raw,
+        last_event_at=_at,
+    )
+)
+_apply_reset_event_stmt = (
+    update(_subs)
+    .where(_subs.c.id == bindparam("b_id"), _fresh_event)
+    .values(
+        used_traffic=_subs.c.used_traffic + _raw + bindparam("b_extra", type_=BigInteger),
+        last_raw_traffic=_raw,
+        last_event_at=_at,
+    )
+)
+
+
+async def _lock_totals(db: AsyncSession, user_ids: List[int]) -> Dict[int, int]:
+    # قفل ردیف کاربران تا دلتای هر دور دقیقاً به همان دور نسبت داده شود
+    old_totals = await db.execute(
+        select(_users.c.id, _users.c.used_traffic).where(_users.c.id.in_(user_ids)).with_for_update()
+    )
+    return {row.id: row.used_traffic or 0 for row in old_totals}
+
+
+async def _refresh_totals(db: AsyncSession, user_ids: List[int], previous: Dict[int, int]) -> Dict[int, int]:
+    """بازمحاسبه مجموع مصرف کاربران از ساب‌اکانت‌ها با یک دستور؛ خروجی: مصرف جدید هر کاربر"""
+    total = (
+        select(func.coalesce(func.sum(_subs.c.used_traffic), 0))
+        .where(_subs.c.guardino_user_id == _users.c.id)
+        .scalar_subquery()
+    )
+    new_totals = await db.execute(
+        update(_users).where(_users.c.id.in_(user_ids)).values(used_traffic=total)
+        .returning(_users.c.id, _users.c.used_traffic)
+    )
+    deltas = {}
+    for row in new_totals:
+        delta = row.used_traffic - previous.get(row.id, 0)
+        if delta > 0:
+            deltas[row.id] = delta
+    return deltas
+
+
+async def apply_usage_readings(db: AsyncSession, readings: Dict[int, int], user_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    اعمال شمارنده‌های خام پنل‌ها (sub_account_id -> raw) به صورت دسته‌ای
+    و بازمحاسبه مجموع مصرف کاربران مربوطه با یک دستور.
+    خروجی: مصرف جدید هر کاربر در همین دور (user_id -> بایت) برای ثبت در تاریخچه
+    """
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return {}
+
+    previous = await _lock_totals(db, user_ids)
+    if readings:
+        await db.execute(_apply_delta_stmt, [{"b_id": sub_id, "b_raw": raw} for sub_id, raw in readings.items()])
+    return await _refresh_totals(db, user_ids, previous)
+
+
+async def apply_event_readings(db: AsyncSession, readings: Dict[int, list], user_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    اعمال شمارنده‌های رسیده از وب‌هوک (sub_account_id -> [قبل از ریست (raw، زمان)، بعد از ریست (raw، زمان، مصرف اضافه)]).
+    برخلاف سینک دوره‌ای، ترتیب رخدادها با last_event_at هر ساب‌اکانت کنترل می‌شود؛
+    شمارنده قبل از ریست زودتر اعمال می‌شود چون زمانش از رخداد ریست قدیمی‌تر است.
+    """
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return {}
+
+    previous = await _lock_totals(db, user_ids)
+    normal = [
+        {"b_id": sub_id, "b_raw": before[0], "b_at": before[1]}
+        for sub_id, (before, _) in readings.items() if before is not None
+    ]
+    resets = [
+        {"b_id": sub_id, "b_raw": after[0], "b_at": after[1], "b_extra": after[2]}
+        for sub_id, (_, after) in readings.items() if after is not None
+    ]
+    if normal:
+        await db.execute(_apply_event_stmt, normal)
+    if resets:
+        await db.execute(_apply_reset_event_stmt, resets)
+    return await _refresh_totals(db, user_ids, previous)
+
+
+async def find_over_quota(db: AsyncSession, user_ids: List[int]) -> List:
+    """کاربران فعالی که مجموع مصرف پیش‌محاسبه‌شده‌شان به سقف رسیده (حجم 0 یعنی نامحدود)"""
+    if not user_ids:
+        return []
+    query = await db.execute(
+        select(GuardinoUser.id, GuardinoUser.username)
+        .where(
+            GuardinoUser.id.in_(user_ids),
+            GuardinoUser.status == UserStatus.ACTIVE,
+            GuardinoUser.purchased_data_limit > 0,
+            GuardinoUser.used_traffic >= GuardinoUser.purchased_data_limit,
+        )
+    )
+    return query.all()
@@ -0,0 +1,113 @@
+# app/services/usage_history.py
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import select, delete, func, literal, cast
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.models import UsageSample, UsageRollup, UsageGranularity
+
+SAMPLE_INTERVAL_MINUTES = 5
+
+
+def sample_bucket(now: Optional[datetime] = None) -> datetime:
+    """شروع بازه 5 دقیقه‌ای فعلی (UTC)"""
+    now = now or datetime.utcnow()
+    return now.replace(minute=now.minute - now.minute % SAMPLE_INTERVAL_MINUTES, second=0, microsecond=0)
+
+
+async def record_usage_samples(db: AsyncSession, deltas: Dict[int, int], reseller_of: Dict[int, int]) -> None:
+    """
+    ثبت دلتای مصرف کاربران در بازه فعلی؛ اگر در همین بازه قبلاً نمونه‌ای بوده، با آن جمع می‌شود.
+    deltas: user_id -> بایت، reseller_of: user_id -> reseller_id
+    """
+    if not deltas:
+        return
+    bucket = sample_bucket()
+    stmt = insert(UsageSample).values([
+        {"guardino_user_id": user_id, "bucket": bucket, "reseller_id": reseller_of[user_id], "bytes": delta}
+        for user_id, delta in deltas.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UsageSample.guardino_user_id, UsageSample.bucket],
+        set_={"bytes": UsageSample.bytes + stmt.excluded.bytes},
+    )
+    await db.execute(stmt)
+
+
+async def _upsert_rollup(db: AsyncSession, granularity: UsageGranularity, source, bucket_expr, since: datetime, until: datetime):
+    """تجمیع بازه [since, until) از جدول منبع در سطح granularity (محاسبه مجدد، پس تکرار آن بی‌خطر است)"""
+    rows = (
+        select(
+            cast(literal(granularity.name), UsageRollup.__table__.c.granularity.type).label("granularity"),
+            source.guardino_user_id,
+            bucket_expr.label("bucket"),
+            source.reseller_id,
+            func.sum(source.bytes).label("bytes"),
+        )
+        .where(source.bucket >= since, source.bucket < until)
+        .group_by(source.guardino_user_id, bucket_expr, source.reseller_id)
+    )
+    if source is UsageRollup:
+        rows = rows.where(UsageRollup.granularity == UsageGranularity.HOUR)
+
+    stmt = insert(UsageRollup).from_select(
+        ["granularity", "guardino_user_id", "bucket", "reseller_id", "bytes"], rows
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UsageRollup.granularity, UsageRollup.guardino_user_id, UsageRollup.bucket],
+        set_={"bytes": stmt.excluded.bytes},
+    )
+    await db.execute(stmt)
+
+
+async def rollup_and_prune(db: AsyncSession, now: Optional[datetime] = None) -> None:
+    """
+    نمونه‌های 5 دقیقه‌ای -> ساعتی -> روزانه، سپس حذف داده‌های خام و ساعتی قدیمی.
+    فقط ساعت‌های کامل‌شده تجمیع می‌شوند.
+    """
+    now = now or datetime.utcnow()
+    current_hour = now.replace(minute=0, second=0, microsecond=0)
+    today = current_hour.replace(hour=0)
+
+    hourly_since = current_hour - timedelta(hours=settings.USAGE_ROLLUP_LOOKBACK_HOURS)
+    await _upsert_rollup(
+        db, UsageGranularity.HOUR, UsageSample, func.date_trunc("hour", UsageSample.bucket), hourly_since, current_hour
+    )
+
+    # روز جاری هم (تا ساعت کامل‌شده فعلی) محاسبه می‌شود تا نمودار روزانه به‌روز بماند
+    daily_since = today - timedelta(days=1)
+    await _upsert_rollup(
+        db, UsageGranularity.DAY, UsageRollup, func.date_trunc("day", UsageRollup.bucket), daily_since, current_hour
+    )
+
+    await db.execute(delete(UsageSample).where(
+        UsageSample.bucket < now - timedelta(hours=settings.USAGE_RAW_RETENTION_HOURS)
+    ))
+    await db.execute(delete(UsageRollup).where(
+        UsageRollup.granularity == UsageGranularity.HOUR,
+        UsageRollup.bucket < now - timedelta(days=settings.USAGE_HOURLY_RETENTION_DAYS),
+    ))
+    await db.execute(delete(UsageRollup).where(
+        UsageRollup.granularity == UsageGranularity.DAY,
+        UsageRollup.bucket < now - timedelta(days=settings.USAGE_DAILY_RETENTION_DAYS),
+    ))
+
+
+async def query_series(
+    db: AsyncSession, granularity: UsageGranularity, since: datetime,
+    user_id: Optional[int] = None, reseller_id: Optional[int] = None,
+) -> List[dict]:
+    """سری زمانی مصرف یک کاربر یا مجموع کاربران یک نماینده از جدول تجمیع"""
+    stmt = (
+        select(UsageRollup.bucket, func.sum(UsageRollup.bytes).label("bytes"))
+        .where(UsageRollup.granularity == granularity, UsageRollup.bucket >= since)
+        .group_by(UsageRollup.bucket)
+        .order_by(UsageRollup.bucket)
+    )
+    if user_id is not None:
+        stmt = stmt.where(UsageRollup.guardino_user_id == user_id)
+    if reseller_id is not None:
+        stmt = stmt.where(UsageRollup.reseller_id == reseller_id)
+    result = await db.execute(stmt)
+    return [{"bucket": row.bucket.isoformat(), "bytes": int(row.bytes)} for row in result]
@@ -0,0 +1,181 @@
+# app/services/usage_ingest.py
+import hashlib
+from datetime import datetime
+from typing import Dict, List, Tuple
+from redis.exceptions import RedisError
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.redis import get_redis
+from app.models import GuardinoUser, SubAccount, UserStatus
+from app.services.usage_accounting import apply_event_readings, find_over_quota
+from app.services.usage_history import record_usage_samples
+from app.services.sync_scheduler import next_sync_time
+from app.services.node_commands import enqueue_suspends
+
+# رخدادهای تکراری (ارسال مجدد وب‌هوک) تا این مدت شناسایی می‌شوند
+DEDUP_TTL = 86400
+
+
+def _event_id(node_id: int, event: dict) -> str:
+    user = event.get("user") or {}
+    parts = (
+        node_id, event.get("action"), event.get("username") or user.get("username"),
+        event.get("enqueued_at"), event.get("used_traffic", user.get("used_traffic")),
+    )
+    return hashlib.sha1("|".join(map(str, parts)).encode("utf-8")).hexdigest()
+
+
+async def drop_duplicates(node_id: int, events: List[dict]) -> List[dict]:
+    """حذف رخدادهایی که قبلاً دریافت شده‌اند (بر اساس شناسه محاسبه‌شده در ردیس)"""
+    if not events:
+        return []
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for event in events:
+            pipe.set(f"guardino:ingest:{_event_id(node_id, event)}", 1, nx=True, ex=DEDUP_TTL)
+        fresh = await pipe.execute()
+    except RedisError as e:
+        # اعمال مصرف بر پایه شمارنده خام است و تکرار آن دلتای صفر می‌دهد؛ پس بدون ردیس هم بی‌خطر ادامه می‌دهیم
+        print(f"Ingest dedup unavailable: {e}")
+        return events
+    return [event for event, is_new in zip(events, fresh) if is_new]
+
+
+# رخدادهایی که شمارنده پنل را صفر می‌کنند؛ فقط در این‌ها شمارنده کمتر به معنی ریست است
+RESET_ACTIONS = {"data_usage_reset", "user_created"}
+# رخدادهای وضعیت کاربر در پنل (مرزبان/پاسارگاد)
+PANEL_DISABLED_ACTIONS = {"user_disabled", "user_expired", "user_limited", "user_deleted"}
+PANEL_ENABLED_ACTIONS = {"user_enabled"}
+
+# username -> [آخرین شمارنده قبل از ریست (raw، زمان)، آخرین شمارنده بعد از ریست (raw، زمان، مصرف بین ریست‌های قبلی)]
+UsageEvents = Dict[str, list]
+# username -> (نوع رخداد، زمان رخداد)
+StatusEvents = Dict[str, Tuple[str, datetime]]
+
+
+def _event_time(event: dict) -> datetime:
+    """زمان رخداد از enqueued_at پنل (ثانیه یونیکس یا ISO)؛ اگر نبود، زمان دریافت"""
+    value = event.get("enqueued_at")
+    try:
+        if isinstance(value, (int, float)):
+            return datetime.utcfromtimestamp(value)
+        if isinstance(value, str):
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+    except (ValueError, OverflowError, OSError):
+        pass
+    return datetime.utcnow()
+
+
+def collect_events(events: List[dict]) -> Tuple[UsageEvents, StatusEvents]:
+    """
+    جمع‌بندی رخدادهای یک درخواست برای هر کاربر به ترتیب زمان رخداد.
+    هم قالب وب‌هوک مرزبان/پاسارگاد (username + user.used_traffic) و هم قالب ساده {username, used_traffic} پذیرفته می‌شود.
+    اگر در دسته رخداد ریستی بوده، مصرف تا قبل از ریست و مصرف بعد از آن (از صفر) جدا نگه داشته می‌شوند.
+    """
+    usage: UsageEvents = {}
+    statuses: StatusEvents = {}
+    timed = sorted(((_event_time(e), i, e) for i, e in enumerate(events)), key=lambda t: (t[0], t[1]))
+    for at, _, event in timed:
+        user = event.get("user") or {}
+        username = event.get("username") or user.get("username")
+        if not username:
+            continue
+        action = event.get("action")
+        if action in PANEL_DISABLED_ACTIONS or action in PANEL_ENABLED_ACTIONS:
+            statuses[username] = (action, at)
+        used = event.get("used_traffic", user.get("used_traffic"))
+        if used is None or action == "user_deleted":
+            continue
+        state = usage.setdefault(username, [None, None])
+        if action in RESET_ACTIONS:
+            # مصرف بین دو ریست داخل همین دسته هم از دست نمی‌رود
+            carry = state[1][0] + state[1][2] if state[1] else 0
+            state[1] = (int(used), at, carry)
+        elif state[1] is not None:
+            state[1] = (int(used), at, state[1][2])
+        else:
+            state[0] = (int(used), at)
+    return usage, statuses
+
+
+async def ingest_node_usage(db: AsyncSession, node_id: int, usage: UsageEvents) -> int:
+    """
+    اعمال دسته‌ای مصرف گزارش‌شده یک نود (همان حسابداری دلتای سینک، با کنترل ترتیب رخدادها).
+    کاربرانی که از سهمیه عبور کرده‌اند غیرفعال و دستور مسدودی ساب‌اکانت‌هایشان در صف نودها ثبت می‌شود.
+    خروجی: تعداد دستورات مسدودی ثبت‌شده
+    """
+    if not usage:
+        return 0
+    subs_query = await db.execute(
+        select(SubAccount.id, SubAccount.guardino_user_id, SubAccount.remote_identifier,
+               SubAccount.last_raw_traffic, GuardinoUser.reseller_id, GuardinoUser.used_traffic,
+               GuardinoUser.purchased_data_limit, GuardinoUser.last_synced_at)
+        .join(GuardinoUser, GuardinoUser.id == SubAccount.guardino_user_id)
+        .where(SubAccount.node_id == node_id, SubAccount.remote_identifier.in_(list(usage)))
+    )
+    subs = subs_query.all()
+
+    readings = {s.id: usage[s.remote_identifier] for s in subs}
+    users = {s.guardino_user_id: s for s in subs}
+    deltas = await apply_event_readings(db, readings, list(users))
+    await record_usage_samples(db, deltas, {uid: s.reseller_id for uid, s in users.items()})
+
+    # داده تازه رسیده؛ سینک دوره‌ای این کاربران به تعویق می‌افتد و فقط کمبودها را جبران می‌کند
+    now = datetime.utcnow()
+    if users:
+        await db.execute(update(GuardinoUser), [
+            {
+                "id": uid,
+                "last_synced_at": now,
+                "next_sync_at": next_sync_time(
+                    now, (s.used_traffic or 0) + deltas.get(uid, 0), s.purchased_data_limit,
+                    deltas.get(uid, 0), s.last_synced_at,
+                ),
+            }
+            for uid, s in users.items()
+        ])
+
+    over_quota = await find_over_quota(db, list(users))
+    if not over_quota:
+        return 0
+    over_quota_ids = [u.id for u in over_quota]
+    await db.execute(
+        update(GuardinoUser).where(GuardinoUser.id.in_(over_quota_ids)).values(status=UserStatus.DISABLED)
+    )
+    targets = await db.execute(
+        select(SubAccount.node_id, SubAccount.remote_identifier).where(SubAccount.guardino_user_id.in_(over_quota_ids))
+    )
+    return enqueue_suspends(db, targets.all())
+
+
+async def ingest_status_events(db: AsyncSession, node_id: int, statuses: StatusEvents) -> int:
+    """
+    واکنش به تغییر وضعیت کاربر در خود پنل. وضعیت گاردینو مرجع است:
+    - اگر پنل کاربری را فعال کرد که در گاردینو غیرفعال/منقضی است، دستور مسدودی دوباره در صف ثبت می‌شود
+    - اگر پنل کاربر فعالی را غیرفعال، منقضی، محدود یا حذف کرد، سینک همان کاربر فوراً انجام می‌شود
+      تا مصرف نهایی و سهمیه‌اش چک شود (ساخت دوباره کاربر حذف‌شده خودکار نیست و فقط گزارش می‌شود)
+    خروجی: تعداد دستورات مسدودی ثبت‌شده
+    """
+    if not statuses:
+        return 0
+    subs_query = await db.execute(
+        select(SubAccount.guardino_user_id, SubAccount.remote_identifier, GuardinoUser.status)
+        .join(GuardinoUser, GuardinoUser.id == SubAccount.guardino_user_id)
+        .where(SubAccount.node_id == node_id, SubAccount.remote_identifier.in_(list(statuses)))
+    )
+    resuspend = []
+    reconcile = set()
+    for sub in subs_query.all():
+        action, _ = statuses[sub.remote_identifier]
+        if action in PANEL_ENABLED_ACTIONS and sub.status != UserStatus.ACTIVE:
+            resuspend.append((node_id, sub.remote_identifier))
+        elif action in PANEL_DISABLED_ACTIONS and sub.status == UserStatus.ACTIVE:
+            reconcile.add(sub.guardino_user_id)
+            if action == "user_deleted":
+                print(f"Sub-account {sub.remote_identifier} was deleted on node {node_id} while its user is active")
+
+    if reconcile:
+        await db.execute(
+            update(GuardinoUser).where(GuardinoUser.id.in_(reconcile)).values(next_sync_at=datetime.utcnow())
+        )
+    return enqueue_suspends(db, resuspend)
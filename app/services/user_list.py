@@ -0,0 +1,131 @@
+# app/services/user_list.py
+import base64
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, Optional, Tuple
+from sqlalchemy import Select, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.models import GuardinoUser, UserStatus
+
+# ستون‌های خروجی CSV (هم‌نام کلیدهای خروجی JSON)
+CSV_COLUMNS = (
+    "id", "username", "status", "purchased_gb", "used_bytes", "remaining_bytes", "usage_percent",
+    "expire_date", "last_synced_at", "created_at", "sub_link",
+)
+
+# موقعیت صفحه‌بندی Keyset: (created_at، id) آخرین کاربر صفحه قبل
+Cursor = Tuple[datetime, int]
+
+
+def encode_cursor(user: GuardinoUser) -> str:
+    raw = f"{user.created_at.isoformat()}|{user.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    """کرسر نامعتبر ValueError می‌دهد"""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    created_at, user_id = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8").split("|")
+    return datetime.fromisoformat(created_at), int(user_id)
+
+
+def build_users_query(
+    reseller_id: int,
+    status: Optional[UserStatus] = None,
+    username_prefix: Optional[str] = None,
+    expiring_before: Optional[datetime] = None,
+    over_quota: Optional[bool] = None,
+) -> Select:
+    """
+    کوئری کاربران نماینده با فیلترهای سمت سرور (بدون ترتیب و صفحه‌بندی).
+    مصرف از ستون پیش‌محاسبه‌شده used_traffic (جمع ساب‌اکانت‌ها که سینک و وب‌هوک نگه می‌دارند) خوانده می‌شود؛
+    همان مقداری که چک سهمیه رویش اجرا می‌شود، بدون هیچ درخواستی به پنل‌ها.
+    """
+    query = select(GuardinoUser).where(GuardinoUser.reseller_id == reseller_id)
+    if status is not None:
+        query = query.where(GuardinoUser.status == status)
+    if username_prefix:
+        query = query.where(GuardinoUser.username.startswith(username_prefix, autoescape=True))
+    if expiring_before is not None:
+        query = query.where(GuardinoUser.expire_date.is_not(None), GuardinoUser.expire_date < expiring_before)
+    # حجم 0 یعنی نامحدود: چنین کاربری هیچ‌وقت از سهمیه عبور نکرده است (مثل find_over_quota)
+    if over_quota is True:
+        query = query.where(
+            GuardinoUser.purchased_data_limit > 0, GuardinoUser.used_traffic >= GuardinoUser.purchased_data_limit
+        )
+    elif over_quota is False:
+        query = query.where(or_(
+            GuardinoUser.purchased_data_limit == 0, GuardinoUser.used_traffic < GuardinoUser.purchased_data_limit
+        ))
+    return query
+
+
+def page_query(query: Select, after: Optional[Cursor], descending: bool, limit: int) -> Select:
+    """
+    صفحه بعدی به روش Keyset روی (created_at، id): به‌جای OFFSET از مقایسه سطری با آخرین ردیف
+    صفحه قبل استفاده می‌شود تا هزینه هر صفحه مستقل از عمق آن باشد (ایندکس ix_guardino_users_reseller_created)
+    """
+    key = tuple_(GuardinoUser.created_at, GuardinoUser.id)
+    if after is not None:
+        query = query.where(key < tuple_(*after) if descending else key > tuple_(*after))
+    if descending:
+        query = query.order_by(GuardinoUser.created_at.desc(), GuardinoUser.id.desc())
+    else:
+        query = query.order_by(GuardinoUser.created_at.asc(), GuardinoUser.id.asc())
+    return query.limit(limit)
+
+
+def user_row(user: GuardinoUser) -> dict:
+    limit = user.purchased_data_limit
+    used_bytes = user.used_traffic or 0
+    # حجم 0 یعنی نامحدود: باقی‌مانده ندارد (None) و درصد مصرف صفر است
+    return {
+        "id": user.id,
+        "username": user.username,
+        "status": user.status.value,
+        "purchased_gb": round(limit / 1073741824, 2),
+        "used_bytes": used_bytes,
+        "remaining_bytes": max(limit - used_bytes, 0) if limit else None,
+        "usage_percent": round(min(used_bytes / limit * 100, 100), 1) if limit else 0,
+        "expire_date": user.expire_date.isoformat() if user.expire_date else None,
+        "last_synced_at": user.last_synced_at.isoformat() if user.last_synced_at else None,
+        "created_at": user.created_at.isoformat(),
+        "sub_link": f"{settings.SYSTEM_DOMAIN}/sub/{user.sub_token}",
+    }
+
+
+async def iter_users(db: AsyncSession, query: Select, after: Optional[Cursor], descending: bool) -> AsyncIterator[dict]:
+    """پیمایش همه کاربران فیلترشده در دسته‌های Keyset، بدون نگه داشتن کل لیست در حافظه"""
+    batch_size = settings.USERS_EXPORT_BATCH_SIZE
+    while True:
+        result = await db.execute(page_query(query, after, descending, batch_size))
+        users = result.scalars().all()
+        for user in users:
+            yield user_row(user)
+        if len(users) < batch_size:
+            return
+        after = (users[-1].created_at, users[-1].id)
+        # آبجکت‌های دسته قبل از نقشه هویت سشن خارج می‌شوند تا حافظه با تعداد کاربران رشد نکند
+        db.expunge_all()
+
+
+async def stream_ndjson(db: AsyncSession, query: Select, after: Optional[Cursor], descending: bool) -> AsyncIterator[str]:
+    async for row in iter_users(db, query, after, descending):
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+async def stream_csv(db: AsyncSession, query: Select, after: Optional[Cursor], descending: bool) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    async for row in iter_users(db, query, after, descending):
+        writer.writerow(row)
+        # هر چند ردیف یک‌بار بافر خالی می‌شود تا تعداد تکه‌های پاسخ کم بماند
+        if buffer.tell() >= 65536:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
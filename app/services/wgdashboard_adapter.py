@@ -1,7 +1,7 @@
 # app/services/wgdashboard_adapter.py
-import httpx
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 from app.models import Node
+from app.services.http_pool import get_client
 
 class WGDashboardAdapter:
     def __init__(self, node: Node):
@@ -11,6 +11,7 @@ class WGDashboardAdapter:
         self.base_url = node.api_url.rstrip("/")
         # در WGDashboard توکن معمولاً در هدر Authorization ارسال می‌شود
         self.api_token = node.api_token
+        self.client = get_client(node)
         self.headers = {
             "Accept": "application/json",
             "Authorization": f"Bearer {self.api_token}"
@@ -18,13 +19,12 @@ class WGDashboardAdapter:
 
     async def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None) -> Dict[str, Any]:
         url = f"{self.base_url}{endpoint}"
-        async with httpx.AsyncClient(verify=False) as client:
-            response = await client.request(method=method, url=url, headers=self.headers, json=data)
-            response.raise_for_status()
-            try:
-                return response.json()
-            except ValueError:
-                return {"detail": response.text}
+        response = await self.client.request(method=method, url=url, headers=self.headers, json=data)
+        response.raise_for_status()
+        try:
+            return response.json()
+        except ValueError:
+            return {"detail": response.text}
 
     async def create_user(self, username: str) -> Dict:
         """
@@ -42,6 +42,16 @@ class WGDashboardAdapter:
     async def get_user(self, username: str) -> Dict:
         return await self._make_request("GET", f"/api/wireguard/client/{username}")
 
+    async def get_user_usage(self, username: str) -> Optional[int]:
+        """وایرگارد در سینک مصرف شرکت نمی‌کند"""
+        return None
+
+    async def get_users_usage_page(self, offset: int, limit: int) -> Tuple[Dict[str, int], int]:
+        """
+        وایرگارد مصرف قابل اتکایی برای سهمیه گاردینو گزارش نمی‌کند؛ سینک این نود را اصلاً نمی‌خواند (NodeFactory.reports_usage).
+        """
+        return {}, 0
+
     async def delete_user(self, username: str) -> Dict:
         """حذف Peer از وایرگارد"""
         return await self._make_request("DELETE", f"/api/wireguard/client/{username}")
@@ -51,9 +61,13 @@ class WGDashboardAdapter:
         payload = {"enabled": False}
         return await self._make_request("PUT", f"/api/wireguard/client/{username}/status", data=payload)
 
+    def extract_subscription_link(self, username: str, user_data: Dict) -> str:
+        """آدرس کانفیگ وایرگارد ثابت است و به پاسخ پنل نیازی ندارد"""
+        return f"{self.base_url}/api/wireguard/client/{username}/configuration"
+
     async def get_subscription_link(self, username: str) -> str:
         """
         وایرگارد لینک ساب ندارد، بلکه فایل conf. برمی‌گرداند.
         ما آدرس دانلود مستقیم کانفیگ را تولید می‌کنیم تا گاردینو آن را ترکیب کند.
         """
-        return f"{self.base_url}/api/wireguard/client/{username}/configuration"
+        return self.extract_subscription_link(username, {})
@@ -0,0 +1,29 @@
+# app/tasks/command_worker.py
+from app.core.celery_app import celery_app
+from app.core.config import settings
+from app.core.redis import lease
+from app.services.node_commands import dispatch_pending
+from app.services.node_limiter import NodeLimiter
+from app.tasks.sync_worker import run_async
+
+
+async def _async_dispatch_commands() -> int:
+    """تخلیه صف دستورات نودها تا زمانی که دستور سررسیدی باقی نمانده باشد"""
+    async with lease("dispatch_node_commands", settings.SYNC_LEASE_TTL) as acquired:
+        if not acquired:
+            return 0
+        limiter = NodeLimiter(settings.SYNC_MAX_CONCURRENCY, settings.SYNC_NODE_CONCURRENCY)
+        total = 0
+        while True:
+            picked = await dispatch_pending(limiter)
+            if not picked:
+                break
+            total += picked
+        return total
+
+
+@celery_app.task
+def dispatch_node_commands():
+    """اجرای دستورات ثبت‌شده در صف (ساخت، ویرایش، مسدودی و حذف کاربر روی پنل‌ها) با تلاش مجدد"""
+    processed = run_async(_async_dispatch_commands())
+    return f"Dispatched {processed} node commands."
@@ -0,0 +1,62 @@
+# app/tasks/expiry_worker.py
+from datetime import datetime
+from sqlalchemy import select, update
+from app.core.celery_app import celery_app
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.redis import lease
+from app.models import GuardinoUser, UserStatus, SubAccount
+from app.services.node_commands import enqueue_suspends
+from app.tasks.sync_worker import run_async
+
+async def _expire_due_batch(now: datetime) -> int:
+    """
+    یک دسته از کاربران فعالی که زمانشان رسیده را EXPIRED می‌کند (فقط از روی ایندکس status/expire_date)
+    و دستور مسدودی ساب‌اکانت‌هایشان را در همان تراکنش در صف نودها ثبت می‌کند.
+    """
+    async with AsyncSessionLocal() as db:
+        due_ids = (
+            select(GuardinoUser.id)
+            .where(GuardinoUser.status == UserStatus.ACTIVE, GuardinoUser.expire_date <= now)
+            .order_by(GuardinoUser.expire_date)
+            .limit(settings.EXPIRY_BATCH_SIZE)
+            .scalar_subquery()
+        )
+        result = await db.execute(
+            update(GuardinoUser)
+            .where(GuardinoUser.id.in_(due_ids))
+            .values(status=UserStatus.EXPIRED)
+            .returning(GuardinoUser.id)
+        )
+        expired_ids = result.scalars().all()
+        if not expired_ids:
+            return 0
+
+        subs_query = await db.execute(
+            select(SubAccount.node_id, SubAccount.remote_identifier)
+            .where(SubAccount.guardino_user_id.in_(expired_ids))
+        )
+        enqueue_suspends(db, subs_query.all())
+
+        await db.commit()
+        return len(expired_ids)
+
+async def _async_enforce_expiry() -> int:
+    """غیرفعال‌سازی دسته‌ای کاربران منقضی (مسدودی روی نودها توسط ورکر صف دستورات انجام می‌شود)"""
+    async with lease("enforce_expiry", settings.SYNC_LEASE_TTL) as acquired:
+        if not acquired:
+            return 0
+        now = datetime.utcnow()
+        expired = 0
+        while True:
+            batch = await _expire_due_batch(now)
+            if not batch:
+                break
+            expired += batch
+        return expired
+
+@celery_app.task
+def enforce_expiry():
+    """هر دقیقه اجرا می‌شود اما فقط وقتی کاری انجام می‌دهد که انقضای کاربری رسیده باشد"""
+    expired = run_async(_async_enforce_expiry())
+    return f"Expired {expired} users."
@@ -0,0 +1,35 @@
+# app/tasks/health_worker.py
+import asyncio
+from sqlalchemy import select
+from app.core.celery_app import celery_app
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models import Node, NodeStatus
+from app.services.http_pool import get_client
+from app.tasks.sync_worker import run_async
+
+
+async def _probe_node(node: Node):
+    """
+    یک درخواست سبک به آدرس پنل؛ نتیجه و تاخیر آن خودکار در سیستم سلامت ثبت می‌شود
+    و اگر کلید نود باز بوده، پاسخ موفق آن را می‌بندد.
+    """
+    try:
+        await get_client(node).get(node.api_url, timeout=settings.NODE_HEALTH_PROBE_TIMEOUT)
+    except Exception as e:
+        print(f"Health probe failed for node {node.id}: {e}")
+
+
+async def _async_probe_nodes():
+    async with AsyncSessionLocal() as db:
+        query = await db.execute(select(Node).where(Node.status == NodeStatus.ACTIVE))
+        nodes = query.scalars().all()
+    await asyncio.gather(*(_probe_node(node) for node in nodes))
+    return len(nodes)
+
+
+@celery_app.task
+def probe_nodes():
+    """بررسی دوره‌ای در دسترس بودن نودها (حتی وقتی ترافیکی به سمتشان نمی‌رود)"""
+    count = run_async(_async_probe_nodes())
+    return f"Probed {count} nodes."
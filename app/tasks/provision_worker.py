@@ -0,0 +1,206 @@
+# app/tasks/provision_worker.py
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict
+import httpx
+from sqlalchemy import select, update, delete
+from app.core.celery_app import celery_app
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models import (
+    GuardinoUser, UserStatus, SubAccount, Node, Reseller, TransactionLog, TransactionType,
+    ProvisioningJob, ProvisioningJobStatus, NodeCommandAction,
+)
+from app.services.node_factory import NodeFactory
+from app.services.node_commands import create_remote_user, enqueue_command
+from app.services.node_limiter import NodeLimiter
+from app.services.provisioning import NODE_PENDING, NODE_CREATING, NODE_DONE, NODE_FAILED, notify_job_update
+from app.tasks.sync_worker import run_async
+
+
+async def _claim_job(job_id: str) -> bool:
+    """برداشتن انحصاری کار (PENDING -> RUNNING) تا دو ورکر همزمان یک کار را اجرا نکنند"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(ProvisioningJob)
+            .where(ProvisioningJob.id == job_id, ProvisioningJob.status == ProvisioningJobStatus.PENDING)
+            .values(status=ProvisioningJobStatus.RUNNING, started_at=datetime.utcnow(),
+                    attempts=ProvisioningJob.attempts + 1)
+            .returning(ProvisioningJob.id)
+        )
+        claimed = result.scalar_one_or_none() is not None
+        await db.commit()
+    return claimed
+
+
+async def _save_progress(job_id: str, node_results: Dict[str, dict]) -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(ProvisioningJob)
+            .where(ProvisioningJob.id == job_id, ProvisioningJob.status == ProvisioningJobStatus.RUNNING)
+            .values(node_results=node_results)
+        )
+        await db.commit()
+    await notify_job_update(job_id)
+
+
+async def _create_on_node(node: Node, username: str, payload: Dict, adopt_existing: bool) -> Dict:
+    """
+    ساخت کاربر روی یک نود. adopt_existing فقط وقتی درست است که درخواست ساخت قبلی همین کار روی همین نود
+    بی‌جواب مانده (تایم‌اوت یا از بین رفتن ورکر)؛ فقط در این حالت پاسخ 409 یعنی ساخت قبلاً انجام شده است.
+    """
+    try:
+        return await create_remote_user(node, username, payload)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code != 409 or not adopt_existing:
+            raise
+        return await NodeFactory.get_adapter(node).get_user(username)
+
+
+async def _finish_success(job: ProvisioningJob, nodes: Dict[int, Node], created: Dict[int, Dict], node_results: Dict[str, dict]):
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(ProvisioningJob)
+            .where(ProvisioningJob.id == job.id, ProvisioningJob.status == ProvisioningJobStatus.RUNNING)
+            .values(status=ProvisioningJobStatus.SUCCEEDED, node_results=node_results, finished_at=datetime.utcnow())
+            .returning(ProvisioningJob.id)
+        )
+        if result.scalar_one_or_none() is None:
+            return
+
+        for node_id, node in nodes.items():
+            data = created.get(node_id)
+            # لینک ساب بومی از پاسخ ساخت ذخیره می‌شود؛ برای نودهایی که در اجرای قبلی ساخته شده‌اند بعداً خوانده می‌شود
+            sub_url = NodeFactory.get_adapter(node).extract_subscription_link(job.username, data) if isinstance(data, dict) else None
+            db.add(SubAccount(guardino_user_id=job.guardino_user_id, node_id=node_id,
+                              remote_identifier=job.username, subscription_url=sub_url or None))
+
+        await db.execute(
+            update(GuardinoUser).where(GuardinoUser.id == job.guardino_user_id).values(status=UserStatus.ACTIVE)
+        )
+        await db.commit()
+
+
+async def _finish_failure(job: ProvisioningJob, node_results: Dict[str, dict], cleanup_node_ids, error: str):
+    """
+    لغو کامل: حذف کاربران ساخته‌شده (از طریق صف دستورات نودها)، بازگرداندن مبلغ رزروشده و حذف رکورد کاربر.
+    تغییر وضعیت RUNNING -> FAILED در همان تراکنش، بازگشت وجه را یک‌باره می‌کند.
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(ProvisioningJob)
+            .where(ProvisioningJob.id == job.id, ProvisioningJob.status == ProvisioningJobStatus.RUNNING)
+            .values(status=ProvisioningJobStatus.FAILED, node_results=node_results, error=error,
+                    guardino_user_id=None, finished_at=datetime.utcnow())
+            .returning(ProvisioningJob.id)
+        )
+        if result.scalar_one_or_none() is None:
+            return
+
+        # دستور حذف به همین کار گره می‌خورد؛ اگر تا اجرای آن نام کاربری مالک تازه‌ای پیدا کند، لغو می‌شود
+        for node_id in cleanup_node_ids:
+            enqueue_command(db, node_id, NodeCommandAction.DELETE, job.username, {"job_id": job.id})
+
+        if job.total_cost > 0:
+            await db.execute(
+                update(Reseller).where(Reseller.id == job.reseller_id).values(balance=Reseller.balance + job.total_cost)
+            )
+            db.add(TransactionLog(reseller_id=job.reseller_id, amount=job.total_cost, transaction_type=TransactionType.REFUND,
+                                  description=f"بازگشت وجه ساخت ناموفق کاربر {job.username}"))
+
+        await db.execute(delete(GuardinoUser).where(GuardinoUser.id == job.guardino_user_id))
+        await db.commit()
+
+
+async def _async_provision_user(job_id: str) -> str:
+    if not await _claim_job(job_id):
+        return "skipped"
+
+    async with AsyncSessionLocal() as db:
+        job = await db.get(ProvisioningJob, job_id)
+        node_ids = [int(n_id) for n_id in job.node_results]
+        nodes_query = await db.execute(select(Node).where(Node.id.in_(node_ids)))
+        nodes = {n.id: n for n in nodes_query.scalars().all()}
+
+    node_results = {n_id: dict(r) for n_id, r in job.node_results.items()}
+    # maybe_created: درخواست ساخت همین کار به این نود رفته ولی جوابش معلوم نشد (تایم‌اوت، یا ورکر قبلی
+    # وسط ساخت از بین رفته)؛ فقط این نودها می‌توانند 409 را به عنوان کاربر خودشان بپذیرند یا در لغو پاک شوند.
+    # نودی که قبلاً با خطای قطعی (مثلاً 409 از همان ابتدا) رد شده، کاربر هم‌نام متعلق به دیگری دارد.
+    for n_id, r in node_results.items():
+        if r["status"] == NODE_CREATING:
+            r["maybe_created"] = True
+        if r["status"] in (NODE_PENDING, NODE_FAILED):
+            r.update(status=NODE_CREATING, error=None)
+    await _save_progress(job_id, node_results)
+
+    limiter = NodeLimiter(settings.SYNC_MAX_CONCURRENCY, settings.SYNC_NODE_CONCURRENCY)
+    save_lock = asyncio.Lock()
+    created: Dict[int, Dict] = {}
+
+    async def provision(n_id: str):
+        node = nodes.get(int(n_id))
+        try:
+            if node is None:
+                raise ValueError("سرور حذف شده است.")
+            async with limiter.slot(node.id):
+                result = await _create_on_node(node, job.username, job.payload,
+                                               adopt_existing=node_results[n_id].get("maybe_created", False))
+            if isinstance(result, dict) and "detail" in result:
+                raise ValueError(str(result["detail"]))
+            created[node.id] = result
+            node_results[n_id].update(status=NODE_DONE, error=None)
+        except Exception as e:
+            if isinstance(e, httpx.TimeoutException):
+                node_results[n_id]["maybe_created"] = True
+            node_results[n_id].update(status=NODE_FAILED, error=repr(e)[:300])
+        # ذخیره پیشرفت هر نود به محض اتمام (به ترتیب، تا نسخه قدیمی‌تر روی جدیدتر ننشیند)
+        async with save_lock:
+            await _save_progress(job_id, node_results)
+
+    await asyncio.gather(*(provision(n_id) for n_id, r in node_results.items() if r["status"] == NODE_CREATING))
+
+    failed = [n_id for n_id, r in node_results.items() if r["status"] != NODE_DONE]
+    if not failed:
+        await _finish_success(job, nodes, created, node_results)
+    else:
+        # کاربر فقط روی نودهایی حذف می‌شود که این کار واقعاً آن را ساخته (پاسخ موفق) یا شاید ساخته باشد (تایم‌اوت)
+        cleanup = {int(n_id) for n_id, r in node_results.items() if r["status"] == NODE_DONE or r.get("maybe_created")}
+        names = "، ".join(node_results[n_id].get("name") or n_id for n_id in failed)
+        await _finish_failure(job, node_results, cleanup, f"ساخت کاربر روی سرور(های) {names} ناموفق بود.")
+    await notify_job_update(job_id)
+    return "succeeded" if not failed else "failed"
+
+
+@celery_app.task
+def provision_user(job_id: str):
+    """ساخت کاربر روی تمام نودهای انتخاب‌شده (با بازگشت وجه در صورت شکست)"""
+    status = run_async(_async_provision_user(job_id))
+    return f"Provisioning job {job_id}: {status}"
+
+
+async def _async_resume_jobs() -> list:
+    """کارهایی که به ورکر نرسیده‌اند یا ورکرشان وسط کار از بین رفته، دوباره در صف قرار می‌گیرند"""
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(ProvisioningJob)
+            .where(ProvisioningJob.status == ProvisioningJobStatus.RUNNING,
+                   ProvisioningJob.started_at < now - timedelta(seconds=settings.PROVISION_JOB_TIMEOUT))
+            .values(status=ProvisioningJobStatus.PENDING)
+        )
+        query = await db.execute(
+            select(ProvisioningJob.id)
+            .where(ProvisioningJob.status == ProvisioningJobStatus.PENDING,
+                   ProvisioningJob.created_at < now - timedelta(seconds=60))
+        )
+        job_ids = query.scalars().all()
+        await db.commit()
+    return job_ids
+
+
+@celery_app.task
+def resume_provisioning_jobs():
+    job_ids = run_async(_async_resume_jobs())
+    for job_id in job_ids:
+        provision_user.delay(job_id)
+    return f"Resumed {len(job_ids)} provisioning jobs."
@@ -1,78 +1,253 @@
 # app/tasks/sync_worker.py
 import asyncio
+from datetime import datetime, timedelta
+from collections import defaultdict
+from typing import Dict
 from app.core.celery_app import celery_app
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, update, func, and_, or_
 from app.core.database import AsyncSessionLocal
-from app.models import GuardinoUser, UserStatus, SubAccount, Reseller, TransactionLog, TransactionType
+from app.models import GuardinoUser, UserStatus, SubAccount, Reseller, TransactionLog, TransactionType, Node, NodeStatus
 from app.services.node_factory import NodeFactory
+from app.services.http_pool import close_all_clients
+from app.core.redis import close_redis, lease, get_redis
+from app.core.principal_cache import publish_invalidation
+from app.core.config import settings
+from app.services.node_limiter import NodeLimiter
+from app.services.node_health import unavailable_nodes
+from app.services.node_commands import enqueue_suspends
+from app.services.usage_accounting import apply_usage_readings, find_over_quota
+from app.services.usage_history import record_usage_samples, rollup_and_prune
+from app.services.sync_scheduler import next_sync_time
+
+# نقطه بازیابی سینک: آخرین id کاربری که دسته‌اش کامیت شده است
+SYNC_CHECKPOINT_KEY = "guardino:sync:checkpoint"
+SYNC_CHECKPOINT_TTL = 86400
+
+def run_async(coro):
+    """
+    اجرای کوروتین داخل تسک Celery.
+    هر تسک حلقه رویداد مخصوص خودش را دارد، پس کلاینت‌های HTTP و ردیس در پایان همان حلقه بسته می‌شوند.
+    """
+    async def _runner():
+        try:
+            return await coro
+        finally:
+            await close_all_clients()
+            await close_redis()
+    return asyncio.run(_runner())
+
+async def _collect_node_usage(node: Node, limiter: NodeLimiter) -> Dict[str, int]:
+    """
+    مصرف همه کاربران یک نود با چند درخواست صفحه‌بندی‌شده (به جای یک get_user برای هر ساب‌اکانت).
+    صفحه اول تعداد کل را مشخص می‌کند و بقیه صفحات با رعایت سقف همزمانی نود، موازی گرفته می‌شوند.
+    """
+    adapter = NodeFactory.get_adapter(node)
+    page_size = settings.SYNC_PAGE_SIZE
+
+    async def fetch_page(offset: int):
+        async with limiter.slot(node.id):
+            return await adapter.get_users_usage_page(offset, page_size)
+
+    usage, total = await fetch_page(0)
+    if usage and total > page_size:
+        pages = await asyncio.gather(*(fetch_page(offset) for offset in range(page_size, total, page_size)))
+        for page_usage, _ in pages:
+            usage.update(page_usage)
+    return usage
+
+async def _collect_all_usage(nodes: Dict[int, Node], limiter: NodeLimiter) -> Dict[int, Dict[str, int]]:
+    """دریافت همزمان مصرف از همه نودها؛ خطای یک نود فقط همان نود را از این دور حذف می‌کند"""
+    node_ids = list(nodes)
+    results = await asyncio.gather(
+        *(_collect_node_usage(nodes[n_id], limiter) for n_id in node_ids), return_exceptions=True
+    )
+    usage_by_node = {}
+    for n_id, result in zip(node_ids, results):
+        if isinstance(result, Exception):
+            print(f"Error fetching bulk usage from node {n_id}: {result}")
+            continue
+        usage_by_node[n_id] = result
+    return usage_by_node
+
+async def _load_checkpoint() -> int:
+    raw = await get_redis().get(SYNC_CHECKPOINT_KEY)
+    return int(raw) if raw else 0
 
 async def _async_sync_traffic():
     """هسته اصلی چک کردن ترافیک (غیرهمگام)"""
+    async with lease("sync_traffic", settings.SYNC_LEASE_TTL) as acquired:
+        if not acquired:
+            # اجرای قبلی هنوز تمام نشده است
+            return False
+        await _sync_traffic_pass()
+        return True
+
+def _due_filter(now: datetime):
+    """کاربران فعالی که نوبت سینکشان رسیده (صف اولویت روی ایندکس status/next_sync_at)"""
+    return and_(
+        GuardinoUser.status == UserStatus.ACTIVE,
+        or_(GuardinoUser.next_sync_at.is_(None), GuardinoUser.next_sync_at <= now),
+    )
+
+async def _collect_per_user_usage(subs, nodes: Dict[int, Node], per_user_nodes: set, limiter: NodeLimiter) -> Dict[int, Dict[str, int]]:
+    """برای نودهایی که فقط چند کاربر سررسید دارند، مصرف همان چند کاربر تک‌تک (و همزمان) خوانده می‌شود"""
+    usage_by_node = defaultdict(dict)
+
+    async def fetch(node_id: int, remote_identifier: str):
+        try:
+            async with limiter.slot(node_id):
+                used = await NodeFactory.get_adapter(nodes[node_id]).get_user_usage(remote_identifier)
+            if used is not None:
+                usage_by_node[node_id][remote_identifier] = used
+        except Exception as e:
+            print(f"Error fetching usage for {remote_identifier} from node {node_id}: {e}")
+
+    await asyncio.gather(*(fetch(s.node_id, s.remote_identifier) for s in subs if s.node_id in per_user_nodes))
+    return usage_by_node
+
+async def _sync_traffic_pass():
+    limiter = NodeLimiter(settings.SYNC_MAX_CONCURRENCY, settings.SYNC_NODE_CONCURRENCY)
+    now = datetime.utcnow()
+
+    # 1. تعداد ساب‌اکانت‌های سررسید روی هر نود فعال؛ نودهای شلوغ با لیست صفحه‌بندی‌شده و بقیه تک‌تک خوانده می‌شوند
     async with AsyncSessionLocal() as db:
-        # پیدا کردن تمام کاربرانی که وضعیتشان Active است
-        query = await db.execute(
-            select(GuardinoUser)
-            .where(GuardinoUser.status == UserStatus.ACTIVE)
-            .options(selectinload(GuardinoUser.sub_accounts).selectinload(SubAccount.node))
+        query = await db.execute(select(Node).where(Node.status == NodeStatus.ACTIVE))
+        nodes = {node.id: node for node in query.scalars().all()}
+        due_counts_query = await db.execute(
+            select(SubAccount.node_id, func.count(SubAccount.id))
+            .join(GuardinoUser, GuardinoUser.id == SubAccount.guardino_user_id)
+            .where(_due_filter(now))
+            .group_by(SubAccount.node_id)
         )
-        active_users = query.scalars().all()
+        due_counts = dict(due_counts_query.all())
 
-        for user in active_users:
-            total_used_bytes = 0
-            
-            # چک کردن مصرف این کاربر در تک‌تک سرورهای متصل به آن
-            for sub_acc in user.sub_accounts:
-                if sub_acc.node.status != "active":
+    # نودهایی که پنلشان مصرف گزارش نمی‌کند (وایرگارد) اصلاً خوانده نمی‌شوند
+    usage_nodes = {n_id for n_id, node in nodes.items() if NodeFactory.reports_usage(node)}
+    # نودهایی که کلیدشان باز است در این دور خوانده نمی‌شوند (بدون هدر دادن زمان روی تایم‌اوت)
+    down_nodes = await unavailable_nodes(nodes)
+    readable = {n_id for n_id in due_counts if n_id in usage_nodes and n_id not in down_nodes}
+    bulk_nodes = {n_id: nodes[n_id] for n_id in readable if due_counts[n_id] > settings.SYNC_BULK_THRESHOLD}
+    per_user_nodes = readable - set(bulk_nodes)
+    bulk_usage = await _collect_all_usage(bulk_nodes, limiter)
+
+    # 2. پیمایش کاربران سررسید به صورت دسته‌ای (Keyset روی id)؛ اگر اجرای قبلی نیمه‌کاره مانده، از همان‌جا ادامه می‌دهیم
+    last_user_id = await _load_checkpoint()
+    while True:
+        async with AsyncSessionLocal() as db:
+            # فقط ستون‌های لازم خوانده می‌شوند (بدون ساخت آبجکت‌های ORM)
+            users_query = await db.execute(
+                select(GuardinoUser.id, GuardinoUser.username, GuardinoUser.reseller_id,
+                       GuardinoUser.used_traffic, GuardinoUser.purchased_data_limit, GuardinoUser.last_synced_at)
+                .where(_due_filter(now), GuardinoUser.id > last_user_id)
+                .order_by(GuardinoUser.id)
+                .limit(settings.SYNC_BATCH_SIZE)
+            )
+            users = users_query.all()
+            if not users:
+                break
+            user_ids = [u.id for u in users]
+
+            subs_query = await db.execute(
+                select(SubAccount.id, SubAccount.guardino_user_id, SubAccount.node_id,
+                       SubAccount.remote_identifier, SubAccount.last_raw_traffic)
+                .where(SubAccount.guardino_user_id.in_(user_ids))
+            )
+            subs = subs_query.all()
+            per_user_usage = await _collect_per_user_usage(subs, nodes, per_user_nodes, limiter)
+
+            # اتصال شمارنده‌های دریافت‌شده از هر نود به ساب‌اکانت‌ها (در حافظه)
+            # کاربرانی که حتی یک ساب‌اکانتشان (روی نود فعالی که باید مصرف گزارش کند) خوانده نشد:
+            # نود قطع، خطای صفحه یا خطای درخواست تکی
+            readings = {}
+            touched_users = set()
+            unread_users = set()
+            for sub in subs:
+                if sub.node_id not in usage_nodes:
                     continue
-                    
-                try:
-                    adapter = NodeFactory.get_adapter(sub_acc.node)
-                    # دریافت اطلاعات کاربر از پنل بومی
-                    remote_user_data = await adapter.get_user(sub_acc.remote_identifier)
-                    
-                    # استخراج مصرف بر اساس نوع پنل
-                    used_traffic = 0
-                    if sub_acc.node.panel_type == "marzban":
-                        used_traffic = remote_user_data.get("used_traffic", 0)
-                    elif sub_acc.node.panel_type == "pasarguard":
-                        used_traffic = remote_user_data.get("used_traffic", 0) # فرض بر تشابه فیلد
-                        
-                    # آپدیت آخرین مصرفِ این ساب‌اکانت در دیتابیس خودمان
-                    sub_acc.used_traffic = used_traffic
-                    total_used_bytes += used_traffic
-                    
-                except Exception as e:
-                    print(f"Error fetching usage for {user.username} from node {sub_acc.node.id}: {e}")
-
-            # بررسی اینکه آیا مجموع مصرف از حجم خریداری شده بیشتر شده است؟
-            if total_used_bytes >= user.purchased_data_limit:
-                # 1. تغییر وضعیت در گاردینو
-                user.status = UserStatus.DISABLED
-                
-                # 2. ارسال دستور مسدودی به تمام نودهای متصل
-                for sub_acc in user.sub_accounts:
-                    if sub_acc.node.status == "active":
-                        try:
-                            adapter = NodeFactory.get_adapter(sub_acc.node)
-                            await adapter.suspend_user(sub_acc.remote_identifier)
-                        except Exception as e:
-                            print(f"Failed to suspend {user.username} on node {sub_acc.node.id}: {e}")
-                            
-        await db.commit()
+                # نقشه خالی هم پاسخ نود است؛ فقط نبود کلید یعنی این نود در این دور خوانده نشده
+                node_usage = bulk_usage.get(sub.node_id)
+                if node_usage is None:
+                    node_usage = per_user_usage.get(sub.node_id)
+                if node_usage is None or sub.remote_identifier not in node_usage:
+                    unread_users.add(sub.guardino_user_id)
+                    continue
+                raw = node_usage[sub.remote_identifier]
+                # ساب‌اکانت‌هایی که شمارنده‌شان تغییری نکرده اصلاً نوشته نمی‌شوند
+                if raw != sub.last_raw_traffic:
+                    readings[sub.id] = raw
+                    touched_users.add(sub.guardino_user_id)
+
+            # نوشتن دسته‌ای دلتاها و بازمحاسبه مجموع مصرف همین کاربران + ثبت نمونه در تاریخچه مصرف
+            deltas = await apply_usage_readings(db, readings, touched_users)
+            await record_usage_samples(db, deltas, {u.id: u.reseller_id for u in users})
+
+            # نوبت بعدی هر کاربر بر اساس حجم باقی‌مانده و سرعت مصرف
+            # کاربرانی که مصرفشان کامل خوانده نشد، بدون جلو بردن last_synced_at در اولین فرصت دوباره چک می‌شوند
+            # (وگرنه دلتای صفر آن‌ها را تا SYNC_MAX_INTERVAL از چک سهمیه عقب می‌انداخت)
+            synced_at = datetime.utcnow()
+            retry_at = synced_at + timedelta(seconds=settings.SYNC_MIN_INTERVAL)
+            await db.execute(update(GuardinoUser), [
+                {
+                    "id": u.id,
+                    "last_synced_at": u.last_synced_at if u.id in unread_users else synced_at,
+                    "next_sync_at": retry_at if u.id in unread_users else next_sync_time(
+                        synced_at, (u.used_traffic or 0) + deltas.get(u.id, 0), u.purchased_data_limit,
+                        deltas.get(u.id, 0), u.last_synced_at,
+                    ),
+                }
+                for u in users
+            ])
+
+            # چک سهمیه فقط از روی مجموع پیش‌محاسبه‌شده هر کاربر
+            over_quota_users = await find_over_quota(db, user_ids)
+            if over_quota_users:
+                over_quota_ids = {u.id for u in over_quota_users}
+                await db.execute(
+                    update(GuardinoUser)
+                    .where(GuardinoUser.id.in_(over_quota_ids))
+                    .values(status=UserStatus.DISABLED)
+                )
+                # دستور مسدودی روی تمام نودهای متصل در همین تراکنش در صف ثبت می‌شود (اجرا با تلاش مجدد توسط ورکر صف)
+                enqueue_suspends(db, [
+                    (sub.node_id, sub.remote_identifier) for sub in subs if sub.guardino_user_id in over_quota_ids
+                ])
+
+            await db.commit()
+
+        # ثبت نقطه بازیابی بعد از هر دسته
+        last_user_id = users[-1].id
+        await get_redis().set(SYNC_CHECKPOINT_KEY, last_user_id, ex=SYNC_CHECKPOINT_TTL)
+
+    # دور کامل شد؛ دور بعدی از ابتدا شروع می‌شود
+    await get_redis().delete(SYNC_CHECKPOINT_KEY)
 
 @celery_app.task
 def sync_all_traffic():
     """تسک زمان‌بندی شده برای چک کردن ترافیک که توسط Celery Beat صدا زده می‌شود"""
-    asyncio.run(_async_sync_traffic())
+    if not run_async(_async_sync_traffic()):
+        return "Traffic sync skipped: previous pass still running."
     return "Traffic sync completed."
 
 
+
+async def _async_rollup_usage():
+    async with AsyncSessionLocal() as db:
+        await rollup_and_prune(db)
+        await db.commit()
+
+@celery_app.task
+def rollup_usage_history():
+    """تجمیع ساعتی/روزانه تاریخچه مصرف و حذف نمونه‌های خام قدیمی"""
+    run_async(_async_rollup_usage())
+    return "Usage history rolled up."
+
+
 async def _async_deduct_fees():
     """کسر حق اشتراک روزانه نمایندگان"""
     async with AsyncSessionLocal() as db:
         query = await db.execute(select(Reseller).where(Reseller.daily_subscription_fee > 0))
         resellers = query.scalars().all()
+        locked_ids = []
         
         for reseller in resellers:
             reseller.balance -= reseller.daily_subscription_fee
@@ -88,10 +263,15 @@ async def _async_deduct_fees():
             # اگر موجودی منفی شد، پنل نماینده قفل می‌شود
             if reseller.balance < 0 and reseller.status == "active":
                 reseller.status = "locked"
+                locked_ids.append(reseller.id)
                 
         await db.commit()
 
+    # کش نماینده در پروسه‌های API باطل می‌شود تا قفل شدن فوراً اعمال شود
+    for reseller_id in locked_ids:
+        await publish_invalidation(reseller_id)
+
 @celery_app.task
 def deduct_daily_fees():
-    asyncio.run(_async_deduct_fees())
+    run_async(_async_deduct_fees())
     return "Daily fees deducted."
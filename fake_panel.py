@@ -0,0 +1,162 @@
+# fake_panel.py
+"""
+پنل جایگزین محلی (شبیه مرزبان) برای تست گاردینو بدون سرور واقعی.
+
+اجرای پنل:
+    python fake_panel.py serve --port 9000 --guardino http://localhost:8000 --node-id 1 --secret my_secret
+بازپخش رخدادهای وب‌هوک ذخیره‌شده:
+    python fake_panel.py replay events.json --guardino http://localhost:8000 --node-id 1 --secret my_secret
+
+fake_panel_events.json نمونه‌ای برای بازپخش است: رخداد تکراری، رخداد قدیمی‌ترِ رسیده بعد از رخداد جدید،
+ریست مصرف و رخدادهای وضعیت (برای کاربر demo_user که باید قبلاً روی همین نود ساخته شده باشد).
+"""
+import argparse
+import asyncio
+import base64
+import json
+import time
+from datetime import datetime, timedelta
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from jose import jwt
+
+app = FastAPI(title="Guardino Fake Panel")
+USERS: dict = {}
+WEBHOOK = {"url": None, "secret": None}
+
+
+async def push_events(events: list):
+    """ارسال رخدادها به گاردینو با همان قالب و هدر وب‌هوک مرزبان"""
+    if not WEBHOOK["url"]:
+        return
+    async with httpx.AsyncClient() as client:
+        resp = await client.post(WEBHOOK["url"], json=events, headers={"x-webhook-secret": WEBHOOK["secret"] or ""})
+        print(f"webhook -> {resp.status_code} {resp.text}")
+
+
+def _event(action: str, user: dict) -> dict:
+    now = time.time()
+    return {"action": action, "username": user["username"], "user": user, "enqueued_at": now, "send_at": now, "tries": 0}
+
+
+@app.post("/api/admin/token")
+async def admin_token():
+    token = jwt.encode({"sub": "admin", "exp": datetime.utcnow() + timedelta(hours=1)}, "fake", algorithm="HS256")
+    return {"access_token": token, "token_type": "bearer"}
+
+
+@app.get("/api/inbounds")
+async def inbounds():
+    return {"vless": [{"tag": "VLESS TCP"}], "vmess": [{"tag": "VMESS TCP"}], "trojan": [{"tag": "TROJAN TCP"}]}
+
+
+@app.post("/api/user")
+async def create_user(request: Request):
+    data = await request.json()
+    username = data["username"]
+    if username in USERS:
+        raise HTTPException(status_code=409, detail="User already exists")
+    USERS[username] = {
+        "username": username, "status": "active", "used_traffic": 0,
+        "data_limit": data.get("data_limit"), "expire": data.get("expire"),
+        "subscription_url": f"{request.base_url}sub/{username}",
+    }
+    return USERS[username]
+
+
+@app.get("/api/user/{username}")
+async def get_user(username: str):
+    if username not in USERS:
+        raise HTTPException(status_code=404, detail="User not found")
+    return USERS[username]
+
+
+@app.put("/api/user/{username}")
+async def modify_user(username: str, request: Request):
+    if username not in USERS:
+        raise HTTPException(status_code=404, detail="User not found")
+    old_status = USERS[username]["status"]
+    USERS[username].update(await request.json())
+    # مثل مرزبان، تغییر وضعیت کاربر به صورت رخداد جدا گزارش می‌شود
+    new_status = USERS[username]["status"]
+    if new_status != old_status:
+        action = {"active": "user_enabled", "disabled": "user_disabled", "expired": "user_expired", "limited": "user_limited"}.get(new_status)
+        if action:
+            await push_events([_event(action, USERS[username])])
+    return USERS[username]
+
+
+@app.delete("/api/user/{username}")
+async def delete_user(username: str):
+    user = USERS.pop(username, None)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    await push_events([_event("user_deleted", user)])
+    return {"detail": "User successfully deleted"}
+
+
+@app.get("/api/users")
+async def list_users(offset: int = 0, limit: int = 100):
+    users = list(USERS.values())
+    return {"users": users[offset:offset + limit], "total": len(users)}
+
+
+@app.get("/sub/{username}", response_class=PlainTextResponse)
+async def subscription(username: str):
+    if username not in USERS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    link = f"vless://00000000-0000-0000-0000-000000000001@127.0.0.1:443?type=tcp#{username}"
+    return base64.b64encode(link.encode("utf-8")).decode("utf-8")
+
+
+@app.post("/fake/traffic/{username}")
+async def add_traffic(username: str, bytes: int):
+    """شبیه‌سازی مصرف: حجم به کاربر اضافه و رخداد آن به گاردینو ارسال می‌شود"""
+    if username not in USERS:
+        raise HTTPException(status_code=404, detail="User not found")
+    USERS[username]["used_traffic"] += bytes
+    await push_events([_event("user_updated", USERS[username])])
+    return USERS[username]
+
+
+@app.post("/fake/reset/{username}")
+async def reset_traffic(username: str):
+    """شبیه‌سازی ریست مصرف توسط ادمین پنل"""
+    if username not in USERS:
+        raise HTTPException(status_code=404, detail="User not found")
+    USERS[username]["used_traffic"] = 0
+    await push_events([_event("data_usage_reset", USERS[username])])
+    return USERS[username]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Guardino fake panel")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve = sub.add_parser("serve")
+    serve.add_argument("--port", type=int, default=9000)
+    replay = sub.add_parser("replay")
+    replay.add_argument("events_file")
+    for p in (serve, replay):
+        p.add_argument("--guardino", default="http://localhost:8000")
+        p.add_argument("--node-id", type=int)
+        p.add_argument("--secret")
+
+    args = parser.parse_args()
+    if args.node_id is not None:
+        WEBHOOK["url"] = f"{args.guardino.rstrip('/')}/api/v1/ingest/{args.node_id}"
+        WEBHOOK["secret"] = args.secret
+
+    if args.command == "serve":
+        uvicorn.run(app, host="0.0.0.0", port=args.port)
+    else:
+        with open(args.events_file, encoding="utf-8") as f:
+            events = json.load(f)
+        asyncio.run(push_events(events if isinstance(events, list) else [events]))
+
+
+if __name__ == "__main__":
+    main()
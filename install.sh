@@ -178,6 +178,8 @@ async def init():
     print('✅ Tables Created Successfully!')
 asyncio.run(init())
 "
+# جداول تازه با مدل فعلی ساخته شده‌اند؛ همه مایگریشن‌ها اعمال‌شده علامت می‌خورند تا upgrade بعدی فقط تغییرات جدید را اجرا کند
+docker exec guardino_api alembic stamp head
 
 echo -e "\n${YELLOW}👑 Creating Super Admin...${NC}"
 docker exec guardino_api python create_superadmin.py